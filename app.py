@@ -1,24 +1,133 @@
 import asyncio
+import base64
+import hashlib
+import itertools
 import json
-from time import time
+import math
+import mimetypes
+import os
+from collections import defaultdict
 
-from quart import Quart, abort, jsonify, render_template, request
+from quart import (
+    Quart,
+    Response,
+    abort,
+    g,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+)
 
-from pocketpal.audio import get_full_url, text_to_audio
+from pocketpal.audio import (
+    AUDIO_VARIANTS,
+    OUTPUT_FORMAT,
+    VOICES,
+    audio_codec,
+    audio_service,
+    synthesize,
+)
+from pocketpal.audio_cache import AudioCache
+from pocketpal.cache import ReadThroughCache, make_shared_store
+from pocketpal import db
+from pocketpal.context import build_context, load_encoding
 from pocketpal.db import (
     AsyncSessionFactory,
+    checkout,
     query,
     query_one,
-    query_scalar,
     query_with_session,
+    statement,
+)
+from pocketpal.events import Notifier
+from pocketpal.gateway import current_priority
+from pocketpal.jobs import (
+    AUDIO_WORKERS,
+    GENERATION_DEPTH,
+    PRIORITY_SPECULATIVE,
+    PRIORITY_USER,
+    GenerationQueue,
+    Job,
+    make_audio_job_store,
+    make_job_store,
+)
+from pocketpal.llm import (
+    GenerationError,
+    generate_new_branch,
+    generate_new_story_info,
+    generate_sibling_branches,
+    openai_prompt_stream,
+)
+from pocketpal.metrics import Span, flush_traces, registry, span
+from pocketpal.prompts import get_branch_prompt
+from pocketpal.singleflight import SingleFlight
+from pocketpal.starters import (
+    STARTER_LANGUAGES,
+    STARTER_POOL_DEPTH,
+    STARTER_POOL_SIZE,
+    STARTER_PREMISES,
+    STARTER_REFILL_INTERVAL,
+    missing_starters,
+    pick_category,
+    random_premise,
+    starter_requests,
 )
-from pocketpal.llm import openai_prompt
-from pocketpal.prompts import get_continue_prompt, get_final_prompt, get_initial_prompt
-from pocketpal.utils import base62
+from pocketpal.storage import storage
+from pocketpal.utils import new_id, split_sentences
 
 MAX_STORY_LENGTH = 10000  # Approximately 10 branches deep.
+# Sentences are batched up to this length before being sent to TTS.
+MIN_TTS_CHUNK_LENGTH = 40
+# Longest a client can ask get_branch to wait for generation to finish.
+MAX_BRANCH_WAIT_SECONDS = 30
+# Stories end after MAX_STORY_LENGTH, so no tree is deeper than this.
+MAX_TREE_DEPTH = 100
+# Random characters of the story ID that start the IDs of its branches, so
+# a story's branches sit together in the indexes. 0 orders them by time.
+BRANCH_ID_STORY_PREFIX = int(os.getenv("BRANCH_ID_STORY_PREFIX", 0))
+# Branches generating for longer than this are assumed to be stuck.
+BRANCH_STALE_SECONDS = int(os.getenv("BRANCH_STALE_SECONDS", 300))
+STALE_SWEEP_INTERVAL = int(os.getenv("STALE_SWEEP_INTERVAL", 60))
+# How long shutdown waits for running generation jobs. Cloud Run kills the
+# container 10 seconds after asking it to stop.
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", 7))
+# Write speculative sibling branches in one LLM call, sharing the story's
+# tokens.
+BATCH_SIBLINGS = os.getenv("BATCH_SIBLINGS", "1") == "1"
+# How often branch event streams re-read the branch, to notice changes made
+# by other replicas.
+BRANCH_EVENTS_POLL_SECONDS = float(os.getenv("BRANCH_EVENTS_POLL_SECONDS", 2))
+# Longest a branch event stream stays open.
+BRANCH_EVENTS_TIMEOUT = 120
+# Audio that HLS players take as segments without a container.
+HLS_CONTENT_TYPES = ("audio/mpeg",)
+BRANCH_CACHE_SIZE = int(os.getenv("BRANCH_CACHE_SIZE", 10000))
+STORY_CACHE_SIZE = int(os.getenv("STORY_CACHE_SIZE", 1000))
+# Recent stories, and the branches down to this depth, loaded into the
+# caches on startup. Pooled starter stories are always loaded.
+WARM_CACHE_STORIES = int(os.getenv("WARM_CACHE_STORIES", 200))
+WARM_CACHE_DEPTH = int(os.getenv("WARM_CACHE_DEPTH", 4))
 
 app = Quart(__name__)
+audio_cache = AudioCache(storage)
+# Concurrent work on the same branch within this process runs only once.
+content_flight = SingleFlight()
+children_flight = SingleFlight()
+sibling_flight = SingleFlight()
+# Wakes up branch event streams when a branch changes status.
+branch_changes = Notifier()
+# Set when a starter story is handed out, to refill the pool right away.
+starter_refill_needed = asyncio.Event()
+# Stories and finished branches never change, so they are served from
+# memory (and the optional shared tier) once they have been read.
+shared_cache_store = make_shared_store()
+branch_cache = ReadThroughCache("branch", BRANCH_CACHE_SIZE, store=shared_cache_store)
+story_cache = ReadThroughCache("story", STORY_CACHE_SIZE, store=shared_cache_store)
+
+
+class BranchLockError(Exception):
+    """Raised when another worker has already claimed a branch."""
 
 
 # Entrypoint for visitors to the app
@@ -29,80 +138,222 @@ async def index(story_id=None):
     return await render_template("index.html")
 
 
+@app.before_request
+async def start_request_span():
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    g.request_span = Span("request", f"{request.method} {rule}").start()
+
+
+@app.after_request
+async def finish_request_span(response):
+    request_span = g.get("request_span")
+    if request_span is not None:
+        request_span.finish(str(response.status_code))
+        g.request_span = None
+    return response
+
+
+def finish_span_after(events):
+    """
+    Keep timing the request until its streamed body ends, rather than until
+    the handler returns the response.
+    """
+    request_span = g.pop("request_span", None)
+    if request_span is None:
+        return events
+    request_span.detach()
+
+    async def timed_events():
+        outcome = "200"
+        try:
+            async for event in events:
+                yield event
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            request_span.finish(outcome)
+
+    return timed_events()
+
+
+@app.route("/metrics")
+async def metrics():
+    """Stage latency histograms in the Prometheus text format."""
+    return registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@app.route("/audio/<path:blob_name>")
+async def get_audio(blob_name):
+    """
+    Serve audio blobs when they are stored locally instead of in GCS. Blobs
+    are content addressed, so they are cached as immutable, and single byte
+    ranges are supported so that playback can start from partial content.
+    """
+    if not hasattr(storage, "open"):
+        # Blobs in GCS are downloaded from the bucket.
+        abort(404)
+    try:
+        blob = await storage.open(blob_name)
+    except (FileNotFoundError, IsADirectoryError, ValueError):
+        abort(404)
+
+    headers = {
+        "ETag": f'"{blob.etag}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "Content-Type": mimetypes.guess_type(blob_name)[0] or "application/octet-stream",
+    }
+    if request.if_none_match.contains(blob.etag):
+        return "", 304, headers
+
+    start, stop, status = 0, blob.size, 200
+    byte_range = request.range
+    if (
+        byte_range is not None
+        and len(byte_range.ranges) == 1
+        and (not request.if_range or request.if_range.etag == blob.etag)
+    ):
+        satisfiable = byte_range.range_for_length(blob.size)
+        if satisfiable is None:
+            return "", 416, {**headers, "Content-Range": f"bytes */{blob.size}"}
+        start, stop = satisfiable
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{blob.size}"
+
+    headers["Content-Length"] = str(stop - start)
+    return Response(blob.chunks(start, stop), status, headers)
+
+
 @app.route("/v1/stories/", methods=["POST"])
 async def create_story():
     """Create a new story"""
     data = await request.get_json()
     story_premise = data.get("initial_prompt")
 
+    try:
+        story_json, initial_branch_json = await create_new_story(story_premise)
+    except GenerationError as e:
+        app.logger.error(f"Failed to generate story: {e!r}")
+        abort(502, "Could not generate a story, please try again.")
+
+    await queue_first_choices(story_json, initial_branch_json)
+    return jsonify({"story": story_json, "initial_branch": initial_branch_json})
+
+
+@app.route("/v1/stories/starter", methods=["POST"])
+async def start_starter_story():
+    """
+    Hand out a pre-generated story in the requested language ("lang", "en"
+    by default) and premise category ("category", any by default), which
+    along with its first choices is ready right away. When the pool has run
+    dry, a story is generated from one of the category's premises instead.
+    """
+    data = await request.get_json(silent=True) or {}
+    language = data.get("lang", "en")
+    category = data.get("category")
+    if language not in VOICES:
+        abort(400, f"Language {language} is not supported")
+    if category is not None and category not in STARTER_PREMISES:
+        abort(400, f"Unknown category {category}")
+
+    story = await db.claim_starter(language, category)
+    # Top the pool back up without waiting for the next refill.
+    starter_refill_needed.set()
+    if story:
+        starter_requests.inc(outcome="hit")
+        story_json = story_to_json(story)
+        initial_branch = await db.get_branch(story.initial_branch_id)
+        return jsonify(
+            {"story": story_json, "initial_branch": branch_to_json(initial_branch)}
+        )
+
+    starter_requests.inc(outcome="miss")
+    app.logger.warning(
+        f"Starter pool empty, generating a story: lang={language}, category={category}"
+    )
+    premise = random_premise(pick_category(category))
+    try:
+        story_json, initial_branch_json = await create_new_story(premise, language)
+    except GenerationError as e:
+        app.logger.error(f"Failed to generate story: {e!r}")
+        abort(502, "Could not generate a story, please try again.")
+
+    await queue_first_choices(story_json, initial_branch_json)
+    return jsonify({"story": story_json, "initial_branch": initial_branch_json})
+
+
+async def create_new_story(story_premise, language=None, use_cache=True):
+    """
+    Generate a story with its initial branch and store it, along with the
+    empty rows of its first two choices. Returns the story and the initial
+    branch as JSON. Raises GenerationError if the LLM failed.
+    """
     # Generate content for initial branch
-    llm_start = time()
-    json_from_llm = await openai_prompt(get_initial_prompt(story_premise))
-    llm_duration = time() - llm_start
+    with span("generate", "story_info") as llm_span:
+        story_info = await generate_new_story_info(story_premise, language, use_cache)
     app.logger.info(
-        f"LLM generated content for new story in {llm_duration:.2f} seconds"
+        f"LLM generated content for new story in {llm_span.duration:.2f} seconds"
     )
-    try:
-        story_info = json.loads(json_from_llm)
-    except json.JSONDecodeError:
-        app.logger.error(f"Failed to parse JSON: {json_from_llm}")
-        raise
-    assert story_info["lang"]
-    assert story_info["title"]
-    assert story_info["description"]
-    assert story_info["paragraph"]
 
     # Generate IDs
-    story_id = base62(10)
-    initial_branch_id = base62(10)
-    positive_branch_id = base62(10)
-    negative_branch_id = base62(10)
+    story_id = new_id()
+    initial_branch_id = new_branch_id(story_id)
+    positive_branch_id = new_branch_id(story_id)
+    negative_branch_id = new_branch_id(story_id)
     app.logger.info(
         f"Creating new story: story_id={story_id}, initial_branch_id={initial_branch_id}"
     )
 
     # Generate audio before the transaction
-    audio_url = f"audios/{story_id}_{initial_branch_id}.mp3"
-    tts_start = time()
-    await text_to_audio(story_info["lang"], story_info["paragraph"], audio_url)
-    tts_duration = time() - tts_start
+    with span("generate", "story_audio") as tts_span:
+        audio_url, audio_variants = await asyncio.gather(
+            audio_cache.text_to_audio(story_info.lang, story_info.paragraph),
+            audio_cache.text_to_variants(story_info.lang, story_info.paragraph),
+        )
     app.logger.info(
-        f"Audio generated for story_id={story_id}, initial_branch_id={initial_branch_id} in {tts_duration:.2f} seconds"
+        f"Audio generated for story_id={story_id}, initial_branch_id={initial_branch_id} in {tts_span.duration:.2f} seconds"
     )
 
     # Create story and branches within a single transaction
     async with AsyncSessionFactory() as session:
         try:
+            await checkout(session)
             # Create story and all branches in a single query
             await query_with_session(
                 session,
-                """
+                statement(
+                    "create_story",
+                    """
                 WITH story_insert AS (
                     INSERT INTO stories (story_id, initial_branch_id, title, description, initial_prompt, lang)
                     VALUES (:story_id, :initial_branch_id, :title, :description, :initial_prompt, :lang)
                 ),
                 initial_branch_insert AS (
                     INSERT INTO branches
-                    (branch_id, story_id, previous_branch_id, status, sentiment, audio_url, paragraph, positive_branch_id, negative_branch_id)
-                    VALUES (:initial_branch_id, :story_id, NULL, 'done', 'initial_branch', :audio_url, :paragraph, :positive_branch_id, :negative_branch_id)
+                    (branch_id, story_id, previous_branch_id, status, sentiment, audio_url, audio_variants, paragraph, positive_branch_id, negative_branch_id, depth, story_prefix, story_length)
+                    VALUES (:initial_branch_id, :story_id, NULL, 'done', 'initial_branch', :audio_url, CAST(:audio_variants AS JSONB), :paragraph, :positive_branch_id, :negative_branch_id, 1, :paragraph, :story_length)
                 ),
                 positive_branch_insert AS (
                     INSERT INTO branches
-                    (branch_id, story_id, previous_branch_id, status, sentiment)
-                    VALUES (:positive_branch_id, :story_id, :initial_branch_id, 'new', 'positive')
+                    (branch_id, story_id, previous_branch_id, status, sentiment, depth)
+                    VALUES (:positive_branch_id, :story_id, :initial_branch_id, 'new', 'positive', 2)
                 )
                 INSERT INTO branches
-                (branch_id, story_id, previous_branch_id, status, sentiment)
-                VALUES (:negative_branch_id, :story_id, :initial_branch_id, 'new', 'negative')
+                (branch_id, story_id, previous_branch_id, status, sentiment, depth)
+                VALUES (:negative_branch_id, :story_id, :initial_branch_id, 'new', 'negative', 2)
                 """,
+                ),
                 story_id=story_id,
                 initial_branch_id=initial_branch_id,
-                title=story_info["title"],
-                description=story_info["description"],
+                title=story_info.title,
+                description=story_info.description,
                 initial_prompt=story_premise,
-                lang=story_info["lang"],
+                lang=story_info.lang,
                 audio_url=audio_url,
-                paragraph=story_info["paragraph"],
+                audio_variants=json.dumps(audio_variants),
+                paragraph=story_info.paragraph,
+                story_length=len(story_info.paragraph),
                 positive_branch_id=positive_branch_id,
                 negative_branch_id=negative_branch_id,
             )
@@ -116,44 +367,61 @@ async def create_story():
         f"DB insertions completed for story_id={story_id}, initial_branch_id={initial_branch_id}"
     )
 
-    # TODO: Asynchronously kick off generation of text for the initial branch
+    story_json = {
+        "id": story_id,
+        "initial_branch_id": initial_branch_id,
+        "title": story_info.title,
+        "description": story_info.description,
+        "initial_prompt": story_premise,
+        "lang": story_info.lang,
+    }
+    initial_branch_json = {
+        "id": initial_branch_id,
+        "story_id": story_id,
+        "previous_branch_id": None,
+        "status": "done",
+        "sentiment": "initial_branch",
+        "audio_url": storage.url(audio_url),
+        "audio_variants": variant_urls(audio_variants),
+        "paragraph": story_info.paragraph,
+        "positive_branch_id": positive_branch_id,
+        "negative_branch_id": negative_branch_id,
+        "final_branch": False,
+    }
+    await story_cache.set(story_id, story_json)
+    await branch_cache.set(initial_branch_id, initial_branch_json)
 
-    return jsonify(
-        {
-            "story": {
-                "id": story_id,
-                "initial_branch_id": initial_branch_id,
-                "title": story_info["title"],
-                "description": story_info["description"],
-                "initial_prompt": story_premise,
-                "lang": story_info["lang"],
-            },
-            "initial_branch": {
-                "id": initial_branch_id,
-                "story_id": story_id,
-                "previous_branch_id": None,
-                "status": "done",
-                "sentiment": "initial_branch",
-                "audio_url": get_full_url(audio_url),
-                "paragraph": story_info["paragraph"],
-                "positive_branch_id": positive_branch_id,
-                "negative_branch_id": negative_branch_id,
-                "final_branch": False,
-            },
-        }
-    )
+    return story_json, initial_branch_json
+
+
+async def queue_first_choices(story_json, initial_branch_json):
+    """Generate the first two choices in the background while the intro plays."""
+    for sentiment in ("positive", "negative"):
+        await generation_queue.enqueue(
+            story_json["id"],
+            initial_branch_json[f"{sentiment}_branch_id"],
+            PRIORITY_SPECULATIVE,
+            depth=1,
+        )
 
 
 @app.route("/v1/stories/<story_id>/")
 async def get_story(story_id):
     """Get story details"""
+    cached = await story_cache.get(story_id)
+    if cached:
+        return jsonify(cached)
+
     app.logger.info(f"Fetching story: story_id={story_id}")
     story = await query_one(
-        """
+        statement(
+            "get_story",
+            """
         SELECT story_id, initial_branch_id, title, description, initial_prompt, lang
         FROM stories
         WHERE story_id = :story_id
         """,
+        ),
         story_id=story_id,
     )
 
@@ -161,34 +429,116 @@ async def get_story(story_id):
         app.logger.warning(f"Story not found: story_id={story_id}")
         abort(404, f"Story {story_id} does not exist!")
 
-    return jsonify(
-        {
-            "id": story.story_id,
-            "initial_branch_id": story.initial_branch_id,
-            "title": story.title,
-            "description": story.description,
-            "initial_prompt": story.initial_prompt,
-            "lang": story.lang,
-        }
+    story_json = story_to_json(story)
+    await story_cache.set(story_id, story_json)
+    return jsonify(story_json)
+
+
+@app.route("/v1/stories/<story_id>/tree")
+async def get_tree(story_id):
+    """
+    Get every branch in a subtree as an adjacency list, without generating
+    anything. "root" defaults to the initial branch and "depth" limits how
+    many levels below it are included.
+    """
+    root_id = request.args.get("root")
+    max_depth = request.args.get("depth", type=int)
+    if max_depth is None or max_depth < 0:
+        max_depth = MAX_TREE_DEPTH
+
+    result = await query(
+        statement(
+            "get_tree",
+            """
+        WITH root AS (
+            SELECT branch_id, depth
+            FROM branches
+            WHERE story_id = :story_id
+            AND branch_id = COALESCE(
+                :root_id,
+                (SELECT initial_branch_id FROM stories WHERE story_id = :story_id)
+            )
+        )
+        SELECT b.branch_id, b.previous_branch_id, b.status, b.sentiment, b.audio_url,
+            b.positive_branch_id, b.negative_branch_id, b.final_branch, b.depth,
+            root.branch_id AS root_id
+        FROM branches b, root
+        WHERE b.story_id = :story_id
+        AND b.depth BETWEEN root.depth AND root.depth + :max_depth
+        """,
+        ),
+        story_id=story_id,
+        root_id=root_id,
+        max_depth=max_depth,
     )
+    rows = result.fetchall()
+    if not rows:
+        abort(404, f"Branch {root_id or 'root'} of story {story_id} does not exist!")
+
+    # The query returns every branch of the story within the depth range, so
+    # keep only those that descend from the root.
+    children = defaultdict(list)
+    for row in rows:
+        children[row.previous_branch_id].append(row)
+    root_id = rows[0].root_id
+    subtree = [row for row in rows if row.branch_id == root_id]
+    for row in subtree:
+        subtree.extend(children[row.branch_id])
+
+    payload = {
+        "story_id": story_id,
+        "root": root_id,
+        "branches": [
+            {
+                "id": row.branch_id,
+                "previous_branch_id": row.previous_branch_id,
+                "status": row.status,
+                "sentiment": row.sentiment,
+                "audio_url": storage.url(row.audio_url) if row.audio_url else None,
+                "positive_branch_id": row.positive_branch_id,
+                "negative_branch_id": row.negative_branch_id,
+                "final_branch": row.final_branch,
+                "depth": row.depth,
+            }
+            for row in subtree
+        ],
+    }
+    etag = hashlib.sha1(
+        json.dumps(payload, sort_keys=True).encode(), usedforsecurity=False
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route("/v1/stories/<story_id>/branches/<branch_id>/")
 async def get_branch(story_id, branch_id):
     """
-    Get branch details and generate content on demand if necessary.
+    Get branch details and queue generation of missing content.
+
+    Content is generated in the background, so clients poll this endpoint,
+    or follow the events endpoint, until the branch status is "done". The
+    optional "wait" query parameter holds the response for up to that many
+    seconds while the paragraph is written, with all waiters sharing the
+    same in-flight job. The branch is returned as "text-only" as soon as
+    its paragraph exists, while its audio is synthesized.
+
+    Clients on slow links can get a smaller audio variant as audio_url, by
+    name with the "audio" query parameter (e.g. "?audio=opus") or by its
+    content type in the Accept header (e.g. "audio/ogg").
     """
+    # A cached branch is complete, and its children were queued when it was
+    # first served, so there is nothing left to do.
+    cached = await branch_cache.get(branch_id)
+    if cached and cached["story_id"] == story_id:
+        return branch_response(cached)
+
     # Get the branch information
-    branch = await query_one(
-        """
-        SELECT *, s.lang
-        FROM branches b
-        JOIN stories s USING (story_id)
-        WHERE b.branch_id = :branch_id
-        """,
-        story_id=story_id,
-        branch_id=branch_id,
-    )
+    branch = await db.get_branch(branch_id)
 
     if not branch:
         app.logger.warning(
@@ -201,285 +551,875 @@ async def get_branch(story_id, branch_id):
         )
         abort(404, f"Story {story_id} does not exist!")
 
-    initial_status = branch.status
-    is_final_branch = branch.final_branch
-    language = branch.lang
-    sentiment = branch.sentiment
-
-    # If the branch status is "new", generate its content first
-    if initial_status == "new":
-        await generate_branch_content(
-            story_id, branch_id, language, sentiment, is_final_branch
-        )
-
-    if not is_final_branch:
+    branch_json = branch_to_json(branch)
+    if branch.status in ("new", "failed"):
+        # The job also creates and queues the children once the text exists.
+        await generation_queue.enqueue(story_id, branch_id, PRIORITY_USER)
+        wait = min(request.args.get("wait", 0, type=float), MAX_BRANCH_WAIT_SECONDS)
+        if wait > 0 and await generation_queue.wait(branch_id, wait):
+            branch_json = branch_to_json(await db.get_branch(branch_id))
+    elif not branch.final_branch and branch.status != "generating-text":
         app.logger.info(
             f"Computing children for branch: story_id={story_id}, branch_id={branch_id}"
         )
+        if branch.positive_branch_id and branch.negative_branch_id:
+            children = await db.get_children(branch_id)
+        else:
+            children = await generate_children(story_id, branch_id)
+        for child in children:
+            branch_json[f"{child.sentiment}_branch_id"] = child.branch_id
+            if child.status in ("new", "failed") or GENERATION_DEPTH > 1:
+                await generation_queue.enqueue(
+                    story_id, child.branch_id, PRIORITY_SPECULATIVE, depth=1
+                )
 
-        # Get story content
-        story_content = await query_scalar(
-            """
-            WITH RECURSIVE branch_history AS (
-                SELECT branch_id, previous_branch_id, paragraph, 1 AS depth
-                FROM branches
-                WHERE branch_id = :branch_id
-
-                UNION ALL
-                
-                SELECT b.branch_id, b.previous_branch_id, b.paragraph, bh.depth + 1
-                FROM branches b
-                JOIN branch_history bh ON b.branch_id = bh.previous_branch_id
-            )
-            SELECT string_agg(paragraph, E'\n\n' ORDER BY depth DESC) AS full_story
-            FROM branch_history
-            WHERE paragraph IS NOT NULL;
-            """,
-            branch_id=branch_id,
-        )
+    if branch.status == "text-only":
+        # Someone is reading the branch now, so its audio can't wait.
+        await audio_queue.enqueue(story_id, branch_id, PRIORITY_USER)
 
-        if not story_content:
-            raise ValueError(
-                f"Story content not found: story_id={story_id}, branch_id={branch_id}"
-            )
+    if is_complete_branch(branch_json):
+        await branch_cache.set(branch_id, branch_json)
+    return branch_response(branch_json)
 
-        # Story is long enough to become final
-        app.logger.info(
-            f"Story content length: story_id={story_id}, branch_id={branch_id}, length={len(story_content):,} characters"
-        )
-        creating_final_branch = len(story_content) > MAX_STORY_LENGTH
-
-        # Generate positive and negative branches in parallel
-        await asyncio.gather(
-            generate_branch(
-                story_id, branch_id, language, "positive", creating_final_branch
-            ),
-            generate_branch(
-                story_id, branch_id, language, "negative", creating_final_branch
-            ),
-        )
 
-        # Fetch the updated branch details
-        app.logger.debug(
-            f"Fetching updated branch: story_id={story_id}, branch_id={branch_id}"
-        )
+def preferred_audio(variants):
+    """
+    The name of the audio variant the client asked for out of the given
+    ones, by name in the "audio" query parameter or by content type in the
+    Accept header. None means the main audio.
+    """
+    name = request.args.get("audio")
+    if name is not None:
+        return name if name in variants else None
+    content_types = {audio_codec(OUTPUT_FORMAT)[0]: None}
+    for name in variants:
+        if name in AUDIO_VARIANTS:
+            content_types.setdefault(audio_codec(AUDIO_VARIANTS[name])[0], name)
+    # Ordered by quality, so the first audio type the client takes wins.
+    for content_type, quality in request.accept_mimetypes:
+        if quality > 0 and content_type in content_types:
+            return content_types[content_type]
+    return None
 
-    if initial_status == "new" or not is_final_branch:
-        branch = await query_one(
-            """
-            SELECT *
-            FROM branches
-            WHERE branch_id = :branch_id
-            """,
-            branch_id=branch_id,
+
+def branch_response(branch_json):
+    """The branch with its audio_url pointing at the preferred variant."""
+    name = preferred_audio(branch_json["audio_variants"])
+    if name is not None:
+        branch_json = {**branch_json, "audio_url": branch_json["audio_variants"][name]}
+    response = jsonify(branch_json)
+    response.vary.add("Accept")
+    return response
+
+
+def path_audio(path, content_types=None):
+    """
+    Blob names and output formats of the audio along a path, in the variant
+    the client prefers if every branch has it, out of those with one of the
+    content types if given. Stops at the first branch without audio.
+    """
+    ready = list(itertools.takewhile(lambda branch: branch.audio_url, path))
+    variants = [variant_blobs(branch.audio_variants) for branch in ready]
+    common = set.intersection(*(set(blobs) for blobs in variants)) if variants else set()
+    common = {
+        name
+        for name in common
+        if name in AUDIO_VARIANTS
+        and (content_types is None or audio_codec(AUDIO_VARIANTS[name])[0] in content_types)
+    }
+    name = preferred_audio(common)
+    if name is None:
+        return [(branch.audio_url, OUTPUT_FORMAT) for branch in ready]
+    return [(blobs[name], AUDIO_VARIANTS[name]) for blobs in variants]
+
+
+async def get_path(story_id, branch_id):
+    """
+    The branch and its ancestors, queueing whatever the path is missing
+    like get_branch does.
+    """
+    path = await db.get_branch_path(branch_id)
+    if not path or path[-1].story_id != story_id:
+        abort(404, f"Branch {branch_id} does not exist!")
+    for branch in path:
+        if branch.status in ("new", "failed"):
+            await generation_queue.enqueue(story_id, branch.branch_id, PRIORITY_USER)
+        elif branch.status == "text-only":
+            await audio_queue.enqueue(story_id, branch.branch_id, PRIORITY_USER)
+    return path
+
+
+@app.route("/v1/stories/<story_id>/branches/<branch_id>/playlist.m3u8")
+async def get_branch_playlist(story_id, branch_id):
+    """
+    An HLS playlist of the audio of the branch and all of its ancestors, so
+    clients can prefetch and play a whole path without a gap between
+    branches. MP3 variants are picked like in get_branch, since HLS can't
+    carry Ogg. While audio along the path is still being synthesized, the
+    playlist stops before it and has no end, so players reload it until
+    it's complete.
+    """
+    path = await get_path(story_id, branch_id)
+    segments = path_audio(path, HLS_CONTENT_TYPES)
+    durations = await asyncio.gather(
+        *(audio_cache.duration(blob, output_format) for blob, output_format in segments)
+    )
+    # A segment without a blob is still being uploaded.
+    segments = [
+        (blob, duration)
+        for (blob, _), duration in itertools.takewhile(
+            lambda item: item[1] is not None, zip(segments, durations)
         )
-        if not branch:
-            raise ValueError(f"Branch not found: branch_id={branch_id}")
+    ]
+    complete = len(segments) == len(path)
+    target_duration = max((duration for _, duration in segments), default=1)
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(target_duration)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if complete else 'EVENT'}",
+    ]
+    for blob, duration in segments:
+        lines += [f"#EXTINF:{duration:.3f},", storage.url(blob)]
+    if complete:
+        lines.append("#EXT-X-ENDLIST")
+    playlist = "\n".join(lines) + "\n"
+
+    etag = hashlib.sha1(playlist.encode(), usedforsecurity=False).hexdigest()
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept"}
+    if request.if_none_match.contains(etag):
+        return "", 304, headers
+    return playlist, 200, {**headers, "Content-Type": "application/vnd.apple.mpegurl"}
+
 
-    return jsonify(
+@app.route("/v1/stories/<story_id>/branches/<branch_id>/audiobook")
+async def get_branch_audiobook(story_id, branch_id):
+    """
+    Redirect to a single audio file of the branch and all of its ancestors,
+    built on the first request and kept in blob storage. Variants are picked
+    like in get_branch. Returns 409 until the audio of the whole path exists.
+    """
+    path = await get_path(story_id, branch_id)
+    segments = path_audio(path)
+    if len(segments) < len(path):
+        abort(409, f"Audio of branch {branch_id} or its ancestors isn't ready yet")
+
+    with span("generate", "audiobook") as audiobook_span:
+        blob_name = await audio_cache.concatenate([blob for blob, _ in segments])
+    app.logger.info(
+        f"Audiobook ready: story_id={story_id}, branch_id={branch_id}, branches={len(segments)}, duration={audiobook_span.duration:.2f}s"
+    )
+    response = redirect(storage.url(blob_name))
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/v1/stories/<story_id>/branches/<branch_id>/events")
+async def get_branch_events(story_id, branch_id):
+    """
+    Server-sent "branch" events with the branch every time its status
+    changes, ending once it's "done" or "failed". Lets clients show the paragraph as
+    soon as it's written and start playback when the audio arrives,
+    without polling. Generation is queued like in get_branch.
+    """
+    branch = await db.get_branch(branch_id)
+    if not branch or branch.story_id != story_id:
+        abort(404, f"Branch {branch_id} does not exist!")
+
+    if branch.status in ("new", "failed"):
+        await generation_queue.enqueue(story_id, branch_id, PRIORITY_USER)
+    elif branch.status == "text-only":
+        await audio_queue.enqueue(story_id, branch_id, PRIORITY_USER)
+
+    response = await make_response(
+        finish_span_after(branch_status_events(branch_id)),
         {
-            "id": branch.branch_id,
-            "story_id": branch.story_id,
-            "previous_branch_id": branch.previous_branch_id,
-            "status": branch.status,
-            "sentiment": branch.sentiment,
-            "audio_url": get_full_url(branch.audio_url) if branch.audio_url else None,
-            "paragraph": branch.paragraph,
-            "positive_branch_id": branch.positive_branch_id,
-            "negative_branch_id": branch.negative_branch_id,
-            "final_branch": branch.final_branch,
-        }
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        },
     )
+    response.timeout = None
+    return response
 
 
-async def generate_branch(
-    story_id, previous_branch_id, language, sentiment, is_final_branch
-):
-    app.logger.info(
-        f"Generating branch: story_id={story_id}, previous_branch_id={previous_branch_id}, sentiment={sentiment}"
+@app.route("/v1/stories/<story_id>/branches/<branch_id>/stream")
+async def stream_branch(story_id, branch_id):
+    """
+    Generate a branch while streaming it as server-sent events: "token"
+    events as the LLM writes, "audio" events with base64 MP3 chunks as soon
+    as each sentence is synthesized, and a final "branch" event once the
+    branch is stored. Branches that are already generated or being generated
+    elsewhere only get the "branch" event.
+    """
+    branch = await db.get_branch(branch_id)
+    if not branch or branch.story_id != story_id:
+        abort(404, f"Branch {branch_id} does not exist!")
+
+    claimed = None
+    if branch.status in ("new", "failed"):
+        claimed = await db.claim_branch_text(branch_id)
+
+    if claimed:
+        events = stream_branch_content(claimed)
+    else:
+        events = stream_existing_branch(branch_id)
+    response = await make_response(
+        finish_span_after(events),
+        {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        },
     )
-    child_branch = await query_one(
-        """
-        SELECT branch_id, status
-        FROM branches 
-        WHERE previous_branch_id = :previous_branch_id 
-        AND sentiment = :sentiment
-        """,
-        previous_branch_id=previous_branch_id,
-        sentiment=sentiment,
+    response.timeout = None
+    return response
+
+
+def story_to_json(story):
+    return {
+        "id": story.story_id,
+        "initial_branch_id": story.initial_branch_id,
+        "title": story.title,
+        "description": story.description,
+        "initial_prompt": story.initial_prompt,
+        "lang": story.lang,
+    }
+
+
+def branch_to_json(branch):
+    return {
+        "id": branch.branch_id,
+        "story_id": branch.story_id,
+        "previous_branch_id": branch.previous_branch_id,
+        "status": branch.status,
+        "sentiment": branch.sentiment,
+        "audio_url": storage.url(branch.audio_url) if branch.audio_url else None,
+        "audio_variants": variant_urls(branch.audio_variants),
+        "paragraph": branch.paragraph,
+        "positive_branch_id": branch.positive_branch_id,
+        "negative_branch_id": branch.negative_branch_id,
+        "final_branch": branch.final_branch,
+    }
+
+
+def variant_blobs(audio_variants):
+    """Blob names of the audio variants by name, as stored on a branch."""
+    if isinstance(audio_variants, str):
+        audio_variants = json.loads(audio_variants)
+    return audio_variants or {}
+
+
+def variant_urls(audio_variants):
+    """URLs of the audio variants by name, from their blob names."""
+    return {name: storage.url(blob) for name, blob in variant_blobs(audio_variants).items()}
+
+
+def is_complete_branch(branch_json):
+    """Whether the branch has all of its content and will never change."""
+    return branch_json["status"] == "done" and (
+        branch_json["final_branch"]
+        or bool(branch_json["positive_branch_id"] and branch_json["negative_branch_id"])
     )
 
-    if child_branch and child_branch.status != "failed":
-        return
 
-    # Create new branch or update failed branch.
-    # To reach a 0.01% chance of collision, you need approximately 13M items.
-    new_branch_id = child_branch.branch_id if child_branch else base62(10)
-    app.logger.info(
-        f"{'Updating' if child_branch else 'Creating'} branch: story_id={story_id}, branch_id={new_branch_id}"
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def branch_status_events(branch_id):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BRANCH_EVENTS_TIMEOUT
+    status = None
+    with branch_changes.watch(branch_id) as changed:
+        while loop.time() < deadline:
+            changed.clear()
+            branch = await db.get_branch(branch_id)
+            if branch.status != status:
+                status = branch.status
+                yield sse_event("branch", branch_to_json(branch))
+            if status in ("done", "failed"):
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), BRANCH_EVENTS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def stream_existing_branch(branch_id):
+    branch = await db.get_branch(branch_id)
+    yield sse_event("branch", branch_to_json(branch))
+
+
+# Keeps streamed generations alive when their client disconnects.
+streaming_tasks = set()
+
+
+async def stop_streaming(timeout):
+    """
+    Give streamed generations up to timeout seconds to finish, then cancel
+    them, which hands their branches back.
+    """
+    if streaming_tasks:
+        app.logger.info(f"Draining streamed generations: running={len(streaming_tasks)}")
+        await asyncio.wait(set(streaming_tasks), timeout=timeout)
+    tasks = set(streaming_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def stream_branch_content(branch):
+    """
+    Relay the events of a streamed generation. The generation itself runs
+    in its own task so that it is stored even if the client goes away.
+    """
+    events = asyncio.Queue()
+    task = asyncio.create_task(
+        content_flight.do(
+            branch.branch_id,
+            lambda: generate_streamed_branch_content(branch, events),
+        )
     )
+    streaming_tasks.add(task)
+    task.add_done_callback(streaming_tasks.discard)
+    while (event := await events.get()) is not None:
+        yield sse_event(*event)
 
-    if not child_branch:
-        await query(
-            """
-            INSERT INTO branches 
-            (branch_id, story_id, previous_branch_id, status, sentiment, audio_url, paragraph, final_branch)
-            VALUES (:new_branch_id, :story_id, :previous_branch_id, 'new', :sentiment, NULL, NULL, :final_branch)
-            """,
-            new_branch_id=new_branch_id,
-            story_id=story_id,
-            previous_branch_id=previous_branch_id,
-            sentiment=sentiment,
-            final_branch=is_final_branch,
+
+async def generate_streamed_branch_content(branch, events: asyncio.Queue):
+    """
+    Generate a branch claimed with db.claim_branch_text, starting TTS
+    sentence by sentence while the LLM is still writing.
+    """
+    story_id, branch_id = branch.story_id, branch.branch_id
+    sentences = asyncio.Queue()
+    audio_chunks = []
+
+    async def write_text():
+        context = await build_context(
+            branch.story_content,
+            branch.lang,
+            branch.parent_summary,
+            branch.parent_summary_depth,
+        )
+        prompt = get_branch_prompt(
+            context.text, branch.lang, branch.sentiment, branch.final_branch
+        )
+        new_paragraph = ""
+        spoken_length = 0
+        async for token in openai_prompt_stream(prompt):
+            new_paragraph += token
+            await events.put(("token", {"text": token}))
+            unspoken = new_paragraph[spoken_length:]
+            complete, rest = split_sentences(unspoken)
+            if complete and len(unspoken) - len(rest) >= MIN_TTS_CHUNK_LENGTH:
+                await sentences.put(" ".join(complete))
+                spoken_length = len(new_paragraph) - len(rest)
+        if new_paragraph[spoken_length:].strip():
+            await sentences.put(new_paragraph[spoken_length:].strip())
+        await sentences.put(None)
+
+        # Audio is already on its way, so skip straight past "text-only".
+        await db.save_paragraph(
+            branch_id,
+            branch.story_content,
+            new_paragraph,
+            status="generating-audio",
+            story_summary=context.summary,
+            summary_depth=context.summary_depth,
         )
+        branch_changes.notify(branch_id)
+        return new_paragraph
 
-    await generate_branch_content(
-        story_id, new_branch_id, language, sentiment, is_final_branch
+    async def speak():
+        while (sentence := await sentences.get()) is not None:
+            async for chunk in synthesize(branch.lang, sentence):
+                audio_chunks.append(chunk)
+                await events.put(("audio", {"data": base64.b64encode(chunk).decode()}))
+
+    try:
+        with span("generate", "streamed_branch") as stream_span:
+            new_paragraph, _ = await asyncio.gather(write_text(), speak())
+        await events.put(("audio-end", {}))
+        app.logger.info(
+            f"Streamed branch: story_id={story_id}, branch_id={branch_id}, duration={stream_span.duration:.2f}s"
+        )
+
+        audio_url = await audio_cache.store(
+            branch.lang, new_paragraph, b"".join(audio_chunks)
+        )
+        # The client already has the audio, so the variants can take their time.
+        audio_variants = await audio_cache.text_to_variants(branch.lang, new_paragraph)
+        await db.save_audio(branch_id, audio_url, audio_variants)
+        await branch_cache.invalidate(branch_id)
+        branch_changes.notify(branch_id)
+
+        stored_branch = await db.get_branch(branch_id)
+        await events.put(("branch", branch_to_json(stored_branch)))
+
+        # Let the queue create the children and generate them ahead of time.
+        await generation_queue.enqueue(story_id, branch_id, PRIORITY_USER)
+    except asyncio.CancelledError:
+        await release_branches([branch_id])
+        raise
+    except Exception as e:
+        app.logger.exception(
+            f"Streamed generation failed: story_id={story_id}, branch_id={branch_id}"
+        )
+        await db.fail_branch(branch_id)
+        branch_changes.notify(branch_id)
+        await events.put(("error", {"message": str(e)}))
+    finally:
+        await events.put(None)
+
+
+async def generate_children(story_id, branch_id):
+    """
+    Create the positive and negative child rows of a branch if they don't
+    exist yet. Returns the child rows, which may still need their content.
+    """
+    return await children_flight.do(
+        branch_id, lambda: create_missing_children(story_id, branch_id)
     )
 
-    # Update the requested branch with reference to the child branch
-    update_query = "UPDATE branches SET "
-    if sentiment == "positive":
-        update_query += "positive_branch_id = :new_branch_id"
-    else:
-        update_query += "negative_branch_id = :new_branch_id"
-    update_query += " WHERE branch_id = :previous_branch_id"
 
-    await query(
-        update_query,
-        new_branch_id=new_branch_id,
-        previous_branch_id=previous_branch_id,
+def new_branch_id(story_id):
+    prefix = story_id[-BRANCH_ID_STORY_PREFIX:] if BRANCH_ID_STORY_PREFIX > 0 else ""
+    return new_id(prefix)
+
+
+async def create_missing_children(story_id, branch_id):
+    positive_branch_id = new_branch_id(story_id)
+    negative_branch_id = new_branch_id(story_id)
+
+    # The unique index on (previous_branch_id, sentiment) makes the insert a
+    # no-op for children that already exist, also across replicas.
+    children = await db.create_children(
+        branch_id, positive_branch_id, negative_branch_id, MAX_STORY_LENGTH
     )
+    if len(children) < 2:
+        # A concurrent insert of the same children makes ours a no-op, but
+        # its rows aren't visible to our statement's snapshot. A separate
+        # statement sees them once they're committed.
+        created = children
+        children = await db.get_children(branch_id)
+        if children and len(children) > len(created):
+            app.logger.info(
+                f"Lost the race to create children: story_id={story_id}, branch_id={branch_id}"
+            )
+    await branch_cache.invalidate(branch_id)
+    if not children:
+        # Children are only created once the branch has its text.
+        app.logger.warning(
+            f"Story content not found: story_id={story_id}, branch_id={branch_id}"
+        )
+        return children
     app.logger.info(
-        f"DB update completed: story_id={story_id}, branch_id={new_branch_id}"
+        f"Children ready: story_id={story_id}, branch_id={branch_id}, children={[child.branch_id for child in children]}"
     )
+    return children
 
 
-async def generate_branch_content(
-    story_id, branch_id, language, sentiment, is_final_branch
-):
-    async with AsyncSessionFactory() as session:
-        try:
-            # Update status from "new" to "generating-text" in a transaction
-            result = await query(
-                """
-                UPDATE branches SET
-                    status = 'generating-text'
-                WHERE branch_id = :branch_id AND status = 'new'
-                """,
-                branch_id=branch_id,
-            )
-            # Make sure there is exactly one row in the result.
-            if result.rowcount != 1:
-                raise ValueError(
-                    f"Could not lock branch {branch_id} for generating text"
-                )
-            await session.commit()
-        except Exception as e:
-            await session.rollback()
-            app.logger.error(
-                f"Failed to update branch status: story_id={story_id}, branch_id={branch_id}, error={str(e)}"
+async def generate_branch_content(branch_id, use_cache=True):
+    """
+    Write the paragraph of the branch if it's missing, along with its
+    sibling's if that's missing too, and hand the branches over to the
+    audio queue once they're waiting for audio. Returns the branch, or None
+    if it doesn't exist.
+    """
+    claimed = await claim_branch_text(branch_id)
+    try:
+        if len(claimed) == 2:
+            # The sibling's job finds the pair in flight and waits for it.
+            await sibling_flight.do(
+                claimed[0].previous_branch_id,
+                lambda: generate_sibling_text_content(claimed, use_cache),
             )
-            raise
+        elif claimed:
+            await generate_text_content(claimed[0], use_cache)
+    except asyncio.CancelledError:
+        await release_branches([branch.branch_id for branch in claimed])
+        raise
+    except Exception:
+        for branch in claimed:
+            await db.fail_branch(branch.branch_id)
+            branch_changes.notify(branch.branch_id)
+        raise
+    for branch in claimed:
+        await audio_queue.enqueue(branch.story_id, branch.branch_id, current_priority.get())
+    for branch in claimed:
+        if branch.branch_id == branch_id:
+            return branch
+
+    branch = await db.get_branch(branch_id)
+    if branch and branch.status == "generating-text":
+        pair = sibling_flight.get(branch.previous_branch_id)
+        if pair:
+            await asyncio.wait([pair])
+            branch = await db.get_branch(branch_id)
+    if not branch or branch.status != "text-only":
+        return branch
+    await audio_queue.enqueue(branch.story_id, branch_id, current_priority.get())
+    return branch
 
-    # Get story content
-    story_content = await query_scalar(
-        """
-        WITH RECURSIVE branch_history AS (
-            SELECT branch_id, previous_branch_id, paragraph, 1 AS depth
-            FROM branches
-            WHERE branch_id = :branch_id
 
-            UNION ALL
-            
-            SELECT b.branch_id, b.previous_branch_id, b.paragraph, bh.depth + 1
-            FROM branches b
-            JOIN branch_history bh ON b.branch_id = bh.previous_branch_id
+async def claim_branch_text(branch_id):
+    """
+    Claim the branch for writing its paragraph, together with its sibling
+    when BATCH_SIBLINGS is set and both are missing. Returns the claimed
+    branches, which may be only the sibling.
+
+    A batched call decodes both paragraphs one after the other, so it saves
+    tokens but takes longer. Only speculative work is batched, and a user
+    waiting for a branch gets it written on its own.
+    """
+    if BATCH_SIBLINGS and current_priority.get() > PRIORITY_USER:
+        claimed = await db.claim_siblings(branch_id)
+        if claimed:
+            return claimed
+    branch = await db.claim_branch_text(branch_id)
+    return [branch] if branch else []
+
+
+async def generate_branch_audio(branch_id):
+    """Synthesize the audio of a text-only branch. Returns the branch."""
+    branch = await db.get_branch(branch_id)
+    if not branch or branch.status != "text-only":
+        return branch
+    if not await db.claim_branch_audio(branch_id):
+        raise BranchLockError(f"Could not lock branch {branch_id} for generating audio")
+    branch_changes.notify(branch_id)
+    try:
+        await generate_audio_content(
+            branch.story_id, branch_id, branch.lang, branch.paragraph
         )
-        SELECT string_agg(paragraph, E'\n\n' ORDER BY depth DESC) AS full_story
-        FROM branch_history
-        WHERE paragraph IS NOT NULL;
-        """,
-        branch_id=branch_id,
-    )
+    except asyncio.CancelledError:
+        await release_branches([branch_id])
+        raise
+    return branch
 
-    new_paragraph = await generate_text_content(
-        story_id, branch_id, story_content, language, sentiment, is_final_branch
-    )
-    await generate_audio_content(story_id, branch_id, language, new_paragraph)
+
+async def release_branches(branch_ids):
+    """
+    Hand back branches whose generation was cancelled, e.g. by a shutdown,
+    so they can be resumed right away instead of after the stale sweep.
+    """
+    if not branch_ids:
+        return
+    # Shielded, since the task doing this has already been cancelled.
+    await asyncio.shield(db.reset_branches(branch_ids))
+    for branch_id in branch_ids:
+        branch_changes.notify(branch_id)
 
 
-async def generate_text_content(
-    story_id, branch_id, story_content, language, sentiment, is_final_branch
-):
+async def generate_text_content(branch, use_cache=True):
+    """Write the paragraph of a branch claimed with db.claim_branch_text."""
+    story_id, branch_id = branch.story_id, branch.branch_id
     app.logger.info(
-        f"Generating text content for branch: story_id={story_id}, branch_id={branch_id}, sentiment={sentiment}"
+        f"Generating text content for branch: story_id={story_id}, branch_id={branch_id}, sentiment={branch.sentiment}"
     )
-    if is_final_branch:
-        prompt = get_final_prompt(story_content, language, sentiment)
-        app.logger.debug(
-            f"Final prompt generated: story_id={story_id}, branch_id={branch_id}"
+    with span("generate", "paragraph") as llm_span:
+        context = await build_context(
+            branch.story_content,
+            branch.lang,
+            branch.parent_summary,
+            branch.parent_summary_depth,
         )
-    else:
-        prompt = get_continue_prompt(story_content, language, sentiment)
-        app.logger.debug(
-            f"Continue prompt generated: story_id={story_id}, branch_id={branch_id}"
+        new_paragraph = await generate_new_branch(
+            branch.lang, context.text, branch.sentiment, branch.final_branch, use_cache
         )
-    llm_start = time()
-    new_paragraph = await openai_prompt(prompt)
-    llm_duration = time() - llm_start
     app.logger.info(
-        f"Paragraph generated: story_id={story_id}, branch_id={branch_id}, duration={llm_duration:.2f}s"
+        f"Paragraph generated: story_id={story_id}, branch_id={branch_id}, context_tokens={context.tokens}, duration={llm_span.duration:.2f}s"
     )
 
+    # Clients can show the paragraph while the audio queue gets to it.
     app.logger.debug(
         f"Updating branch status to 'text-only': story_id={story_id}, branch_id={branch_id}"
     )
-    await query(
-        """
-        UPDATE branches SET
-            status = 'text-only',
-            paragraph = :new_paragraph
-        WHERE branch_id = :branch_id
-        """,
-        new_paragraph=new_paragraph,
-        branch_id=branch_id,
+    await db.save_paragraph(
+        branch_id,
+        branch.story_content,
+        new_paragraph,
+        status="text-only",
+        story_summary=context.summary,
+        summary_depth=context.summary_depth,
     )
+    await branch_cache.invalidate(branch_id)
+    branch_changes.notify(branch_id)
 
     return new_paragraph
 
 
-async def generate_audio_content(story_id, branch_id, language, new_paragraph):
-    app.logger.debug(
-        f"Updating branch status to 'generating-audio': story_id={story_id}, branch_id={branch_id}"
+async def generate_sibling_text_content(branches, use_cache=True):
+    """
+    Write the paragraphs of two siblings claimed with db.claim_siblings in
+    one LLM call, falling back to a call per sibling if that fails.
+    """
+    first = branches[0]
+    story_id = first.story_id
+    branch_ids = [branch.branch_id for branch in branches]
+    app.logger.info(
+        f"Generating text content for siblings: story_id={story_id}, branch_ids={branch_ids}"
     )
-    await query(
-        """
-        UPDATE branches SET
-            status = 'generating-audio'
-        WHERE branch_id = :branch_id
-        """,
-        branch_id=branch_id,
+    with span("generate", "siblings") as llm_span:
+        context = await build_context(
+            first.story_content,
+            first.lang,
+            first.parent_summary,
+            first.parent_summary_depth,
+        )
+        try:
+            by_sentiment = await generate_sibling_branches(
+                first.lang, context.text, first.final_branch, use_cache
+            )
+            paragraphs = [by_sentiment[branch.sentiment] for branch in branches]
+        except GenerationError as e:
+            app.logger.warning(
+                f"Batched siblings failed, writing them one by one: story_id={story_id}, error={e!r}"
+            )
+            paragraphs = await asyncio.gather(
+                *(
+                    generate_new_branch(
+                        branch.lang,
+                        context.text,
+                        branch.sentiment,
+                        branch.final_branch,
+                        use_cache,
+                    )
+                    for branch in branches
+                )
+            )
+    app.logger.info(
+        f"Paragraphs generated: story_id={story_id}, branch_ids={branch_ids}, context_tokens={context.tokens}, duration={llm_span.duration:.2f}s"
+    )
+
+    await db.save_sibling_paragraphs(
+        first.story_content,
+        dict(zip(branch_ids, paragraphs)),
+        story_summary=context.summary,
+        summary_depth=context.summary_depth,
     )
+    for branch_id in branch_ids:
+        await branch_cache.invalidate(branch_id)
+        branch_changes.notify(branch_id)
 
-    audio_url = f"audios/{story_id}_{branch_id}.mp3"
-    tts_start = time()
-    await text_to_audio(language, new_paragraph, audio_url)
-    tts_duration = time() - tts_start
+
+async def generate_audio_content(story_id, branch_id, language, new_paragraph):
+    # The variants are requested alongside the main audio, so the branch is
+    # done as soon as the slowest of them.
+    with span("generate", "audio") as tts_span:
+        audio_url, audio_variants = await asyncio.gather(
+            audio_cache.text_to_audio(language, new_paragraph),
+            audio_cache.text_to_variants(language, new_paragraph),
+        )
     app.logger.info(
-        f"Audio generated: story_id={story_id}, branch_id={branch_id}, duration={tts_duration:.2f}s"
+        f"Audio generated: story_id={story_id}, branch_id={branch_id}, duration={tts_span.duration:.2f}s"
     )
 
     app.logger.debug(
         f"Updating branch status to 'done': story_id={story_id}, branch_id={branch_id}"
     )
-    await query(
-        """
-        UPDATE branches SET
-            status = 'done', 
-            audio_url = :audio_url
-        WHERE branch_id = :branch_id
-        """,
-        audio_url=audio_url,
-        branch_id=branch_id,
+    await db.save_audio(branch_id, audio_url, audio_variants)
+    await branch_cache.invalidate(branch_id)
+    branch_changes.notify(branch_id)
+
+
+async def write_branch(branch_id, use_cache=True):
+    """
+    Run generate_branch_content once per branch in this process, marking
+    the branch as failed if it raises.
+    """
+    try:
+        return await content_flight.do(
+            branch_id, lambda: generate_branch_content(branch_id, use_cache)
+        )
+    except Exception:
+        await db.fail_branch(branch_id)
+        branch_changes.notify(branch_id)
+        raise
+
+
+async def run_generation_job(job: Job):
+    """
+    Write the paragraph of a branch, then queue its children while the job
+    is still within the speculation depth. Children only need the text, so
+    they don't wait for the audio.
+    """
+    # Provider calls made by this job wait in the job's priority lane.
+    current_priority.set(job.priority)
+    branch = await write_branch(job.branch_id)
+    if not branch:
+        app.logger.warning(f"Branch for job not found: branch_id={job.branch_id}")
+        return
+    if branch.final_branch or job.depth >= GENERATION_DEPTH:
+        return
+    for child in await generate_children(job.story_id, job.branch_id):
+        await generation_queue.enqueue(
+            job.story_id, child.branch_id, PRIORITY_SPECULATIVE, job.depth + 1
+        )
+
+
+async def run_audio_job(job: Job):
+    """Synthesize the audio of a branch whose paragraph is already written."""
+    current_priority.set(job.priority)
+    try:
+        await content_flight.do(
+            ("audio", job.branch_id), lambda: generate_branch_audio(job.branch_id)
+        )
+    except BranchLockError as e:
+        app.logger.info(f"Skipping job: {e}")
+    except Exception:
+        await db.fail_branch(job.branch_id)
+        branch_changes.notify(job.branch_id)
+        raise
+
+
+async def sweep_stale_branches():
+    """
+    Periodically move branches stuck in generating-text or generating-audio,
+    e.g. because their worker died, back to a state they can resume from.
+    """
+    while True:
+        await asyncio.sleep(STALE_SWEEP_INTERVAL)
+        try:
+            branches = await db.reset_stale_branches(BRANCH_STALE_SECONDS)
+        except Exception:
+            app.logger.exception("Failed to sweep stale branches")
+            continue
+        for branch in branches:
+            app.logger.warning(
+                f"Reset stale branch: story_id={branch.story_id}, branch_id={branch.branch_id}, status={branch.status}"
+            )
+            await branch_cache.invalidate(branch.branch_id)
+            queue = audio_queue if branch.status == "text-only" else generation_queue
+            await queue.enqueue(branch.story_id, branch.branch_id)
+
+
+async def refill_starter_pool():
+    """
+    Keep STARTER_POOL_SIZE stories ready per language and category, checking
+    every STARTER_REFILL_INTERVAL seconds or as soon as one is handed out.
+    Replicas refill independently, so the pool can briefly overshoot.
+    """
+    # Pooled stories are never waited on, so users always go first.
+    current_priority.set(PRIORITY_SPECULATIVE)
+    while True:
+        starter_refill_needed.clear()
+        try:
+            for language, category in missing_starters(await db.count_starters()):
+                await add_starter_story(language, category)
+        except Exception:
+            app.logger.exception("Failed to refill starter pool")
+        try:
+            await asyncio.wait_for(
+                starter_refill_needed.wait(), STARTER_REFILL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
+
+
+async def add_starter_story(language, category):
+    # There are only a few premises per category, so cached completions
+    # would hand out the same story over and over.
+    story_json, initial_branch_json = await create_new_story(
+        random_premise(category), language, use_cache=False
+    )
+    story_id = story_json["id"]
+    branch_ids = [
+        initial_branch_json["positive_branch_id"],
+        initial_branch_json["negative_branch_id"],
+    ]
+    # Write the first levels of choices a level at a time. Their audio
+    # follows through the audio queue.
+    for level in range(1, STARTER_POOL_DEPTH + 1):
+        branches = await asyncio.gather(
+            *(write_branch(branch_id, use_cache=False) for branch_id in branch_ids)
+        )
+        if level == STARTER_POOL_DEPTH:
+            break
+        children = await asyncio.gather(
+            *(
+                generate_children(story_id, branch.branch_id)
+                for branch in branches
+                if branch and not branch.final_branch
+            )
+        )
+        branch_ids = [
+            child.branch_id for level_children in children for child in level_children
+        ]
+    await db.add_starter(story_id, language, category)
+    app.logger.info(
+        f"Added starter story: story_id={story_id}, lang={language}, category={category}"
+    )
+
+
+async def warm_caches():
+    """
+    Load the hot stories and their top branches into the memory caches, so
+    that a new instance doesn't send its first requests to the database.
+    """
+    if WARM_CACHE_STORIES <= 0:
+        return
+    with span("warm", "caches") as warm_span:
+        stories = await db.get_hot_stories(WARM_CACHE_STORIES)
+        for story in stories:
+            story_cache.prime(story.story_id, story_to_json(story))
+        branches = await db.get_top_branches(
+            [story.story_id for story in stories], WARM_CACHE_DEPTH
+        )
+        warmed = 0
+        for branch in branches:
+            branch_json = branch_to_json(branch)
+            if is_complete_branch(branch_json):
+                branch_cache.prime(branch.branch_id, branch_json)
+                warmed += 1
+    app.logger.info(
+        f"Warmed caches: stories={len(stories)}, branches={warmed}, duration={warm_span.duration:.2f}s"
+    )
+
+
+generation_queue = GenerationQueue(run_generation_job, make_job_store())
+# Text and audio are separate stages, so TTS never holds up the next paragraph.
+audio_queue = GenerationQueue(
+    run_audio_job, make_audio_job_store(), workers=AUDIO_WORKERS, name="audio"
+)
+background_tasks = set()
+
+
+@app.before_serving
+async def start_services():
+    # Fails startup rather than serving without token counts.
+    await asyncio.to_thread(load_encoding)
+    await db.start_connector()
+    await audio_service.start()
+    try:
+        await warm_caches()
+    except Exception:
+        app.logger.exception("Failed to warm caches")
+    await generation_queue.start()
+    await audio_queue.start()
+    background_tasks.add(asyncio.create_task(sweep_stale_branches()))
+    if STARTER_POOL_SIZE > 0 and STARTER_LANGUAGES:
+        background_tasks.add(asyncio.create_task(refill_starter_pool()))
+
+
+@app.after_serving
+async def stop_services():
+    # Let running generation finish, so its branches aren't left behind in
+    # generating-text or generating-audio. Whatever doesn't finish in time
+    # is handed back and picked up by the next start.
+    await asyncio.gather(
+        generation_queue.stop(SHUTDOWN_DRAIN_SECONDS),
+        audio_queue.stop(SHUTDOWN_DRAIN_SECONDS),
+        stop_streaming(SHUTDOWN_DRAIN_SECONDS),
     )
+    # Only now, since queue workers may be waiting on a branch that the
+    # starter pool refill is writing.
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await audio_service.close()
+    await db.close()
+    flush_traces()
@@ -0,0 +1,99 @@
+"""
+Per-call overhead of uploading audio with fresh clients versus the shared
+AudioService. Runs against a local stand-in for the Cloud Storage upload API
+with a simulated token refresh, so no credentials or network are needed.
+
+    python -m benchmarks.audio_overhead [calls]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import ClientSession, web
+
+PORT = 8765
+os.environ["STORAGE_API_URL"] = f"http://127.0.0.1:{PORT}"
+
+from pocketpal.audio import BUCKET_NAME, AudioService  # noqa: E402
+
+# Roughly what a round trip to the Google token endpoint costs.
+TOKEN_REFRESH_SECONDS = 0.05
+PAYLOAD = b"\xff" * 32_000
+
+
+class SimulatedCredentials:
+    def __init__(self):
+        self.token = None
+        self.expiry = None
+
+    @property
+    def valid(self):
+        return self.token is not None and datetime.utcnow() < self.expiry
+
+    def refresh(self, request):
+        time.sleep(TOKEN_REFRESH_SECONDS)
+        self.token = "token"
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+async def handle_upload(request):
+    await request.read()
+    return web.json_response({"bucket": request.match_info["bucket"]})
+
+
+async def loop_lag(stop: asyncio.Event):
+    """Longest time the event loop was blocked while the benchmark ran."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - start - 0.001)
+    return worst
+
+
+async def upload_with_fresh_clients(name):
+    # What text_to_audio used to do on every call.
+    credentials = SimulatedCredentials()
+    credentials.refresh(None)
+    async with ClientSession() as session:
+        url = f"http://127.0.0.1:{PORT}/upload/storage/v1/b/{BUCKET_NAME}/o?uploadType=media&name={name}"
+        headers = {"Authorization": f"Bearer {credentials.token}"}
+        async with session.post(url, headers=headers, data=PAYLOAD) as response:
+            assert response.status == 200
+
+
+async def measure(label, upload, calls):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(upload(f"audios/bench_{i}.mp3") for i in range(calls)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    print(
+        f"{label:<14} {elapsed / calls * 1000:8.2f} ms/call"
+        f"  {calls / elapsed:8.1f} calls/s  max loop stall {await lag * 1000:7.1f} ms"
+    )
+
+
+async def main(calls):
+    app = web.Application(client_max_size=10 * 1024 * 1024)
+    app.router.add_post("/upload/storage/v1/b/{bucket}/o", handle_upload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    service = AudioService(credentials=SimulatedCredentials())
+    await service.start()
+    try:
+        await measure("fresh clients", upload_with_fresh_clients, calls)
+        await measure("AudioService", service.upload_audio, calls)
+    finally:
+        await service.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,103 @@
+"""
+Concurrency stress test for branch creation against a local Postgres. Fires
+many simultaneous get_branch requests at one branch, then many direct child
+creations that bypass the in-process single-flight like separate replicas
+would, and checks that every request succeeded and no child was duplicated.
+
+    createdb pocketpal_stress
+    psql pocketpal_stress -f queries/create.sql
+    DATABASE_URL=postgresql+asyncpg://localhost/pocketpal_stress \\
+        python -m benchmarks.branch_concurrency [concurrency]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("TTS_BACKEND", "fake")
+os.environ.setdefault("AUDIO_STORAGE", "local")
+os.environ.setdefault("AUDIO_STORAGE_DIR", tempfile.mkdtemp())
+
+from app import app, create_missing_children  # noqa: E402
+from pocketpal.db import query, query_one  # noqa: E402
+from pocketpal.fakes import FAKE_PARAGRAPH  # noqa: E402
+from pocketpal.utils import base62  # noqa: E402
+
+
+async def seed_story():
+    story_id = base62(10)
+    branch_id = base62(10)
+    await query(
+        """
+        WITH story_insert AS (
+            INSERT INTO stories (story_id, initial_branch_id, title, description, initial_prompt, lang)
+            VALUES (:story_id, :branch_id, 'Stress', 'Stress test', 'stress', 'en')
+        )
+        INSERT INTO branches
+        (branch_id, story_id, previous_branch_id, status, sentiment, paragraph, depth, story_prefix, story_length)
+        VALUES (:branch_id, :story_id, NULL, 'done', 'initial_branch', :paragraph, 1, :paragraph, :story_length)
+        """,
+        story_id=story_id,
+        branch_id=branch_id,
+        paragraph=FAKE_PARAGRAPH,
+        story_length=len(FAKE_PARAGRAPH),
+    )
+    return story_id, branch_id
+
+
+async def count_children(branch_id):
+    result = await query(
+        """
+        SELECT sentiment, count(*) AS children
+        FROM branches
+        WHERE previous_branch_id = :branch_id
+        GROUP BY sentiment
+        """,
+        branch_id=branch_id,
+    )
+    return {row.sentiment: row.children for row in result.fetchall()}
+
+
+async def main(concurrency):
+    client = app.test_client()
+
+    story_id, branch_id = await seed_story()
+    start = time.perf_counter()
+    responses = await asyncio.gather(
+        *(
+            client.get(f"/v1/stories/{story_id}/branches/{branch_id}/")
+            for _ in range(concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    statuses = Counter(response.status_code for response in responses)
+    children = await count_children(branch_id)
+    print(f"get_branch x{concurrency}: {dict(statuses)} in {elapsed:.2f}s, children={children}")
+    assert statuses == {200: concurrency}, statuses
+    assert children == {"positive": 1, "negative": 1}, children
+
+    story_id, branch_id = await seed_story()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(create_missing_children(story_id, branch_id) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    children = await count_children(branch_id)
+    parent = await query_one(
+        "SELECT positive_branch_id, negative_branch_id FROM branches WHERE branch_id = :branch_id",
+        branch_id=branch_id,
+    )
+    print(f"create_missing_children x{concurrency}: {elapsed:.2f}s, children={children}")
+    assert children == {"positive": 1, "negative": 1}, children
+    assert parent.positive_branch_id and parent.negative_branch_id, parent
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,85 @@
+"""
+Prompt tokens and LLM latency per story depth when prompting with the full
+story versus the windowed context with a rolling summary. Uses the fake LLM,
+whose latency grows with the prompt like a real provider's, unless
+LLM_BACKEND=openai is set.
+
+    python -m benchmarks.context_window [depth]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_CACHE", "0")
+
+from pocketpal import llm  # noqa: E402
+from pocketpal.context import build_context  # noqa: E402
+from pocketpal.fakes import FakeLLM  # noqa: E402
+
+# Fixed overhead per call plus prompt processing time per token.
+FAKE_LATENCY = 0.05
+FAKE_TOKEN_LATENCY = 0.0002
+REPORT_DEPTHS = {1, 5, 10, 20, 30, 40, 60, 80, 100}
+
+
+def input_tokens(call):
+    return llm.usage_stats.totals[call]["input_tokens"]
+
+
+async def timed_branch(story, sentiment):
+    """Write the next paragraph, returning it with its prompt tokens and latency."""
+    tokens = input_tokens("write_paragraph")
+    start = time.perf_counter()
+    paragraph = await llm.generate_new_branch("en", story, sentiment, use_cache=False)
+    latency = time.perf_counter() - start
+    return paragraph, input_tokens("write_paragraph") - tokens, latency
+
+
+async def main(max_depth):
+    for route, backend in llm.router.routes.items():
+        if isinstance(backend, FakeLLM):
+            llm.router.routes[route] = FakeLLM(
+                latency=FAKE_LATENCY, token_latency=FAKE_TOKEN_LATENCY
+            )
+
+    story = "You wake up at the edge of a forest with no memory of how you got there."
+    summary, summary_depth = None, 0
+    totals = {"full": [0, 0.0], "windowed": [0, 0.0]}
+    print(
+        f"{'depth':>5} {'full tokens':>12} {'full s':>8} {'window tokens':>14} {'window s':>9} {'summarized':>11}"
+    )
+    for depth in range(1, max_depth + 1):
+        sentiment = "positive" if depth % 2 else "negative"
+        _, full_tokens, full_latency = await timed_branch(story, sentiment)
+
+        # Summarizing counts towards the windowed cost of the branch that did it.
+        summary_tokens = input_tokens("summarize_story")
+        start = time.perf_counter()
+        context = await build_context(story, "en", summary, summary_depth)
+        context_latency = time.perf_counter() - start
+        paragraph, window_tokens, window_latency = await timed_branch(
+            context.text, sentiment
+        )
+        window_tokens += input_tokens("summarize_story") - summary_tokens
+        window_latency += context_latency
+        summary, summary_depth = context.summary, context.summary_depth
+
+        totals["full"][0] += full_tokens
+        totals["full"][1] += full_latency
+        totals["windowed"][0] += window_tokens
+        totals["windowed"][1] += window_latency
+        if depth in REPORT_DEPTHS or depth == max_depth:
+            print(
+                f"{depth:5d} {full_tokens:12d} {full_latency:8.3f} {window_tokens:14d} {window_latency:9.3f} {summary_depth:11d}"
+            )
+        story = f"{story}\n\n{paragraph}"
+
+    for name, (tokens, latency) in totals.items():
+        print(f"{name:>8} total: {tokens} prompt tokens, {latency:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 40))
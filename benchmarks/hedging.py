@@ -0,0 +1,74 @@
+"""
+Paragraph latency with and without hedged requests, against fake routes
+with a heavy latency tail. Reports p50/p90/p99, how often the hedge fired
+and which route won.
+
+    python -m benchmarks.hedging [calls] [concurrency]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_CACHE", "0")
+
+from benchmarks.loadtest import percentile  # noqa: E402
+from pocketpal import llm  # noqa: E402
+from pocketpal.fakes import FakeLLM, Faults  # noqa: E402
+from pocketpal.gateway import Gateway  # noqa: E402
+from pocketpal.routing import Policy, Router, route_wins  # noqa: E402
+
+# Median 0.3s, with about one call in fifteen taking over a second.
+TAIL_LATENCY = "lognormal:0.3,0.8"
+STORY = "You wake up at the edge of a forest with no memory of how you got there."
+
+
+def make_router(policy: Policy) -> Router:
+    routes = {
+        "primary": FakeLLM("primary", faults=Faults(TAIL_LATENCY, seed=1)),
+        "backup": FakeLLM("backup", faults=Faults(TAIL_LATENCY, seed=2)),
+    }
+    gateway = Gateway("bench", concurrency=1000, retries=0)
+    return Router(routes, {"continue": policy}, gateway, min_samples=20, default_delay=1.0)
+
+
+async def run(name: str, policy: Policy, calls: int, concurrency: int):
+    llm.router = make_router(policy)
+    before = dict(route_wins.series)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await llm.generate_new_branch("en", f"{STORY} ({i})", "positive", use_cache=False)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    latencies.sort()
+    wins = Counter()
+    hedged = 0
+    for (call, route, was_hedged), count in route_wins.series.items():
+        count -= before.get((call, route, was_hedged), 0)
+        if call == "continue" and count:
+            wins[route] += count
+            hedged += count if was_hedged == "true" else 0
+    print(
+        f"{name:<10} {percentile(latencies, 50) * 1000:8.0f} {percentile(latencies, 90) * 1000:8.0f} "
+        f"{percentile(latencies, 99) * 1000:8.0f} {hedged / calls:8.1%}  {dict(wins)}"
+    )
+
+
+async def main(calls: int, concurrency: int):
+    print(f"{'policy':<10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'hedged':>8}  wins per route")
+    await run("single", Policy("primary"), calls, concurrency)
+    await run("hedged", Policy("primary", "backup"), calls, concurrency)
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(calls, concurrency))
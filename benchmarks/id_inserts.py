@@ -0,0 +1,110 @@
+"""
+Insert throughput of random 10 character IDs versus time-ordered IDs, with
+and without a story prefix, against a local Postgres. Each scheme fills its
+own copy of the branch keys and indexes in batches, and reports rows per
+second over the whole run and the last batches, along with the size of
+its indexes. Random keys slow down as the indexes outgrow the cache.
+
+    createdb pocketpal_bench
+    DATABASE_URL=postgresql+asyncpg://localhost/pocketpal_bench \\
+        python -m benchmarks.id_inserts [rows] [batch]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from pocketpal.db import close, query, query_scalar
+from pocketpal.utils import base62, new_id
+
+STORIES = 1000
+# Share of the run, from the end, that the "last" throughput covers.
+LAST_SHARE = 0.1
+
+
+def random_ids(story_id):
+    return base62(10)
+
+
+def ordered_ids(story_id):
+    return new_id()
+
+
+def prefixed_ids(story_id):
+    return new_id(story_id[-2:])
+
+
+SCHEMES = {
+    "random": random_ids,
+    "ordered": ordered_ids,
+    "prefixed": prefixed_ids,
+}
+
+
+async def create_table(name):
+    await query(f"DROP TABLE IF EXISTS {name}")
+    await query(
+        f"""
+        CREATE TABLE {name} (
+            branch_id TEXT NOT NULL,
+            story_id TEXT NOT NULL,
+            previous_branch_id TEXT,
+            PRIMARY KEY (branch_id)
+        )
+        """
+    )
+    await query(f"CREATE INDEX {name}_previous ON {name} (previous_branch_id)")
+
+
+async def run(scheme, make_id, rows, batch):
+    table = f"bench_ids_{scheme}"
+    await create_table(table)
+    # Stories grow side by side, each branch continuing an earlier one.
+    stories = [base62(10) for _ in range(STORIES)]
+    branches = {story_id: [] for story_id in stories}
+    insert = f"""
+        INSERT INTO {table} (branch_id, story_id, previous_branch_id)
+        SELECT * FROM unnest(
+            CAST(:branch_ids AS TEXT[]), CAST(:story_ids AS TEXT[]), CAST(:previous_ids AS TEXT[])
+        )
+    """
+
+    timings = []
+    for _ in range(0, rows, batch):
+        branch_ids, story_ids, previous_ids = [], [], []
+        for _ in range(batch):
+            story_id = random.choice(stories)
+            previous = branches[story_id]
+            branch_id = make_id(story_id)
+            branch_ids.append(branch_id)
+            story_ids.append(story_id)
+            previous_ids.append(previous[len(previous) // 2] if previous else None)
+            previous.append(branch_id)
+        start = time.perf_counter()
+        await query(
+            insert, branch_ids=branch_ids, story_ids=story_ids, previous_ids=previous_ids
+        )
+        timings.append(time.perf_counter() - start)
+
+    last = timings[-max(1, int(len(timings) * LAST_SHARE)) :]
+    index_bytes = await query_scalar(f"SELECT pg_indexes_size('{table}')")
+    print(
+        f"{scheme:>10} {batch * len(timings) / sum(timings):12,.0f} "
+        f"{batch * len(last) / sum(last):12,.0f} {index_bytes / 2**20:10.1f}"
+    )
+    await query(f"DROP TABLE {table}")
+
+
+async def main(rows, batch):
+    print(f"{rows:,} rows in batches of {batch}")
+    print(f"{'scheme':>10} {'rows/s':>12} {'last rows/s':>12} {'index MB':>10}")
+    for scheme, make_id in SCHEMES.items():
+        await run(scheme, make_id, rows, batch)
+    await close()
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    asyncio.run(main(rows, batch))
@@ -0,0 +1,242 @@
+"""
+Simulated users walking story trees: each one creates or picks a story,
+then follows random choices down to an ending, fetching every branch and
+its audio like the player does. Reports throughput and p50/p95/p99 latency
+per endpoint.
+
+    createdb pocketpal_bench
+    psql pocketpal_bench -f queries/create.sql
+    DATABASE_URL=postgresql+asyncpg://localhost/pocketpal_bench \\
+        python -m benchmarks.loadtest --users 50 --duration 60
+
+The app is served in-process by Hypercorn with fake providers, whose latency
+and failure rates come from the FAKE_LLM_*, FAKE_TTS_* and FAKE_STORAGE_*
+variables. Pass --url to load a server that is already running instead.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("TTS_BACKEND", "fake")
+os.environ.setdefault("AUDIO_STORAGE", "fake")
+os.environ.setdefault("AUDIO_STORAGE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("FAKE_LLM_LATENCY", "lognormal:0.8,0.3")
+os.environ.setdefault("FAKE_TTS_LATENCY", "lognormal:0.4,0.3")
+
+import aiohttp  # noqa: E402
+
+PREMISES = [
+    "A lighthouse keeper finds a message in a bottle addressed to them.",
+    "A child discovers that their shadow has started making its own choices.",
+    "The last train of the night stops at a station that isn't on the map.",
+    "A baker's bread starts granting small wishes to whoever eats it.",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of the values, which must be sorted."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+class Recorder:
+    """Latencies and failures per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def request(
+        self, session: aiohttp.ClientSession, endpoint: str, method: str, url: str, **kwargs
+    ):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                if response.content_type == "application/json":
+                    body = await response.json()
+                else:
+                    body = await response.read()
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            body, ok = None, False
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[endpoint] += 1
+            return None
+        return body
+
+    def report(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            report[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "rps": len(latencies) / elapsed,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1],
+            }
+        return report
+
+
+def print_report(report: Dict[str, Dict[str, float]], elapsed: float):
+    print(
+        f"{'endpoint':<22} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<22} {row['requests']:8d} {row['errors']:6d} {row['rps']:8.1f} "
+            f"{row['p50'] * 1000:8.1f} {row['p95'] * 1000:8.1f} {row['p99'] * 1000:8.1f} {row['max'] * 1000:8.1f}"
+        )
+    total = sum(row["requests"] for row in report.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s")
+
+
+async def walk_story(
+    session: aiohttp.ClientSession,
+    recorder: Recorder,
+    url: str,
+    stories: List[str],
+    args,
+):
+    """One user session: pick a story and play it to the end."""
+    if not stories or random.random() < args.new_story_rate:
+        created = await recorder.request(
+            session,
+            "POST story",
+            "POST",
+            f"{url}/v1/stories/",
+            json={"initial_prompt": random.choice(PREMISES)},
+        )
+        if created is None:
+            return
+        story_id = created["story"]["id"]
+        stories.append(story_id)
+    else:
+        story_id = random.choice(stories)
+
+    story = await recorder.request(
+        session, "GET story", "GET", f"{url}/v1/stories/{story_id}/"
+    )
+    if story is None:
+        return
+    if random.random() < args.tree_rate:
+        await recorder.request(
+            session, "GET tree", "GET", f"{url}/v1/stories/{story_id}/tree"
+        )
+
+    branch_id: Optional[str] = story["initial_branch_id"]
+    for _ in range(args.max_steps):
+        branch = await recorder.request(
+            session,
+            "GET branch",
+            "GET",
+            f"{url}/v1/stories/{story_id}/branches/{branch_id}/",
+            params={"wait": str(args.wait)},
+        )
+        # Text-only branches can be read while their audio is synthesized.
+        if branch is None or branch["status"] not in ("text-only", "done"):
+            return
+        if branch["audio_url"] and branch["audio_url"].startswith("/"):
+            await recorder.request(session, "GET audio", "GET", f"{url}{branch['audio_url']}")
+        if branch["final_branch"]:
+            return
+        await asyncio.sleep(args.think)
+        branch_id = branch[f"{random.choice(['positive', 'negative'])}_branch_id"]
+        if not branch_id:
+            return
+
+
+async def run_load(url: str, args) -> Dict[str, Dict[str, float]]:
+    recorder = Recorder()
+    stories: List[str] = []
+    deadline = time.perf_counter() + args.duration
+
+    async def user(session):
+        while time.perf_counter() < deadline:
+            await walk_story(session, recorder, url, stories, args)
+
+    timeout = aiohttp.ClientTimeout(total=args.wait + 30)
+    connector = aiohttp.TCPConnector(limit=args.users)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(session) for _ in range(args.users)))
+        elapsed = time.perf_counter() - start
+    report = recorder.report(elapsed)
+    print_report(report, elapsed)
+    return report
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def serve_and_run(args):
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    from app import app
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{free_port()}"]
+    config.accesslog = None
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(app, config, shutdown_trigger=shutdown.wait))
+    url = f"http://{config.bind[0]}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{url}/metrics"):
+                    break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    try:
+        return await run_load(url, args)
+    finally:
+        shutdown.set()
+        await server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="load a running server instead")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--max-steps", type=int, default=10, help="branches per walk")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds between choices")
+    parser.add_argument("--wait", type=float, default=20, help="get_branch wait parameter")
+    parser.add_argument("--new-story-rate", type=float, default=0.05)
+    parser.add_argument("--tree-rate", type=float, default=0.1)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
+    if args.url:
+        report = await run_load(args.url.rstrip("/"), args)
+    else:
+        report = await serve_and_run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Counts the database statements and transactions behind each step of serving
+and generating a branch, against a local Postgres with fake providers.
+
+    createdb pocketpal_bench
+    psql pocketpal_bench -f queries/create.sql
+    DATABASE_URL=postgresql+asyncpg://localhost/pocketpal_bench \\
+        python -m benchmarks.query_count
+"""
+
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("TTS_BACKEND", "fake")
+os.environ.setdefault("AUDIO_STORAGE", "local")
+os.environ.setdefault("AUDIO_STORAGE_DIR", tempfile.mkdtemp())
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, run_generation_job  # noqa: E402
+from pocketpal import db  # noqa: E402
+from pocketpal.fakes import FAKE_PARAGRAPH  # noqa: E402
+from pocketpal.jobs import Job  # noqa: E402
+from pocketpal.utils import base62  # noqa: E402
+
+
+class Counter:
+    def __init__(self):
+        self.statements = 0
+        self.transactions = 0
+
+    def on_execute(self, *args):
+        self.statements += 1
+
+    def on_begin(self, *args):
+        self.transactions += 1
+
+
+counter = Counter()
+event.listen(db.engine.sync_engine, "before_cursor_execute", counter.on_execute)
+event.listen(db.engine.sync_engine, "begin", counter.on_begin)
+
+
+@asynccontextmanager
+async def measure(label):
+    counter.statements = counter.transactions = 0
+    yield
+    print(
+        f"{label:<40} {counter.statements:3d} statements  {counter.transactions:3d} transactions"
+    )
+
+
+async def seed_story():
+    story_id = base62(10)
+    branch_id = base62(10)
+    await db.query(
+        """
+        WITH story_insert AS (
+            INSERT INTO stories (story_id, initial_branch_id, title, description, initial_prompt, lang)
+            VALUES (:story_id, :branch_id, 'Bench', 'Query count', 'bench', 'en')
+        )
+        INSERT INTO branches
+        (branch_id, story_id, previous_branch_id, status, sentiment, paragraph, depth, story_prefix, story_length)
+        VALUES (:branch_id, :story_id, NULL, 'done', 'initial_branch', :paragraph, 1, :paragraph, :story_length)
+        """,
+        story_id=story_id,
+        branch_id=branch_id,
+        paragraph=FAKE_PARAGRAPH,
+        story_length=len(FAKE_PARAGRAPH),
+    )
+    return story_id, branch_id
+
+
+async def main():
+    client = app.test_client()
+    story_id, branch_id = await seed_story()
+    url = f"/v1/stories/{story_id}/branches/{branch_id}/"
+
+    async with measure("get_branch, children missing"):
+        response = await client.get(url)
+    branch = await response.get_json()
+
+    async with measure("get_branch, children exist"):
+        await client.get(url)
+
+    async with measure("generate a new child branch"):
+        await run_generation_job(
+            Job(story_id=story_id, branch_id=branch["positive_branch_id"], depth=1)
+        )
+
+    async with measure("get_branch, generated child"):
+        await client.get(f"/v1/stories/{story_id}/branches/{branch['positive_branch_id']}/")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+Requests per second and latency of the load test against Hypercorn run with
+hypercorn_config.py, across worker counts and event loops. Each
+configuration is a separate server process with fake providers, stopped
+with SIGTERM like Cloud Run does, so its shutdown drain is timed as well.
+
+    createdb pocketpal_bench
+    psql pocketpal_bench -f queries/create.sql
+    DATABASE_URL=postgresql+asyncpg://localhost/pocketpal_bench \\
+        python -m benchmarks.serving --workers 1,4 --loops asyncio,uvloop
+
+Takes the load test's options, e.g. --users and --duration.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+# Quicker fakes than the load test's, so that serving overhead shows.
+os.environ.setdefault("FAKE_LLM_LATENCY", "lognormal:0.2,0.3")
+os.environ.setdefault("FAKE_TTS_LATENCY", "lognormal:0.1,0.3")
+os.environ.setdefault("STARTER_POOL_SIZE", "0")
+
+import aiohttp  # noqa: E402
+
+from benchmarks.loadtest import free_port, parse_args, run_load  # noqa: E402
+
+
+async def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(f"{url}/metrics"):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.2)
+    raise TimeoutError(f"Server at {url} didn't start")
+
+
+async def run(workers: int, loop: str, args):
+    bind = f"127.0.0.1:{free_port()}"
+    env = {
+        **os.environ,
+        "SERVER_BIND": bind,
+        "SERVER_WORKERS": str(workers),
+        "SERVER_LOOP": loop,
+    }
+    server = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "hypercorn",
+        "app:app",
+        "--config",
+        "file:hypercorn_config.py",
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    url = f"http://{bind}"
+    try:
+        await wait_until_up(url)
+        print(f"\n{workers} workers, {loop}")
+        report = await run_load(url, args)
+    finally:
+        start = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        await server.wait()
+        shutdown = time.perf_counter() - start
+
+    branch = report.get("GET branch", {})
+    story = report.get("GET story", {})
+    return (
+        sum(row["rps"] for row in report.values()),
+        branch.get("p99", 0.0),
+        story.get("p99", 0.0),
+        shutdown,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--loops", default="asyncio,uvloop")
+    options, rest = parser.parse_known_args()
+    args = parse_args(rest)
+
+    results = {}
+    for loop in options.loops.split(","):
+        for workers in map(int, options.workers.split(",")):
+            results[workers, loop] = await run(workers, loop, args)
+
+    print(
+        f"\n{'workers':>7} {'loop':<8} {'req/s':>8} {'branch p99 ms':>14} {'story p99 ms':>13} {'shutdown s':>11}"
+    )
+    for (workers, loop), (rps, branch_p99, story_p99, shutdown) in results.items():
+        print(
+            f"{workers:7d} {loop:<8} {rps:8.1f} {branch_p99 * 1000:14.1f} {story_p99 * 1000:13.1f} {shutdown:11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Tokens and wall time of writing both children of a branch with one batched
+call versus a call per sibling, at several story lengths. Uses the fake
+LLM, whose latency grows with the prompt and the output like a real
+provider's, unless LLM_BACKEND=openai is set.
+
+    python -m benchmarks.sibling_batching [rounds]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_CACHE", "0")
+
+from pocketpal import llm  # noqa: E402
+from pocketpal.fakes import FAKE_PARAGRAPH, FakeLLM  # noqa: E402
+
+# Fixed overhead per call, prompt processing and decoding time per token.
+FAKE_LATENCY = 0.05
+FAKE_TOKEN_LATENCY = 0.0002
+FAKE_OUTPUT_TOKEN_LATENCY = 0.01
+STORY_PARAGRAPHS = (1, 4, 8)
+
+
+def tokens(call):
+    totals = llm.usage_stats.totals[call]
+    return totals["input_tokens"], totals["output_tokens"]
+
+
+async def per_sibling(story):
+    await asyncio.gather(
+        *(
+            llm.generate_new_branch("en", story, sentiment, use_cache=False)
+            for sentiment in ("positive", "negative")
+        )
+    )
+
+
+async def batched(story):
+    await llm.generate_sibling_branches("en", story, use_cache=False)
+
+
+async def measure(name, call, write, story, rounds):
+    input_before, output_before = tokens(call)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await write(story)
+    latency = (time.perf_counter() - start) / rounds
+    input_after, output_after = tokens(call)
+    input_tokens = (input_after - input_before) // rounds
+    output_tokens = (output_after - output_before) // rounds
+    print(f"{name:>12} {input_tokens:13d} {output_tokens:14d} {latency:8.3f}")
+    return input_tokens + output_tokens, latency
+
+
+async def main(rounds):
+    for route, backend in llm.router.routes.items():
+        if isinstance(backend, FakeLLM):
+            llm.router.routes[route] = FakeLLM(
+                latency=FAKE_LATENCY,
+                token_latency=FAKE_TOKEN_LATENCY,
+                output_token_latency=FAKE_OUTPUT_TOKEN_LATENCY,
+            )
+
+    for paragraphs in STORY_PARAGRAPHS:
+        story = "\n\n".join([FAKE_PARAGRAPH] * paragraphs)
+        print(f"story of {paragraphs} paragraphs")
+        print(f"{'path':>12} {'input tokens':>13} {'output tokens':>14} {'seconds':>8}")
+        two_tokens, two_latency = await measure(
+            "per sibling", "write_paragraph", per_sibling, story, rounds
+        )
+        one_tokens, one_latency = await measure(
+            "batched", "write_paragraphs", batched, story, rounds
+        )
+        print(
+            f"batched uses {1 - one_tokens / two_tokens:.0%} fewer tokens, "
+            f"{one_latency / two_latency:.2f}x the wall time, and half the requests\n"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
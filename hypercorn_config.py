@@ -0,0 +1,27 @@
+"""
+Hypercorn settings, read with --config file:hypercorn_config.py. Every
+worker process runs its own copy of the app, with its own job queues,
+caches and database pool.
+"""
+
+import importlib.util
+import os
+
+bind = os.getenv("SERVER_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("SERVER_WORKERS", 1))
+# uvloop when it's installed, which it is in the image.
+worker_class = os.getenv(
+    "SERVER_LOOP", "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+)
+backlog = int(os.getenv("SERVER_BACKLOG", 2048))
+# Longer than the 600 second idle timeout of Google's load balancers, so
+# they never reuse a connection the app has just closed.
+keep_alive_timeout = float(os.getenv("SERVER_KEEP_ALIVE", 620))
+# HTTP/2 is negotiated over TLS, and cleartext HTTP/2 is accepted as is,
+# e.g. from Cloud Run with --use-http2.
+h2_max_concurrent_streams = int(os.getenv("SERVER_H2_STREAMS", 100))
+# Open requests get this long to finish on shutdown, then the app drains its
+# generation jobs for SHUTDOWN_DRAIN_SECONDS.
+graceful_timeout = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 2))
+shutdown_timeout = float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", 30))
+accesslog = os.getenv("SERVER_ACCESS_LOG") or None
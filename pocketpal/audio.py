@@ -1,16 +1,44 @@
+import asyncio
+import logging
 import os
-from typing import Dict, Tuple
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
 from urllib.parse import quote
 
 import aiohttp
+import httpx
 from elevenlabs import VoiceSettings
 from elevenlabs.client import AsyncElevenLabs
 from google.auth import default
 from google.auth.credentials import Credentials
 from google.auth.transport.requests import Request
 
+from pocketpal.gateway import Gateway
+from pocketpal.metrics import Span, span
+
+logger = logging.getLogger(__name__)
+
+TTS_BACKEND = os.getenv("TTS_BACKEND", "elevenlabs")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-BUCKET_NAME = "pocketpal-bucket"
+BUCKET_NAME = os.getenv("BUCKET_NAME", "pocketpal-bucket")
+STORAGE_API_URL = os.getenv("STORAGE_API_URL", "https://storage.googleapis.com")
+# Where clients download blobs from, e.g. a CDN in front of the bucket.
+AUDIO_BASE_URL = os.getenv(
+    "AUDIO_BASE_URL", f"https://storage.googleapis.com/{BUCKET_NAME}"
+)
+
+# Concurrent requests allowed per provider, also the size of each keep-alive pool.
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 8))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 8))
+KEEPALIVE_SECONDS = 60
+
+# The ElevenLabs output format of every branch's audio_url.
+OUTPUT_FORMAT = os.getenv("AUDIO_OUTPUT_FORMAT", "mp3_22050_32")
+VOICE_SETTINGS = VoiceSettings(
+    stability=0.0,
+    similarity_boost=1.0,
+    style=0.0,
+    use_speaker_boost=True,
+)
 
 
 VOICES: Dict[str, Tuple[str, str]] = {
@@ -22,53 +50,254 @@ VOICES: Dict[str, Tuple[str, str]] = {
     # "en": ("BNgbHR0DNeZixGQVzloa", "eleven_turbo_v2"),
 }
 
+# Content type and file extension of the codecs clients can play, by the
+# prefix of the ElevenLabs output format.
+AUDIO_CODECS: Dict[str, Tuple[str, str]] = {
+    "mp3": ("audio/mpeg", "mp3"),
+    "opus": ("audio/ogg", "ogg"),
+}
+
+
+def audio_codec(output_format: str) -> Tuple[str, str]:
+    """Content type and file extension of an ElevenLabs output format."""
+    codec = output_format.partition("_")[0]
+    if codec not in AUDIO_CODECS:
+        raise ValueError(f"Output format {output_format} not supported")
+    return AUDIO_CODECS[codec]
+
+
+def audio_bitrate(output_format: str) -> int:
+    """Bits per second of an ElevenLabs output format, which are all CBR."""
+    return int(output_format.rpartition("_")[2]) * 1000
+
+
+def parse_variants(spec: str) -> Dict[str, str]:
+    """Output formats by variant name from "name=output_format,..."."""
+    variants = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, output_format = item.partition("=")
+        audio_codec(output_format)
+        variants[name.strip()] = output_format.strip()
+    return variants
+
+
+# Extra renditions of every paragraph, requested from ElevenLabs alongside
+# OUTPUT_FORMAT, for clients on slow links. Each one is another TTS call per
+# paragraph, so none by default: the default OUTPUT_FORMAT is already the
+# smallest ElevenLabs offers. Worth it with a bigger main format, e.g.
+# AUDIO_OUTPUT_FORMAT=mp3_44100_64 and AUDIO_VARIANTS=low=mp3_22050_32.
+AUDIO_VARIANTS = parse_variants(os.getenv("AUDIO_VARIANTS", ""))
+
 
 def get_full_url(destination_blob_name: str) -> str:
     """Returns the full URL for a given blob name in the bucket."""
-    return f"https://storage.googleapis.com/{BUCKET_NAME}/{quote(destination_blob_name, safe='')}"
+    return f"{AUDIO_BASE_URL}/{quote(destination_blob_name, safe='')}"
 
 
-async def text_to_audio(language: str, text: str, destination_blob_name: str):
-    """Convert text to audio and upload to Google Cloud Storage"""
-    if language not in VOICES:
-        raise ValueError(f"Language {language} not supported")
-
-    voice_id, model_id = VOICES[language]
-
-    client = AsyncElevenLabs(api_key=ELEVENLABS_API_KEY)
-
-    response = client.text_to_speech.convert(
-        voice_id=voice_id,
-        optimize_streaming_latency="0",
-        output_format="mp3_22050_32",
-        text=text,
-        model_id=model_id,
-        voice_settings=VoiceSettings(
-            stability=0.0,
-            similarity_boost=1.0,
-            style=0.0,
-            use_speaker_boost=True,
-        ),
-    )
+class AudioService:
+    """
+    Application-lifetime clients for ElevenLabs and Cloud Storage. Keeps
+    connections alive between calls and caches the storage access token
+    until it expires. Started and closed by the app's serving hooks, but
+    starts itself lazily if used outside the app.
+    """
+
+    def __init__(self, credentials: Optional[Credentials] = None):
+        self._credentials = credentials
+        self._token_lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+        self._elevenlabs: Optional[AsyncElevenLabs] = None
+        self._httpx_client: Optional[httpx.AsyncClient] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        async with self._start_lock:
+            if self._session is not None:
+                return
+            self._httpx_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0),
+                limits=httpx.Limits(
+                    max_connections=TTS_CONCURRENCY,
+                    max_keepalive_connections=TTS_CONCURRENCY,
+                    keepalive_expiry=KEEPALIVE_SECONDS,
+                ),
+            )
+            self._elevenlabs = AsyncElevenLabs(
+                api_key=ELEVENLABS_API_KEY, httpx_client=self._httpx_client
+            )
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=UPLOAD_CONCURRENCY,
+                    keepalive_timeout=KEEPALIVE_SECONDS,
+                )
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._httpx_client is not None:
+            await self._httpx_client.aclose()
+            self._httpx_client = None
+            self._elevenlabs = None
+
+    async def get_token(self) -> str:
+        """Returns a storage access token, refreshing it off the event loop."""
+        async with self._token_lock:
+            if self._credentials is None:
+                credentials, _ = await asyncio.to_thread(default)
+                assert isinstance(credentials, Credentials)
+                self._credentials = credentials
+            if not self._credentials.valid:
+                await asyncio.to_thread(self._credentials.refresh, Request())
+            return self._credentials.token
+
+    async def synthesize(
+        self, language: str, text: str, output_format: str = OUTPUT_FORMAT
+    ) -> AsyncIterator[bytes]:
+        """Stream audio of the text from ElevenLabs as it is synthesized."""
+        if language not in VOICES:
+            raise ValueError(f"Language {language} not supported")
+
+        voice_id, model_id = VOICES[language]
+
+        await self.start()
+        assert self._elevenlabs is not None
+        # Not activated, since the span would leak into the consuming code.
+        tts_span = Span("tts", language).start(activate=False)
+        try:
+            async for chunk in self._elevenlabs.text_to_speech.convert(
+                voice_id=voice_id,
+                optimize_streaming_latency="0",
+                output_format=output_format,
+                text=text,
+                model_id=model_id,
+                voice_settings=VOICE_SETTINGS,
+            ):
+                yield chunk
+        except BaseException:
+            tts_span.outcome = "error"
+            raise
+        finally:
+            tts_span.finish()
+
+    async def upload_audio(
+        self,
+        data: Union[bytes, AsyncIterator[bytes]],
+        destination_blob_name: str,
+        content_type: str = "audio/mpeg",
+    ):
+        """
+        Upload audio to Google Cloud Storage. When the data is a stream from
+        synthesize, the upload span includes the synthesis.
+        """
+        with span("upload", "gcs"):
+            await self._upload_audio(data, destination_blob_name, content_type)
 
-    credentials, _ = default()
-    assert isinstance(credentials, Credentials)
-    credentials.refresh(Request())
+    async def _upload_audio(
+        self,
+        data: Union[bytes, AsyncIterator[bytes]],
+        destination_blob_name: str,
+        content_type: str,
+    ):
+        await self.start()
+        assert self._session is not None
+        token = await self.get_token()
 
-    async with aiohttp.ClientSession() as session:
         safe_destination_blob_name = quote(destination_blob_name, safe="")
-        url = f"https://storage.googleapis.com/upload/storage/v1/b/{BUCKET_NAME}/o?uploadType=media&name={safe_destination_blob_name}"
+        url = f"{STORAGE_API_URL}/upload/storage/v1/b/{BUCKET_NAME}/o?uploadType=media&name={safe_destination_blob_name}"
 
         headers = {
-            "Authorization": f"Bearer {credentials.token}",
-            "Content-Type": "audio/mpeg",
+            "Authorization": f"Bearer {token}",
+            "Content-Type": content_type,
         }
 
-        async with session.post(url, headers=headers, data=response) as upload_response:
+        async with self._session.post(
+            url, headers=headers, data=data
+        ) as upload_response:
             if upload_response.status != 200:
                 error_text = await upload_response.text()
                 raise Exception(
                     f"Failed to upload file to {destination_blob_name} in bucket {BUCKET_NAME}. Status code: {upload_response.status}. Error: {error_text}"
                 )
 
-    print(f"File uploaded to {destination_blob_name} in bucket {BUCKET_NAME}.")
+        logger.info(f"File uploaded to {destination_blob_name} in bucket {BUCKET_NAME}.")
+
+    async def blob_exists(self, blob_name: str) -> bool:
+        """Check whether a blob exists in the bucket without downloading it."""
+        return await self.blob_size(blob_name) is not None
+
+    async def blob_size(self, blob_name: str) -> Optional[int]:
+        """The size of a blob in the bucket, or None if it doesn't exist."""
+        await self.start()
+        assert self._session is not None
+        token = await self.get_token()
+
+        url = f"{STORAGE_API_URL}/storage/v1/b/{BUCKET_NAME}/o/{quote(blob_name, safe='')}"
+        headers = {"Authorization": f"Bearer {token}"}
+        async with self._session.get(url, headers=headers) as response:
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(
+                    f"Failed to look up {blob_name} in bucket {BUCKET_NAME}. Status code: {response.status}. Error: {error_text}"
+                )
+            metadata = await response.json()
+            return int(metadata["size"])
+
+    async def download_audio(self, blob_name: str) -> AsyncIterator[bytes]:
+        """Stream a blob out of the bucket."""
+        await self.start()
+        assert self._session is not None
+        token = await self.get_token()
+
+        url = f"{STORAGE_API_URL}/storage/v1/b/{BUCKET_NAME}/o/{quote(blob_name, safe='')}?alt=media"
+        headers = {"Authorization": f"Bearer {token}"}
+        async with self._session.get(url, headers=headers) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(
+                    f"Failed to download {blob_name} from bucket {BUCKET_NAME}. Status code: {response.status}. Error: {error_text}"
+                )
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                yield chunk
+
+
+audio_service = AudioService()
+
+
+def make_tts_backend():
+    if TTS_BACKEND == "fake":
+        from pocketpal.fakes import FakeTTS, Faults
+
+        return FakeTTS(Faults.from_env("FAKE_TTS"))
+    return audio_service
+
+
+tts_backend = make_tts_backend()
+# Rate limits and circuit breakers are per voice. The concurrency limit also
+# keeps calls within the size of the keep-alive pool.
+tts_gateway = Gateway.from_env("tts", "TTS", concurrency=TTS_CONCURRENCY)
+
+
+def synthesize(
+    language: str, text: str, output_format: str = OUTPUT_FORMAT
+) -> AsyncIterator[bytes]:
+    """Stream audio of the text from the TTS backend as it is synthesized."""
+    voice_id = VOICES[language][0] if language in VOICES else language
+    return tts_gateway.stream(
+        lambda: tts_backend.synthesize(language, text, output_format), key=voice_id
+    )
+
+
+async def upload_audio(
+    data: Union[bytes, AsyncIterator[bytes]], destination_blob_name: str
+):
+    """Upload MP3 audio to Google Cloud Storage"""
+    await audio_service.upload_audio(data, destination_blob_name)
+
+
+async def text_to_audio(language: str, text: str, destination_blob_name: str):
+    """Convert text to audio and upload to Google Cloud Storage"""
+    await upload_audio(synthesize(language, text), destination_blob_name)
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union
+
+from pocketpal.audio import (
+    AUDIO_VARIANTS,
+    OUTPUT_FORMAT,
+    VOICE_SETTINGS,
+    AUDIO_CODECS,
+    VOICES,
+    audio_bitrate,
+    audio_codec,
+    synthesize,
+)
+from pocketpal.cache import LRUCache
+from pocketpal.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_SIZE = int(os.getenv("AUDIO_CACHE_SIZE", 10000))
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def audio_key(language: str, text: str, output_format: str = OUTPUT_FORMAT) -> str:
+    """Hash of everything that affects the synthesized audio."""
+    if language not in VOICES:
+        raise ValueError(f"Language {language} not supported")
+    voice_id, model_id = VOICES[language]
+    payload = json.dumps(
+        {
+            "voice_id": voice_id,
+            "model_id": model_id,
+            "output_format": output_format,
+            "voice_settings": VOICE_SETTINGS.dict(),
+            "text": normalize_text(text),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def audio_blob_name(key: str, output_format: str = OUTPUT_FORMAT) -> str:
+    return f"audios/{key}.{audio_codec(output_format)[1]}"
+
+
+class AudioCache:
+    """
+    Content-addressed audio. Blobs are named after a hash of the voice and
+    the normalized text, so identical paragraphs are synthesized and uploaded
+    once. Known blob names are kept in an LRU in front of the storage lookup.
+    Each output format is its own blob, so variants are cached the same way.
+    """
+
+    def __init__(
+        self,
+        storage,
+        synthesize: Callable[[str, str, str], AsyncIterator[bytes]] = synthesize,
+        maxsize: int = AUDIO_CACHE_SIZE,
+        variants: Dict[str, str] = AUDIO_VARIANTS,
+    ):
+        self.storage = storage
+        self.synthesize = synthesize
+        self.variants = variants
+        self.known = LRUCache(maxsize)
+        # Blob sizes never change, since the names are content addressed.
+        self.sizes = LRUCache(maxsize)
+        self._flight = SingleFlight()
+
+    async def text_to_audio(
+        self, language: str, text: str, output_format: str = OUTPUT_FORMAT
+    ) -> str:
+        """Returns the blob name of the audio, synthesizing it if needed."""
+        key = audio_key(language, text, output_format)
+        blob_name = audio_blob_name(key, output_format)
+        if self.known.get(key):
+            return blob_name
+
+        # Identical concurrent requests share a single synthesis.
+        return await self._flight.do(
+            key,
+            lambda: self._synthesize(key, blob_name, language, text, output_format),
+        )
+
+    async def _synthesize(
+        self, key: str, blob_name: str, language: str, text: str, output_format: str
+    ):
+        if not await self.storage.exists(blob_name):
+            await self.storage.put(
+                blob_name,
+                self.synthesize(language, text, output_format),
+                audio_codec(output_format)[0],
+            )
+        self.known.set(key, True)
+        return blob_name
+
+    async def text_to_variants(self, language: str, text: str) -> Dict[str, str]:
+        """
+        Blob names of the extra variants of the audio by variant name. The
+        variants are synthesized concurrently, and one that fails is left
+        out rather than failing the others, since the main audio suffices.
+        """
+        names = list(self.variants)
+        results = await asyncio.gather(
+            *(
+                self.text_to_audio(language, text, self.variants[name])
+                for name in names
+            ),
+            return_exceptions=True,
+        )
+        variants = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Audio variant failed: variant={name}, error={result!r}")
+            else:
+                variants[name] = result
+        return variants
+
+    async def store(
+        self, language: str, text: str, data: Union[bytes, AsyncIterator[bytes]]
+    ) -> str:
+        """Store audio that was synthesized elsewhere and return its blob name."""
+        key = audio_key(language, text)
+        blob_name = audio_blob_name(key)
+        if not self.known.get(key) and not await self.storage.exists(blob_name):
+            await self.storage.put(blob_name, data)
+        self.known.set(key, True)
+        return blob_name
+
+    async def duration(
+        self, blob_name: str, output_format: str = OUTPUT_FORMAT
+    ) -> Optional[float]:
+        """Seconds of audio in a blob, from its size, or None if it's missing."""
+        size = self.sizes.get(blob_name)
+        if size is None:
+            size = await self.storage.size(blob_name)
+            if size is None:
+                return None
+            self.sizes.set(blob_name, size)
+        return size * 8 / audio_bitrate(output_format)
+
+    async def concatenate(self, blob_names: List[str]) -> str:
+        """
+        Returns the blob name of one file with the audio of the blobs in
+        order, building it if needed. It's named after the blobs, so each
+        sequence is only built once. MP3 frames and Ogg streams both play
+        back to back when concatenated.
+        """
+        digest = hashlib.sha256("\n".join(blob_names).encode()).hexdigest()[:32]
+        extension = blob_names[0].rpartition(".")[2]
+        blob_name = f"audiobooks/{digest}.{extension}"
+        if self.known.get(blob_name):
+            return blob_name
+        return await self._flight.do(
+            blob_name, lambda: self._concatenate(blob_name, blob_names)
+        )
+
+    async def _concatenate(self, blob_name: str, blob_names: List[str]) -> str:
+        if not await self.storage.exists(blob_name):
+
+            async def chunks():
+                for name in blob_names:
+                    async for chunk in self.storage.read(name):
+                        yield chunk
+
+            extension = blob_name.rpartition(".")[2]
+            content_type = next(
+                content_type
+                for content_type, codec_extension in AUDIO_CODECS.values()
+                if codec_extension == extension
+            )
+            await self.storage.put(blob_name, chunks(), content_type)
+        self.known.set(blob_name, True)
+        return blob_name
@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Mapping that evicts the least recently used entry once it holds maxsize
+    entries. Entries can also expire after a time-to-live in seconds.
+    on_evict is called with the values that are evicted or expire.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, MISSING, count=False) is not MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > self.clock():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self._data[key]
+            self._evicted(value)
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = self.clock() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self._evicted(evicted)
+
+    def _evicted(self, value: Any):
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class MemoryStore:
+    """Local stand-in for Redis, for tests and single-process deployments."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._data: Dict[str, Tuple[Optional[float], str]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._data[key] = (self.clock() + ttl if ttl is not None else None, value)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class RedisStore:
+    """Shared cache tier on any Redis-compatible server."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.client.set(key, value, ex=int(ttl) if ttl is not None else None)
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+
+def make_shared_store():
+    """The shared tier configured by CACHE_REDIS_URL, if any."""
+    url = os.getenv("CACHE_REDIS_URL")
+    if not url:
+        return None
+    if url == "memory":
+        return MemoryStore()
+    return RedisStore(url)
+
+
+class ReadThroughCache:
+    """
+    JSON payloads in a process-local LRU, in front of an optional shared
+    store so that replicas can fill each other's caches.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        store=None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.store = store
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[dict]:
+        payload = self.memory.get(key)
+        if payload is None and self.store is not None:
+            value = await self.store.get(self._key(key))
+            if value is not None:
+                payload = json.loads(value)
+                self.memory.set(key, payload)
+        return payload
+
+    async def set(self, key: str, payload: dict):
+        self.memory.set(key, payload)
+        if self.store is not None:
+            await self.store.set(self._key(key), json.dumps(payload), self.ttl)
+
+    def prime(self, key: str, payload: dict):
+        """Fill only the local tier, e.g. when warming up a new instance."""
+        self.memory.set(key, payload)
+
+    async def invalidate(self, key: str):
+        self.memory.pop(key)
+        if self.store is not None:
+            await self.store.delete(self._key(key))
@@ -0,0 +1,106 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+import tiktoken
+
+from pocketpal.llm import LLM_MODEL, summarize_story
+
+logger = logging.getLogger(__name__)
+
+# Most tokens the story part of a prompt may use, summary included.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# Paragraphs that are always kept verbatim when the story gets summarized.
+CONTEXT_RECENT_PARAGRAPHS = int(os.getenv("CONTEXT_RECENT_PARAGRAPHS", 4))
+# Part of the budget set aside for the summary.
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 300))
+
+
+_encoding = None
+
+
+def load_encoding():
+    """
+    The token encoding of the model. Loading it may download it, so the app
+    loads it off the event loop when it starts.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+        except KeyError:
+            # A model tiktoken doesn't know yet.
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return len(load_encoding().encode(text))
+
+
+def split_paragraphs(story: Optional[str]) -> List[str]:
+    """The paragraphs of a story_prefix, in the order they were written."""
+    return story.split("\n\n") if story else []
+
+
+@dataclass
+class StoryContext:
+    text: str
+    # The summary and how many paragraphs it covers, to store on the branch.
+    summary: Optional[str]
+    summary_depth: int
+    tokens: int
+
+
+def format_context(summary: Optional[str], recent: List[str]) -> str:
+    story = "\n\n".join(recent)
+    if not summary:
+        return story
+    return f"[Summary of the story so far]\n{summary}\n\n[Most recent paragraphs]\n{story}"
+
+
+async def build_context(
+    story: Optional[str],
+    language: str,
+    summary: Optional[str] = None,
+    summary_depth: int = 0,
+) -> StoryContext:
+    """
+    The story to prompt with: the most recent paragraphs verbatim after the
+    summary of the ones before them. The summary passed in is the parent
+    branch's, and it's only extended once the paragraphs after it no longer
+    fit in the token budget or outnumber twice CONTEXT_RECENT_PARAGRAPHS, so
+    most branches reuse it as is.
+    """
+    paragraphs = split_paragraphs(story)
+    summary_depth = min(summary_depth, len(paragraphs))
+    recent = paragraphs[summary_depth:]
+    tokens = count_tokens(summary) + sum(count_tokens(p) for p in recent)
+    if tokens <= CONTEXT_TOKEN_BUDGET and len(recent) <= 2 * CONTEXT_RECENT_PARAGRAPHS:
+        return StoryContext(format_context(summary, recent), summary, summary_depth, tokens)
+
+    # Keep as many recent paragraphs as fit next to the summary, at least one.
+    keep = 0
+    recent_tokens = 0
+    for paragraph in reversed(recent[-CONTEXT_RECENT_PARAGRAPHS:]):
+        paragraph_tokens = count_tokens(paragraph)
+        if keep and recent_tokens + paragraph_tokens > CONTEXT_TOKEN_BUDGET - CONTEXT_SUMMARY_TOKENS:
+            break
+        keep += 1
+        recent_tokens += paragraph_tokens
+
+    folded = recent[: len(recent) - keep]
+    if folded:
+        # Roughly three quarters of a word per token.
+        max_words = CONTEXT_SUMMARY_TOKENS * 3 // 4
+        summary = await summarize_story(language, summary, folded, max_words)
+        summary_depth += len(folded)
+        recent = recent[len(recent) - keep :]
+        logger.info(
+            f"Summarized story: paragraphs={summary_depth}, kept={len(recent)}"
+        )
+    tokens = count_tokens(summary) + recent_tokens
+    return StoryContext(format_context(summary, recent), summary, summary_depth, tokens)
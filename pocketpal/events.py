@@ -0,0 +1,36 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, Set
+
+
+class Notifier:
+    """
+    Wakes up everyone watching a key when it changes. Only changes made in
+    this process are seen, so watchers should still re-check now and then.
+    """
+
+    def __init__(self):
+        self._watchers: Dict[Hashable, Set[asyncio.Event]] = defaultdict(set)
+
+    def notify(self, key: Hashable):
+        for event in self._watchers.get(key, ()):
+            event.set()
+
+    @contextmanager
+    def watch(self, key: Hashable) -> Iterator[asyncio.Event]:
+        """
+        An event that is set on every change to the key. Clear it before
+        reading the current state, so that no change goes unnoticed.
+        """
+        event = asyncio.Event()
+        self._watchers[key].add(event)
+        try:
+            yield event
+        finally:
+            self._watchers[key].discard(event)
+            if not self._watchers[key]:
+                del self._watchers[key]
+
+    def __len__(self) -> int:
+        return sum(len(events) for events in self._watchers.values())
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from typing import AsyncIterator, Callable, List, Optional, Union
+
+from pocketpal.metrics import span
+
+FAKE_PARAGRAPH = (
+    "You follow the narrow path until it splits in two. To the left, warm "
+    "light spills from a cottage window. To the right, the forest grows "
+    "dark and quiet. Do you knock on the cottage door, or keep walking?"
+)
+
+
+class FakeProviderError(Exception):
+    """A failure injected into a fake provider."""
+
+
+def parse_distribution(spec: str, rng: random.Random) -> Callable[[], float]:
+    """
+    A latency distribution in seconds from a spec like "0.2", "uniform:0.1,0.5",
+    "normal:0.3,0.1", "lognormal:0.8,0.4" (median and sigma) or
+    "exponential:0.5" (mean). Samples are never negative.
+    """
+    kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    params = [float(arg) for arg in args.split(",") if arg]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: params[0] * math.exp(rng.gauss(0, params[1]))
+    if kind == "exponential":
+        return lambda: rng.expovariate(1 / params[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class Faults:
+    """
+    Latency and failures to inject into a fake provider, configurable from
+    the environment, e.g. FAKE_LLM_LATENCY="lognormal:0.8,0.4" and
+    FAKE_LLM_FAILURE_RATE=0.02.
+    """
+
+    def __init__(
+        self,
+        latency: str = "0",
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.rng = random.Random(seed)
+        self.latency = parse_distribution(latency, self.rng)
+        self.failure_rate = failure_rate
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "Faults":
+        seed = os.getenv("FAKE_SEED")
+        return cls(
+            latency=os.getenv(f"{prefix}_LATENCY", "0"),
+            failure_rate=float(os.getenv(f"{prefix}_FAILURE_RATE", 0)),
+            seed=int(seed) if seed is not None else None,
+        )
+
+    async def inject(self, extra_latency: float = 0.0):
+        """Wait for a sampled latency, then fail at the configured rate."""
+        await asyncio.sleep(self.latency() + extra_latency)
+        if self.rng.random() < self.failure_rate:
+            raise FakeProviderError("Injected failure")
+
+
+def fake_completion(prompt: str) -> str:
+    """A plausible, deterministic paragraph for any of the app's prompts."""
+    digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+    return f"{FAKE_PARAGRAPH} ({digest})"
+
+
+def fake_tool_arguments(name: str, prompt: str) -> str:
+    """Plausible, deterministic arguments for the app's tools."""
+    if name == "create_story":
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        language = re.search(r'"language": "(\w+)"', prompt)
+        return json.dumps(
+            {
+                "lang": language.group(1) if language else "en",
+                "title": f"The Forked Path {digest}",
+                "description": "A walk in the woods with a choice at every turn.",
+                "paragraph": FAKE_PARAGRAPH,
+            }
+        )
+    if name == "write_paragraphs":
+        return json.dumps(
+            {
+                sentiment: fake_completion(f"{prompt}\0{sentiment}")
+                for sentiment in ("positive", "negative")
+            }
+        )
+    if name == "summarize_story":
+        return json.dumps({"summary": FAKE_PARAGRAPH})
+    return json.dumps({"paragraph": fake_completion(prompt)})
+
+
+class FakeLLM:
+    """
+    Stand-in for the OpenAI backend that needs no network. Responses come
+    from the script (a list consumed in order, or a function of the prompt),
+    falling back to fake_completion. Each call takes latency seconds, plus
+    token_latency seconds per prompt token to mimic prompt processing, plus
+    output_token_latency seconds per token of tool call arguments to mimic
+    decoding, plus whatever the faults add.
+    """
+
+    def __init__(
+        self,
+        model: str = "fake",
+        script: Optional[Union[List[str], Callable[[str], str]]] = None,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        faults: Optional[Faults] = None,
+        output_token_latency: float = 0.0,
+    ):
+        self.model = model
+        self.script = script
+        self.latency = latency
+        self.token_latency = token_latency
+        self.output_token_latency = output_token_latency
+        self.faults = faults or Faults()
+        self.prompts: List[str] = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.prompts)
+
+    def _delay(self, prompt: str) -> float:
+        # Roughly four characters per token.
+        return self.latency + self.token_latency * len(prompt) / 4
+
+    def _respond(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        if callable(self.script):
+            return self.script(prompt)
+        if self.script:
+            return self.script.pop(0)
+        return fake_completion(prompt)
+
+    async def call_tool(
+        self, system: str, user: str, tool: dict, feedback: Optional[str] = None
+    ):
+        from pocketpal.llm import ToolCall
+
+        name = tool["function"]["name"]
+        prompt = f"{system}\n\n{user}"
+        await self.faults.inject(self._delay(prompt))
+        self.prompts.append(prompt)
+        if callable(self.script):
+            arguments = self.script(prompt)
+        elif self.script:
+            arguments = self.script.pop(0)
+        else:
+            arguments = fake_tool_arguments(name, prompt)
+        await asyncio.sleep(self.output_token_latency * len(arguments) / 4)
+        return ToolCall(arguments, len(prompt) // 4, len(arguments) // 4)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        await self.faults.inject(self._delay(prompt) - self.latency)
+        completion = self._respond(prompt)
+        words = completion.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield word if i == 0 else f" {word}"
+
+
+# One MPEG-2 Layer III frame of silence at 32 kbps, 22050 Hz, mono, which
+# matches the ElevenLabs output format. Each frame is 576 samples long.
+SILENT_MP3_FRAME = b"\xff\xf3\x40\xc0" + b"\x00" * 100
+SILENT_MP3_FRAME_SECONDS = 576 / 22050
+# Roughly how fast the voices speak.
+CHARACTERS_PER_SECOND = 15
+
+
+class FakeTTS:
+    """
+    Stand-in for ElevenLabs that streams silent MP3 about as long as the
+    text would take to read, in chunks like a real synthesis.
+    """
+
+    def __init__(self, faults: Optional[Faults] = None, frames_per_chunk: int = 40):
+        self.faults = faults or Faults()
+        self.frames_per_chunk = frames_per_chunk
+        self.texts: List[str] = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.texts)
+
+    async def synthesize(
+        self, language: str, text: str, output_format: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        # Every output format gets the same silent MP3, only its length matters.
+        self.texts.append(text)
+        await self.faults.inject()
+        seconds = len(text) / CHARACTERS_PER_SECOND
+        frames = max(1, round(seconds / SILENT_MP3_FRAME_SECONDS))
+        for start in range(0, frames, self.frames_per_chunk):
+            yield SILENT_MP3_FRAME * min(self.frames_per_chunk, frames - start)
+            await asyncio.sleep(0)
+
+
+class FakeRemoteStorage:
+    """
+    Local storage whose writes take as long and fail as often as the faults
+    say, to stand in for a remote store. Everything else is passed through.
+    """
+
+    def __init__(self, storage, faults: Optional[Faults] = None):
+        self.storage = storage
+        self.faults = faults or Faults()
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+    async def put(self, blob_name: str, data, content_type: str = "audio/mpeg"):
+        with span("upload", "fake"):
+            await self.faults.inject()
+        await self.storage.put(blob_name, data, content_type)
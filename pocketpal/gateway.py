@@ -0,0 +1,315 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from pocketpal.jobs import PRIORITY_USER
+from pocketpal.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# The lane provider calls made in this context wait in. Generation jobs set
+# it to their own priority, everything else is user-facing.
+current_priority: ContextVar[int] = ContextVar("current_priority", default=PRIORITY_USER)
+
+# Errors in the caller's input, which retrying or tripping the breaker won't fix.
+NOT_RETRYABLE = (ValueError, TypeError)
+
+provider_calls = registry.counter(
+    "pocketpal_provider_calls_total",
+    "Provider call attempts through a gateway, by outcome.",
+    ("gateway", "key", "outcome"),
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider that keeps failing."""
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, and bursts of up to burst."""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PrioritySemaphore:
+    """
+    Bounded concurrency where waiters with a lower priority value go first.
+    The reserved slots are only handed to user-facing calls, so speculative
+    work can never take the whole provider.
+    """
+
+    def __init__(self, limit: int, reserved: int = 0):
+        self.limit = limit
+        self.reserved = min(reserved, limit - 1)
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def _can_start(self, priority: int) -> bool:
+        free = self.limit - self.active
+        return free > (self.reserved if priority > PRIORITY_USER else 0)
+
+    async def acquire(self, priority: int = PRIORITY_USER):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_start(priority):
+                return
+            heapq.heappop(self._waiters)
+            self.active += 1
+            future.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures and fails calls fast until
+    reset_seconds have passed. Then a single trial call decides whether it
+    closes again.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        reset_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        if self.trial or self.clock() - self.opened_at < self.reset_seconds:
+            raise CircuitOpenError("Provider is failing, not calling it for now")
+        self.trial = True
+
+    def record(self, ok: bool):
+        self.trial = False
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = self.clock()
+
+
+class Gateway:
+    """
+    Everything between the app and one provider: a token bucket and circuit
+    breaker per key (the model or voice), a priority semaphore shared by all
+    keys, and retries with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0,
+        burst: float = 1,
+        concurrency: int = 8,
+        reserved: int = 0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.semaphore = PrioritySemaphore(concurrency, reserved)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, concurrency: int = 8) -> "Gateway":
+        """
+        Configured by {prefix}_RATE_LIMIT (calls per second, 0 for none),
+        {prefix}_BURST, {prefix}_CONCURRENCY, {prefix}_RESERVED (slots kept
+        for user-facing calls), {prefix}_RETRIES, {prefix}_RETRY_BACKOFF,
+        {prefix}_BREAKER_THRESHOLD and {prefix}_BREAKER_RESET_SECONDS.
+        """
+        concurrency = int(os.getenv(f"{prefix}_CONCURRENCY", concurrency))
+        return cls(
+            name,
+            rate=float(os.getenv(f"{prefix}_RATE_LIMIT", 0)),
+            burst=float(os.getenv(f"{prefix}_BURST", max(1, concurrency))),
+            concurrency=concurrency,
+            reserved=int(os.getenv(f"{prefix}_RESERVED", concurrency // 4)),
+            retries=int(os.getenv(f"{prefix}_RETRIES", 2)),
+            backoff=float(os.getenv(f"{prefix}_RETRY_BACKOFF", 0.5)),
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", 5)),
+            reset_seconds=float(os.getenv(f"{prefix}_BREAKER_RESET_SECONDS", 30)),
+        )
+
+    def _bucket(self, key: str) -> TokenBucket:
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return self.buckets[key]
+
+    def _breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return self.breakers[key]
+
+    def _check(self, key: str) -> CircuitBreaker:
+        breaker = self._breaker(key)
+        try:
+            breaker.check()
+        except CircuitOpenError:
+            provider_calls.inc(gateway=self.name, key=key, outcome="rejected")
+            raise
+        return breaker
+
+    async def _acquire(self, breaker: CircuitBreaker, priority: int):
+        # Called right after _check, so a trial in progress is this call's.
+        trial = breaker.trial
+        try:
+            await self.semaphore.acquire(priority)
+        except BaseException:
+            # Cancelled while waiting for a slot, before the trial was made.
+            if trial:
+                breaker.trial = False
+            raise
+
+    def _record(self, breaker: CircuitBreaker, key: str, error: Optional[Exception] = None):
+        was_open = breaker.is_open
+        breaker.record(error is None)
+        provider_calls.inc(
+            gateway=self.name, key=key, outcome="error" if error else "ok"
+        )
+        if breaker.is_open and not was_open:
+            logger.warning(f"Circuit opened: gateway={self.name}, key={key}, error={error!r}")
+        elif was_open and not breaker.is_open:
+            logger.info(f"Circuit closed: gateway={self.name}, key={key}")
+
+    async def _backoff(self, key: str, attempt: int, error: Exception):
+        delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+        logger.warning(
+            f"Retrying provider call: gateway={self.name}, key={key}, attempt={attempt + 1}, delay={delay:.2f}s, error={error!r}"
+        )
+        await asyncio.sleep(delay)
+
+    async def call(
+        self, fn: Callable[[], Awaitable[T]], key: str = "default", priority: Optional[int] = None
+    ) -> T:
+        priority = current_priority.get() if priority is None else priority
+        for attempt in range(self.retries + 1):
+            breaker = self._check(key)
+            await self._acquire(breaker, priority)
+            try:
+                await self._bucket(key).acquire()
+                result = await fn()
+            except NOT_RETRYABLE:
+                breaker.trial = False
+                raise
+            except Exception as e:
+                self._record(breaker, key, e)
+                if attempt == self.retries:
+                    raise
+                error = e
+            except BaseException:
+                # A cancelled trial says nothing about the provider, so let
+                # the next call try it instead.
+                breaker.trial = False
+                raise
+            else:
+                self._record(breaker, key)
+                return result
+            finally:
+                self.semaphore.release()
+            await self._backoff(key, attempt, error)
+
+    async def stream(
+        self,
+        make_stream: Callable[[], AsyncIterator[T]],
+        key: str = "default",
+        priority: Optional[int] = None,
+    ) -> AsyncIterator[T]:
+        """
+        Like call for streaming responses, holding the slot until the stream
+        ends. Only failures before the first item are retried, since the
+        consumer has already seen the items before that.
+        """
+        priority = current_priority.get() if priority is None else priority
+        for attempt in range(self.retries + 1):
+            breaker = self._check(key)
+            await self._acquire(breaker, priority)
+            started = False
+            try:
+                await self._bucket(key).acquire()
+                async for item in make_stream():
+                    started = True
+                    yield item
+            except NOT_RETRYABLE:
+                breaker.trial = False
+                raise
+            except Exception as e:
+                self._record(breaker, key, e)
+                if started or attempt == self.retries:
+                    raise
+                error = e
+            except BaseException:
+                # Cancelled, or closed early by the consumer.
+                breaker.trial = False
+                raise
+            else:
+                self._record(breaker, key)
+                return
+            finally:
+                self.semaphore.release()
+            await self._backoff(key, attempt, error)
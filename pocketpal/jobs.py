@@ -0,0 +1,390 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", 4))
+# Workers synthesizing audio for branches that already have their text.
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", 4))
+# How many levels below a served branch get generated ahead of time.
+GENERATION_DEPTH = int(os.getenv("GENERATION_DEPTH", 1))
+# Upper bound on speculative jobs waiting in the queue at any time.
+GENERATION_BUDGET = int(os.getenv("GENERATION_BUDGET", 64))
+# Running jobs older than this are assumed to belong to a dead process.
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 600))
+# Finished jobs are kept this long, to look into failures, then deleted.
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 60 * 60))
+# How often the workers delete finished jobs past their retention.
+JOB_PRUNE_INTERVAL_SECONDS = int(os.getenv("JOB_PRUNE_INTERVAL_SECONDS", 600))
+
+PRIORITY_USER = 0
+PRIORITY_SPECULATIVE = 10
+
+
+@dataclass
+class Job:
+    story_id: str
+    branch_id: str
+    priority: int = PRIORITY_SPECULATIVE
+    depth: int = 0
+    status: str = "queued"
+    attempts: int = 0
+    error: Optional[str] = None
+
+    @property
+    def sort_key(self):
+        return (self.priority, self.depth)
+
+
+class MemoryJobStore:
+    """Keeps jobs in process memory. Used by tests and local development."""
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.finished_at: Dict[str, float] = {}
+
+    async def save(self, job: Job):
+        self.jobs[job.branch_id] = replace(job)
+        if job.status in ("done", "failed"):
+            self.finished_at[job.branch_id] = time.monotonic()
+        else:
+            self.finished_at.pop(job.branch_id, None)
+
+    async def prune(self, retention_seconds: float) -> int:
+        cutoff = time.monotonic() - retention_seconds
+        expired = [
+            branch_id
+            for branch_id, finished_at in self.finished_at.items()
+            if finished_at <= cutoff
+        ]
+        for branch_id in expired:
+            del self.jobs[branch_id]
+            del self.finished_at[branch_id]
+        return len(expired)
+
+    async def load_pending(self) -> List[Job]:
+        return [
+            replace(job, status="queued")
+            for job in self.jobs.values()
+            if job.status in ("queued", "running")
+        ]
+
+
+class PostgresJobStore:
+    """Persists jobs in the generation_jobs table so they survive restarts."""
+
+    def __init__(self):
+        from pocketpal.db import query, statement
+
+        self._query = query
+        self._statement = statement
+
+    async def save(self, job: Job):
+        await self._query(
+            self._statement(
+                "save_job",
+                """
+            INSERT INTO generation_jobs
+            (branch_id, story_id, priority, depth, status, attempts, error, updated_at)
+            VALUES (:branch_id, :story_id, :priority, :depth, :status, :attempts, :error, now())
+            ON CONFLICT (branch_id) DO UPDATE SET
+                priority = EXCLUDED.priority,
+                depth = EXCLUDED.depth,
+                status = EXCLUDED.status,
+                attempts = EXCLUDED.attempts,
+                error = EXCLUDED.error,
+                updated_at = now()
+            """,
+            ),
+            branch_id=job.branch_id,
+            story_id=job.story_id,
+            priority=job.priority,
+            depth=job.depth,
+            status=job.status,
+            attempts=job.attempts,
+            error=job.error,
+        )
+
+    async def load_pending(self) -> List[Job]:
+        # A stale running job means its process died mid-generation, so roll
+        # the branch back to the last state it can be resumed from.
+        await self._query(
+            self._statement(
+                "recover_stale_jobs",
+                """
+            WITH stale AS (
+                UPDATE generation_jobs SET status = 'queued', updated_at = now()
+                WHERE status = 'running'
+                AND updated_at < now() - make_interval(secs => :stale_seconds)
+                RETURNING branch_id
+            )
+            UPDATE branches b SET
+                status = CASE b.status
+                    WHEN 'generating-text' THEN 'new'
+                    ELSE 'text-only'
+                END
+            FROM stale
+            WHERE b.branch_id = stale.branch_id
+            AND b.status IN ('generating-text', 'generating-audio')
+            """,
+            ),
+            stale_seconds=JOB_STALE_SECONDS,
+        )
+        result = await self._query(
+            self._statement(
+                "load_pending_jobs",
+                """
+            SELECT branch_id, story_id, priority, depth, status, attempts, error
+            FROM generation_jobs
+            WHERE status = 'queued'
+            ORDER BY priority, depth, created_at
+            """,
+            )
+        )
+        return [Job(**row._mapping) for row in result.fetchall()]
+
+    async def prune(self, retention_seconds: float) -> int:
+        result = await self._query(
+            self._statement(
+                "prune_jobs",
+                """
+            DELETE FROM generation_jobs
+            WHERE status IN ('done', 'failed')
+            AND updated_at < now() - make_interval(secs => :retention_seconds)
+            """,
+            ),
+            retention_seconds=retention_seconds,
+        )
+        return result.rowcount
+
+
+class PendingAudioStore:
+    """
+    Jobs of the audio queue. It needs no table of its own, since every
+    text-only branch is waiting for audio.
+    """
+
+    def __init__(self, limit: int = 1000):
+        from pocketpal.db import query, statement
+
+        self._query = query
+        self._statement = statement
+        self.limit = limit
+
+    async def save(self, job: Job):
+        pass
+
+    async def prune(self, retention_seconds: float) -> int:
+        return 0
+
+    async def load_pending(self) -> List[Job]:
+        result = await self._query(
+            self._statement(
+                "load_pending_audio",
+                """
+            SELECT branch_id, story_id
+            FROM branches
+            WHERE status = 'text-only'
+            ORDER BY status_updated_at DESC
+            LIMIT :limit
+            """,
+            ),
+            limit=self.limit,
+        )
+        return [Job(**row._mapping) for row in result.fetchall()]
+
+
+def make_job_store():
+    if os.getenv("JOB_STORE", "postgres") == "memory":
+        return MemoryJobStore()
+    return PostgresJobStore()
+
+
+def make_audio_job_store():
+    if os.getenv("JOB_STORE", "postgres") == "memory":
+        return MemoryJobStore()
+    return PendingAudioStore()
+
+
+class GenerationQueue:
+    """
+    Priority queue of branch generation jobs drained by a pool of asyncio
+    workers. User-facing jobs always run before speculative ones, and there
+    is at most one pending job per branch.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Job], Awaitable[None]],
+        store,
+        workers: int = GENERATION_WORKERS,
+        budget: int = GENERATION_BUDGET,
+        name: str = "generation",
+    ):
+        self.name = name
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.budget = budget
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._pending: Dict[str, Job] = {}
+        self._running: Dict[str, Job] = {}
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._counter = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._busy: Set[asyncio.Task] = set()
+        self._stopping = False
+        self._pruned_at: Optional[float] = None
+
+    async def start(self):
+        self._stopping = False
+        for job in await self.store.load_pending():
+            self._push(job)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(
+            f"Job queue started: name={self.name}, workers={self.workers}, recovered={len(self._pending)}"
+        )
+
+    async def stop(self, timeout: float = 0):
+        """
+        Stop the workers. Running jobs get up to timeout seconds to finish
+        first, and the ones that don't are cancelled and left queued in the
+        store, like the jobs that never started.
+        """
+        self._stopping = True
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if timeout > 0 and self._busy:
+            logger.info(
+                f"Draining job queue: name={self.name}, running={len(self._running)}, timeout={timeout}s"
+            )
+            await asyncio.wait(set(self._busy), timeout=timeout)
+        if self._running:
+            logger.warning(
+                f"Cancelling running jobs: name={self.name}, branch_ids={list(self._running)}"
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self, branch_id: str) -> Optional[str]:
+        if branch_id in self._running:
+            return "running"
+        if branch_id in self._pending:
+            return "queued"
+        return None
+
+    async def wait(self, branch_id: str, timeout: float) -> bool:
+        """
+        Wait until no job is queued or running for the branch. Returns False
+        if that didn't happen within the timeout.
+        """
+        if self.status(branch_id) is None:
+            return True
+        event = self._waiters.setdefault(branch_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def speculative_count(self) -> int:
+        return sum(
+            1 for job in self._pending.values() if job.priority > PRIORITY_USER
+        )
+
+    async def enqueue(
+        self,
+        story_id: str,
+        branch_id: str,
+        priority: int = PRIORITY_SPECULATIVE,
+        depth: int = 0,
+    ) -> Optional[Job]:
+        """Queue a branch for generation, or return the equivalent queued job."""
+        for current in (self._pending.get(branch_id), self._running.get(branch_id)):
+            if current and current.sort_key <= (priority, depth):
+                return current
+        if priority > PRIORITY_USER and self.speculative_count() >= self.budget:
+            logger.debug(f"Speculation budget exhausted, skipping branch_id={branch_id}")
+            return None
+
+        job = Job(story_id=story_id, branch_id=branch_id, priority=priority, depth=depth)
+        await self.store.save(job)
+        self._push(job)
+        return job
+
+    def _push(self, job: Job):
+        self._pending[job.branch_id] = job
+        self._queue.put_nowait((job.priority, job.depth, next(self._counter), job))
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while not self._stopping:
+            *_, job = await self._queue.get()
+            try:
+                # Skip entries that were superseded by a higher priority job.
+                if self._pending.get(job.branch_id) is not job:
+                    continue
+                self._busy.add(task)
+                await self._run(job)
+            finally:
+                self._busy.discard(task)
+                self._queue.task_done()
+            await self._prune()
+
+    async def _prune(self):
+        """Delete finished jobs past their retention, at most once an interval."""
+        now = time.monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < JOB_PRUNE_INTERVAL_SECONDS:
+            return
+        # Claimed before the delete so that only one worker runs it.
+        self._pruned_at = now
+        try:
+            deleted = await self.store.prune(JOB_RETENTION_SECONDS)
+        except Exception:
+            logger.exception(f"Failed to prune finished jobs: name={self.name}")
+            return
+        if deleted:
+            logger.info(f"Pruned finished jobs: name={self.name}, deleted={deleted}")
+
+    async def _run(self, job: Job):
+        del self._pending[job.branch_id]
+        self._running[job.branch_id] = job
+        job.status = "running"
+        job.attempts += 1
+        try:
+            await self.store.save(job)
+            await self.handler(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # Picked up again by the next start.
+                job.status = "queued"
+                await asyncio.shield(self.store.save(job))
+                raise
+            # Something the handler waited on was cancelled, not the worker.
+            logger.warning(
+                f"Job cancelled: name={self.name}, branch_id={job.branch_id}"
+            )
+            job.status = "failed"
+            job.error = "cancelled"
+        except Exception as e:
+            logger.exception(f"Job failed: name={self.name}, branch_id={job.branch_id}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            if self._running.get(job.branch_id) is job:
+                del self._running[job.branch_id]
+            if self.status(job.branch_id) is None and job.branch_id in self._waiters:
+                self._waiters.pop(job.branch_id).set()
+        await self.store.save(job)
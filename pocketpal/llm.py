@@ -1,10 +1,547 @@
-from langchain.schema import HumanMessage
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from time import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, TypeVar
+
+from langchain.schema import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(model="gpt-4o")
+from pocketpal.cache import LRUCache
+from pocketpal.gateway import Gateway
+from pocketpal.metrics import Span, registry, span
+from pocketpal.routing import CALL_TYPES, Policy, Router, parse_routes
+from pocketpal.prompts import (
+    BRANCH_TOOL,
+    LANGUAGES,
+    SIBLINGS_TOOL,
+    STORY_TOOL,
+    SUMMARY_TOOL,
+    get_branch_messages,
+    get_sibling_messages,
+    get_story_messages,
+    get_summary_messages,
+)
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Models to route calls to, e.g. "gpt-4o=openai:gpt-4o,mini=openai:gpt-4o-mini"
+# or "slow=fake:slow,fast=fake:fast" for local stand-ins. Defaults to
+# LLM_MODEL on LLM_BACKEND. The LLM_POLICY_<CALL TYPE> variables pick a route
+# per call type, optionally hedged by a second one, e.g. "gpt-4o>mini".
+LLM_ROUTES = os.getenv("LLM_ROUTES", f"{LLM_MODEL}={LLM_BACKEND}:{LLM_MODEL}")
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1000))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 24 * 60 * 60))
+# Optional second tier that survives restarts, e.g. "data/llm_cache".
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+
+# Structured calls are retried when the arguments can't be repaired into a
+# valid result. Provider failures are retried by the gateway.
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+
+T = TypeVar("T")
+
+
+class ValidationError(ValueError):
+    """Raised when tool call arguments don't match what was asked for."""
+
+
+class GenerationError(Exception):
+    """Raised when a structured call failed on every attempt."""
+
+
+@dataclass
+class ToolCall:
+    arguments: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+@dataclass
+class Attempt:
+    call: str
+    attempt: int
+    latency: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    error: Optional[str] = None
+    route: Optional[str] = None
+
+
+llm_tokens = registry.counter(
+    "pocketpal_llm_tokens_total",
+    "Tokens used by structured LLM calls, by call and input or output.",
+    ("call", "kind"),
+)
+llm_cache_lookups = registry.counter(
+    "pocketpal_llm_cache_lookups_total",
+    "Completion cache lookups, by result.",
+    ("result",),
+)
+llm_attempts = registry.counter(
+    "pocketpal_llm_attempts_total",
+    "Structured LLM call attempts, by call and outcome.",
+    ("call", "outcome"),
+)
+llm_attempt_seconds = registry.counter(
+    "pocketpal_llm_attempt_seconds_total",
+    "Time spent in structured LLM call attempts, by call.",
+    ("call",),
+)
+
+
+class UsageStats:
+    """Token usage and latency of structured call attempts, per call."""
+
+    def __init__(self):
+        self.totals: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {
+                "attempts": 0,
+                "failures": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "latency": 0.0,
+            }
+        )
+
+    def record(self, attempt: Attempt):
+        totals = self.totals[attempt.call]
+        totals["attempts"] += 1
+        totals["failures"] += attempt.error is not None
+        totals["input_tokens"] += attempt.input_tokens
+        totals["output_tokens"] += attempt.output_tokens
+        totals["latency"] += attempt.latency
+        llm_tokens.inc(attempt.input_tokens, call=attempt.call, kind="input")
+        llm_tokens.inc(attempt.output_tokens, call=attempt.call, kind="output")
+        outcome = "ok" if attempt.error is None else "error"
+        llm_attempts.inc(call=attempt.call, outcome=outcome)
+        llm_attempt_seconds.inc(attempt.latency, call=attempt.call)
+
+    def stats(self):
+        return {call: dict(totals) for call, totals in self.totals.items()}
+
+
+class OpenAIBackend:
+    def __init__(self, model: str):
+        self.model = model
+        self.llm = ChatOpenAI(model=model)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        messages = [HumanMessage(content=prompt)]
+        async for chunk in self.llm.astream(messages):
+            if chunk.content:
+                yield str(chunk.content)
+
+    async def call_tool(
+        self, system: str, user: str, tool: dict, feedback: Optional[str] = None
+    ) -> ToolCall:
+        """Force a call to the tool and return its raw arguments."""
+        llm = self.llm.bind_tools([tool], tool_choice=tool["function"]["name"])
+        messages = [SystemMessage(content=system), HumanMessage(content=user)]
+        if feedback:
+            messages.append(HumanMessage(content=feedback))
+        response = await llm.ainvoke(messages)
+        if response.tool_calls:
+            arguments = json.dumps(response.tool_calls[0]["args"])
+        elif response.invalid_tool_calls:
+            # Arguments that didn't parse are left for repair_json.
+            arguments = response.invalid_tool_calls[0]["args"] or ""
+        else:
+            arguments = str(response.content)
+        usage = response.usage_metadata or {}
+        return ToolCall(
+            arguments, usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        )
+
+
+class DiskCompletionStore:
+    """Completions stored as one JSON file per key."""
+
+    def __init__(self, directory: str, ttl: Optional[float] = None):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if self.ttl is not None and os.path.getmtime(path) + self.ttl < time():
+                return None
+            with open(path) as f:
+                return json.load(f)["completion"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _write(self, key: str, completion: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"completion": completion}, f)
+        os.replace(temporary_path, path)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, completion: str):
+        await asyncio.to_thread(self._write, key, completion)
+
+
+class CompletionCache:
+    """
+    Completions keyed by model and prompt hash, in an in-memory LRU with an
+    optional persistent tier behind it.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = LLM_CACHE_SIZE,
+        ttl: Optional[float] = LLM_CACHE_TTL,
+        store: Optional[DiskCompletionStore] = None,
+    ):
+        self.memory = LRUCache(maxsize, ttl)
+        self.store = store
+        self.store_hits = 0
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        completion = self.memory.get(key)
+        if completion is None and self.store is not None:
+            completion = await self.store.get(key)
+            if completion is not None:
+                self.store_hits += 1
+                self.memory.set(key, completion)
+        llm_cache_lookups.inc(result="miss" if completion is None else "hit")
+        return completion
+
+    async def set(self, key: str, completion: str):
+        self.memory.set(key, completion)
+        if self.store is not None:
+            await self.store.set(key, completion)
+
+    def stats(self):
+        # Memory misses that the persistent tier answered are not real misses.
+        return {
+            "size": len(self.memory),
+            "hits": self.memory.hits + self.store_hits,
+            "misses": self.memory.misses - self.store_hits,
+        }
+
+
+def make_backend(kind: str, model: str):
+    if kind == "fake":
+        from pocketpal.fakes import FakeLLM, Faults
+
+        # Each stand-in can be given its own latency, e.g. FAKE_LLM_FAST_LATENCY.
+        prefix = f"FAKE_LLM_{model.upper().replace('-', '_')}"
+        if os.getenv(f"{prefix}_LATENCY") is None:
+            prefix = "FAKE_LLM"
+        return FakeLLM(model=model, faults=Faults.from_env(prefix))
+    if kind == "openai":
+        return OpenAIBackend(model)
+    raise ValueError(f"Unknown LLM backend: {kind}")
+
+
+def make_router(gateway: Gateway) -> Router:
+    routes = {
+        name: make_backend(kind, model)
+        for name, (kind, model) in parse_routes(LLM_ROUTES).items()
+    }
+    policies = {}
+    for call_type in CALL_TYPES:
+        spec = os.getenv(f"LLM_POLICY_{call_type.upper()}")
+        if spec:
+            policies[call_type] = Policy.parse(spec)
+    return Router(routes, policies, gateway)
+
+
+# Rate limits and circuit breakers are per route.
+llm_gateway = Gateway.from_env("llm", "LLM", concurrency=16)
+router = make_router(llm_gateway)
+completion_cache = CompletionCache(
+    store=DiskCompletionStore(LLM_CACHE_DIR, LLM_CACHE_TTL) if LLM_CACHE_DIR else None
+)
+
+registry.gauge(
+    "pocketpal_llm_cache_entries",
+    "Completions held in the in-memory cache.",
+    lambda: {(): len(completion_cache.memory)},
+)
+
+
+async def _timed_stream(prompt: str) -> AsyncIterator[str]:
+    # Streams are not hedged, since their tokens are relayed as they come.
+    route = router.policy("continue").primary
+    backend = router.routes[route]
+    # Not activated, since the span would leak into the consuming code.
+    stream_span = Span("llm", "stream", route=route).start(activate=False)
+    try:
+        async for token in llm_gateway.stream(
+            lambda: backend.stream(prompt), key=route
+        ):
+            yield token
+    except BaseException:
+        stream_span.outcome = "error"
+        raise
+    finally:
+        stream_span.finish()
+
+
+async def openai_prompt_stream(prompt: str, use_cache: bool = True) -> AsyncIterator[str]:
+    if not (LLM_CACHE and use_cache):
+        async for token in _timed_stream(prompt):
+            yield token
+        return
+
+    key = CompletionCache.key(router.policy("continue").primary, prompt)
+    completion = await completion_cache.get(key)
+    if completion is not None:
+        yield completion
+        return
+
+    tokens = []
+    async for token in _timed_stream(prompt):
+        tokens.append(token)
+        yield token
+    await completion_cache.set(key, "".join(tokens))
+
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def close_json(text: str) -> str:
+    """Close the strings, arrays and objects left open by a truncated response."""
+    closers = []
+    in_string = escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = in_string
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]" and closers:
+            closers.pop()
+    return text + ('"' if in_string else "") + "".join(reversed(closers))
+
+
+def repair_json(text: str) -> Dict[str, Any]:
+    """
+    Parse a JSON object, repairing the usual near misses locally instead of
+    paying for another completion: code fences or prose around the object,
+    trailing commas, raw newlines in strings and truncated endings.
+    """
+    start = text.find("{")
+    if start < 0:
+        raise ValidationError("Response contains no JSON object")
+    text = text[start:]
+    end = text.rfind("}")
+    candidates = [text[: end + 1]] if end >= 0 else []
+    candidates.append(close_json(text))
+    for candidate in candidates:
+        for attempt in (candidate, TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                value = json.loads(attempt, strict=False)
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                return value
+    raise ValidationError("Response is not a valid JSON object")
+
+
+def require_text(arguments: Dict[str, Any], field: str) -> str:
+    value = arguments.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValidationError(f"'{field}' must be a non-empty string")
+    return value.strip()
+
+
+@dataclass
+class StoryInfo:
+    lang: str
+    title: str
+    description: str
+    paragraph: str
+
+    @classmethod
+    def from_arguments(cls, arguments: Dict[str, Any]) -> "StoryInfo":
+        lang = require_text(arguments, "lang").lower()
+        if lang not in LANGUAGES:
+            raise ValidationError(f"'lang' must be one of {', '.join(LANGUAGES)}")
+        return cls(
+            lang=lang,
+            title=require_text(arguments, "title"),
+            description=require_text(arguments, "description"),
+            paragraph=require_text(arguments, "paragraph"),
+        )
+
+
+usage_stats = UsageStats()
+
+
+async def structured_call(
+    call_type: str,
+    tool: dict,
+    system: str,
+    user: str,
+    parse: Callable[[Dict[str, Any]], T],
+    use_cache: bool = True,
+) -> T:
+    """
+    Force a tool call, routed by the call type's policy, and parse its
+    arguments. Invalid arguments are sent back as feedback for up to
+    LLM_MAX_ATTEMPTS attempts, so the next one can fix them. Raises
+    GenerationError if no attempt succeeded.
+    """
+    name = tool["function"]["name"]
+    use_cache = LLM_CACHE and use_cache
+    primary = router.policy(call_type).primary
+    key = CompletionCache.key(primary, f"{name}\0{system}\0{user}")
+    if use_cache:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            return parse(json.loads(cached))
+
+    feedback = None
+    last_error: Optional[Exception] = None
+    for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+        attempt_span = span("llm", name, attempt=attempt).start()
+        call = ToolCall("")
+        route = None
+        provider_failed = False
+        try:
+            call, route = await router.call(
+                call_type,
+                lambda backend: backend.call_tool(system, user, tool, feedback),
+            )
+            attempt_span.attributes["route"] = route
+            arguments = repair_json(call.arguments)
+            result = parse(arguments)
+        except ValidationError as e:
+            feedback = f"Your {name} call was invalid: {e}. Call {name} again with valid arguments."
+            last_error = e
+        except Exception as e:
+            # The gateway has already retried, or the circuits are open.
+            last_error = e
+            provider_failed = True
+        else:
+            last_error = None
+
+        attempt_span.finish("error" if last_error else "ok")
+        usage_stats.record(
+            Attempt(
+                call=name,
+                attempt=attempt,
+                latency=attempt_span.duration,
+                input_tokens=call.input_tokens,
+                output_tokens=call.output_tokens,
+                error=repr(last_error) if last_error else None,
+                route=route,
+            )
+        )
+        if last_error is None:
+            if use_cache:
+                await completion_cache.set(key, json.dumps(arguments))
+            return result
+        logger.warning(
+            f"Structured call failed: call={name}, attempt={attempt}/{LLM_MAX_ATTEMPTS}, error={last_error!r}"
+        )
+        if provider_failed:
+            break
+
+    raise GenerationError(f"{name} failed after {attempt} attempts") from last_error
+
+
+async def generate_new_story_info(
+    premise: str, language: Optional[str] = None, use_cache: bool = True
+) -> StoryInfo:
+    """Start a story from the premise, in the given language if any."""
+    system, user = get_story_messages(premise, language)
+
+    def parse(arguments: Dict[str, Any]) -> StoryInfo:
+        info = StoryInfo.from_arguments(arguments)
+        if language and info.lang != language:
+            raise ValidationError(f"'lang' must be {language}")
+        return info
+
+    return await structured_call("story", STORY_TOOL, system, user, parse, use_cache)
+
+
+async def generate_new_branch(
+    language: str,
+    story: str,
+    sentiment: str,
+    final: bool = False,
+    use_cache: bool = True,
+) -> str:
+    """Write the next paragraph of the story."""
+    system, user = get_branch_messages(story, language, sentiment, final)
+    return await structured_call(
+        "final" if final else "continue",
+        BRANCH_TOOL,
+        system,
+        user,
+        lambda arguments: require_text(arguments, "paragraph"),
+        use_cache,
+    )
+
+
+async def generate_sibling_branches(
+    language: str,
+    story: str,
+    final: bool = False,
+    use_cache: bool = True,
+) -> Dict[str, str]:
+    """
+    Write the positive and negative next paragraphs in one call, paying for
+    the story's tokens once. Returns the paragraphs by sentiment.
+    """
+    system, user = get_sibling_messages(story, language, final)
+    return await structured_call(
+        "final" if final else "continue",
+        SIBLINGS_TOOL,
+        system,
+        user,
+        lambda arguments: {
+            sentiment: require_text(arguments, sentiment)
+            for sentiment in ("positive", "negative")
+        },
+        use_cache,
+    )
 
 
-async def openai_prompt(prompt: str) -> str:
-    messages = [HumanMessage(content=prompt)]
-    response = await llm.ainvoke(messages)
-    return str(response.content)
+async def summarize_story(
+    language: str,
+    summary: Optional[str],
+    paragraphs: List[str],
+    max_words: int,
+    use_cache: bool = True,
+) -> str:
+    """Fold the paragraphs into the summary of the story before them."""
+    system, user = get_summary_messages(summary, paragraphs, language, max_words)
+    return await structured_call(
+        "summary",
+        SUMMARY_TOOL,
+        system,
+        user,
+        lambda arguments: require_text(arguments, "summary"),
+        use_cache,
+    )
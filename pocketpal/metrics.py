@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import secrets
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "jsonl" appends finished spans to TRACE_FILE as OTLP-style JSON, which
+# needs no collector. "otel" mirrors spans into the OpenTelemetry API, to be
+# exported by whatever SDK the process was started with.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "data/traces.jsonl")
+TRACE_FLUSH_SPANS = int(os.getenv("TRACE_FLUSH_SPANS", 100))
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)  # fmt: skip
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Histogram:
+    """A Prometheus histogram with one series per combination of labels."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per series: counts per bucket (the last one is +Inf), sum.
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        counts, total = self.series.setdefault(
+            key, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self.series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": str(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter with one series per combination of labels."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.series.items()):
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    A Prometheus gauge whose series are read from collect when rendered,
+    for values that are cheaper to look up than to keep up to date.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.collect().items()):
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        metric = Gauge(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.histogram(
+    "pocketpal_stage_duration_seconds",
+    "Time spent per stage: request, db, llm, tts or upload.",
+    ("stage", "name", "outcome"),
+)
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, buffered to keep writes off the hot path."""
+
+    def __init__(self, path: str, flush_spans: int = TRACE_FLUSH_SPANS):
+        self.path = path
+        self.flush_spans = flush_spans
+        self.buffer: List[str] = []
+
+    def start(self, span: "Span"):
+        pass
+
+    def finish(self, span: "Span"):
+        self.buffer.append(
+            json.dumps(
+                {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": f"{span.stage} {span.name}",
+                    "startTimeUnixNano": span.start_ns,
+                    "endTimeUnixNano": span.end_ns,
+                    "attributes": {**span.attributes, "outcome": span.outcome},
+                }
+            )
+        )
+        if len(self.buffer) >= self.flush_spans:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write("\n".join(self.buffer) + "\n")
+        self.buffer = []
+
+
+class OpenTelemetryExporter:
+    """Mirrors spans into the OpenTelemetry API, a no-op without an SDK."""
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self.trace = trace
+        self.tracer = trace.get_tracer("pocketpal")
+
+    def start(self, span: "Span"):
+        parent = span.parent.otel_span if span.parent else None
+        context = self.trace.set_span_in_context(parent) if parent else None
+        span.otel_span = self.tracer.start_span(
+            f"{span.stage} {span.name}",
+            context=context,
+            start_time=span.start_ns,
+            attributes=span.attributes,
+        )
+
+    def finish(self, span: "Span"):
+        if span.outcome == "error":
+            span.otel_span.set_status(self.trace.StatusCode.ERROR)
+        span.otel_span.set_attribute("outcome", span.outcome)
+        span.otel_span.end(end_time=span.end_ns)
+
+    def flush(self):
+        pass
+
+
+def make_exporter():
+    if TRACE_EXPORTER == "jsonl":
+        return JsonLinesExporter(TRACE_FILE)
+    if TRACE_EXPORTER == "otel":
+        try:
+            return OpenTelemetryExporter()
+        except ImportError:
+            logger.warning("opentelemetry is not installed, spans will not be exported")
+    return None
+
+
+exporter = make_exporter()
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Times a stage and records it in stage_seconds once finished. Use it as a
+    context manager, or call start and finish around code that can't be
+    wrapped, such as request hooks.
+    """
+
+    def __init__(self, stage: str, name: str, **attributes):
+        self.stage = stage
+        self.name = name
+        self.attributes = attributes
+        self.outcome = "ok"
+        self.parent: Optional[Span] = None
+        self.trace_id = ""
+        self.span_id = secrets.token_hex(8)
+        self.parent_id: Optional[str] = None
+        self.start_ns = self.end_ns = 0
+        self.duration = 0.0
+        self.otel_span = None
+        self._started = 0.0
+        self._token = None
+
+    def start(self, activate: bool = True) -> "Span":
+        """
+        Start timing. Spans started while this one is active become its
+        children. Pass activate=False inside generators, where the active
+        span would leak into the code consuming them.
+        """
+        self.parent = current_span.get()
+        self.trace_id = self.parent.trace_id if self.parent else secrets.token_hex(16)
+        self.parent_id = self.parent.span_id if self.parent else None
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        if activate:
+            self._token = current_span.set(self)
+        if exporter is not None:
+            exporter.start(self)
+        return self
+
+    def finish(self, outcome: Optional[str] = None):
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        if outcome is not None:
+            self.outcome = outcome
+        if self._token is not None:
+            current_span.reset(self._token)
+            self._token = None
+        stage_seconds.observe(
+            self.duration, stage=self.stage, name=self.name, outcome=self.outcome
+        )
+        if exporter is not None:
+            exporter.finish(self)
+
+    def detach(self):
+        """
+        Stop being the active span while timing goes on, for spans finished
+        elsewhere, such as in the generator of a streamed response.
+        """
+        if self._token is not None:
+            current_span.reset(self._token)
+            self._token = None
+
+    def __enter__(self) -> "Span":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish("error" if exc_type is not None else None)
+
+
+def span(stage: str, name: str, **attributes) -> Span:
+    return Span(stage, name, **attributes)
+
+
+def flush_traces():
+    if exporter is not None:
+        exporter.flush()
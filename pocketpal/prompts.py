@@ -1,14 +1,9 @@
 import json
 
-# TODO: Refactor these prompts into this format:
-# 1. System prompt with solid instructions
-# 2. Tool calls for gathering structured data from the LLM (even if it's just one string).
-#    (Use forced tool calls for this.)
-# 3. The user message which should only contain actual user input to avoid confusion between user input and LLM instructions.
+# Structured calls use a system prompt for the instructions, a forced tool
+# call for the output, and a user message with only the story content.
 
-# Probably we merge llm.py and prompts.py and use llm.bind_tools(…) and SystemMessage etc.
-# - generate_new_story_info(premise)
-# - generate_new_branch(language, story, sentiment, final=False)
+LANGUAGES = ["es", "en", "pt", "se"]
 
 # Thoughts on prompts below:
 # - We should iterate on what "positive" and "negative" mean for the LLM.
@@ -21,30 +16,134 @@ import json
 # - Consider adding a target audience setting for a story ("for 4-year-olds", "for adults", or just "automatic" to let the LLM choose)
 
 
-def get_initial_prompt(story_description):
-    return f"""Please take this input JSON:
-
-{json.dumps({"story_premise": story_description}, indent=4)}
-
-And turn it into a new story with only its first paragraph written, and not too long.
+STORY_SYSTEM_PROMPT = """You turn a story premise into a new story with only its first paragraph written, and not too long.
 The paragraph should finish with a situation where there is an alternative choice that will change the original flow of the story. The alternatives should be one that propels the story forward, and one that changes the direction of the story.
 You write using the language that was used for the premise and in the second person in the present tense to make the experience more immersive.
 The title for the story should be unique and intriguing, fit for the cover of a book, based on the premise and beginning of the story.
+The user message is the premise, along with the language to write in when it is given.
+Always answer by calling the create_story tool.
+"""
 
-Provide a JSON object matching this TypeScript interface:
-
-interface Story {{
-    lang: "es" | "en" | "pt" | "se";
-    paragraph: string;
-    description: string;
-    title: string;
-}}
-
-DO NOT PUT BACKTICKS. Only write raw JSON.
+STORY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "create_story",
+        "description": "Create a story with its title, description and first paragraph.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "lang": {"type": "string", "enum": LANGUAGES},
+                "title": {"type": "string"},
+                "description": {"type": "string"},
+                "paragraph": {"type": "string"},
+            },
+            "required": ["lang", "title", "description", "paragraph"],
+        },
+    },
+}
+
+BRANCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "write_paragraph",
+        "description": "Write the next paragraph of the story.",
+        "parameters": {
+            "type": "object",
+            "properties": {"paragraph": {"type": "string"}},
+            "required": ["paragraph"],
+        },
+    },
+}
+
+SIBLINGS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "write_paragraphs",
+        "description": "Write the positive and the negative next paragraph of the story.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "positive": {"type": "string"},
+                "negative": {"type": "string"},
+            },
+            "required": ["positive", "negative"],
+        },
+    },
+}
+
+SUMMARY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "summarize_story",
+        "description": "Save the summary of the story so far.",
+        "parameters": {
+            "type": "object",
+            "properties": {"summary": {"type": "string"}},
+            "required": ["summary"],
+        },
+    },
+}
+
+
+def get_story_messages(story_description, language=None):
+    """
+    The system and user messages for generating a new story, written in the
+    language of the premise unless another language is given.
+    """
+    message = {"story_premise": story_description}
+    if language:
+        message["language"] = language
+    return STORY_SYSTEM_PROMPT, json.dumps(message)
+
+
+def get_branch_messages(story, language, sentiment, is_final_branch):
+    """The system and user messages for generating the next paragraph."""
+    if is_final_branch:
+        instructions = get_final_instructions(language, sentiment)
+    else:
+        instructions = get_continue_instructions(language, sentiment)
+    return (
+        f"""{instructions}
+The user message is the story so far. Always answer by calling the write_paragraph tool.
+""",
+        story,
+    )
+
+
+def get_sibling_messages(story, language, is_final_branch):
+    """
+    The system and user messages for generating the positive and negative
+    next paragraphs at once, sharing the story between them.
+    """
+    if is_final_branch:
+        instructions = get_final_instructions(language, "positive and negative")
+    else:
+        instructions = get_continue_instructions(language, "positive and negative")
+    return (
+        f"""{instructions}
+Write one paragraph for each sentiment. They are alternatives to each other, so neither may refer to the other.
+The user message is the story so far. Always answer by calling the write_paragraphs tool.
+""",
+        story,
+    )
+
+
+def get_summary_messages(summary, paragraphs, language, max_words):
+    """
+    The system and user messages for folding paragraphs into the summary of
+    everything that happened before them.
+    """
+    system = f"""You keep a running summary of an interactive story written in the second person.
+Rewrite the summary so that it also covers the new paragraphs, in at most {max_words} words.
+Keep the characters, places, objects and choices that later paragraphs may refer back to, and drop the prose.
+Write the summary in the language with code "{language}". Always answer by calling the summarize_story tool.
 """
+    story = "\n\n".join(paragraphs)
+    user = f"# Summary\n{summary or '(The story has just begun.)'}\n\n# New paragraphs\n{story}"
+    return system, user
 
 
-def get_continue_prompt(story, language, sentiment):
+def get_continue_instructions(language, sentiment):
     return f"""# Task
 You are a talented fantasy novels writer that is working on an audio-game.
 You write using the provided language and the second person in the present tense to make the experience more immersive.
@@ -61,17 +160,12 @@ The paragraph should finish with a situation where there is an alternative choic
 # Language
 {language}
 
-# Input:
-{story}
-
 # Sentiment
 {sentiment}
-
-# Output
 """
 
 
-def get_final_prompt(story, language, sentiment):
+def get_final_instructions(language, sentiment):
     return f"""# Task
 You are a talented fantasy novels writer that is working on an audio-game.
 You write using the provided language and the second person in the present tense to make the experience more immersive.
@@ -88,11 +182,20 @@ If the sentiment is negative, write a tragic ending.
 # Language
 {language}
 
-# Input
-{story}
-
 # Sentiment
 {sentiment}
+"""
+
+
+def get_branch_prompt(story, language, sentiment, is_final_branch):
+    """A single plain-text prompt, for streaming the paragraph as it's written."""
+    if is_final_branch:
+        instructions = get_final_instructions(language, sentiment)
+    else:
+        instructions = get_continue_instructions(language, sentiment)
+    return f"""{instructions}
+# Input
+{story}
 
 # Output
 """
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from pocketpal.gateway import Gateway
+from pocketpal.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Hedges fire once the primary has taken longer than this quantile of its
+# recent latencies for the call type.
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.9))
+# Until a route has this many samples, hedges fire after the default delay.
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 5))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", 200))
+
+# What the app asks the LLM for, each with its own policy.
+CALL_TYPES = ("story", "continue", "final", "summary")
+
+T = TypeVar("T")
+
+route_wins = registry.counter(
+    "pocketpal_llm_route_wins_total",
+    "LLM calls by call type, the route that answered and whether it was hedged.",
+    ("call", "route", "hedged"),
+)
+
+
+class LatencyWindow:
+    """The most recent latencies of a route, for estimating its quantiles."""
+
+    def __init__(self, size: int = LLM_LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+
+    def quantile(self, q: float) -> float:
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclass
+class Policy:
+    """Which route answers a call type, and which one hedges it if any."""
+
+    primary: str
+    hedge: Optional[str] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Policy":
+        """A policy from "route" or "route>hedge_route"."""
+        primary, _, hedge = spec.partition(">")
+        return cls(primary.strip(), hedge.strip() or None)
+
+
+def parse_routes(spec: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Routes by name from "name=backend:model,..." where the name defaults to
+    the model, e.g. "gpt-4o=openai:gpt-4o,mini=openai:gpt-4o-mini".
+    """
+    routes = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, target = item.rpartition("=")
+        kind, _, model = target.partition(":")
+        routes[name or model or kind] = (kind, model or kind)
+    return routes
+
+
+class Router:
+    """
+    Sends each LLM call to the route its call type's policy names. Hedged
+    policies fire the same call at the hedge route once the primary is
+    slower than usual, and take whichever answers first.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, Any],
+        policies: Dict[str, Policy],
+        gateway: Gateway,
+        hedge_quantile: float = LLM_HEDGE_QUANTILE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        default_delay: float = LLM_HEDGE_DEFAULT_DELAY,
+    ):
+        for call_type, policy in policies.items():
+            for route in (policy.primary, policy.hedge):
+                if route is not None and route not in routes:
+                    raise ValueError(f"Policy for {call_type} uses unknown route {route}")
+        self.routes = routes
+        self.policies = policies
+        self.default_policy = Policy(next(iter(routes)))
+        self.gateway = gateway
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+
+    def policy(self, call_type: str) -> Policy:
+        return self.policies.get(call_type, self.default_policy)
+
+    def _window(self, call_type: str, route: str) -> LatencyWindow:
+        if (call_type, route) not in self.latencies:
+            self.latencies[call_type, route] = LatencyWindow()
+        return self.latencies[call_type, route]
+
+    def hedge_delay(self, call_type: str, route: str) -> float:
+        window = self._window(call_type, route)
+        if len(window) < self.min_samples:
+            return self.default_delay
+        return window.quantile(self.hedge_quantile)
+
+    async def _attempt(
+        self, call_type: str, route: str, fn: Callable[[Any], Awaitable[T]]
+    ) -> T:
+        start = time.perf_counter()
+        try:
+            result = await self.gateway.call(lambda: fn(self.routes[route]), key=route)
+        except asyncio.CancelledError:
+            # The other request won, so this one took at least this long.
+            self._window(call_type, route).observe(time.perf_counter() - start)
+            raise
+        self._window(call_type, route).observe(time.perf_counter() - start)
+        return result
+
+    async def call(
+        self, call_type: str, fn: Callable[[Any], Awaitable[T]]
+    ) -> Tuple[T, str]:
+        """
+        Call fn with the backend of the call type's route. Returns its result
+        and the name of the route that produced it.
+        """
+        policy = self.policy(call_type)
+        if policy.hedge is None:
+            result = await self._attempt(call_type, policy.primary, fn)
+            route_wins.inc(call=call_type, route=policy.primary, hedged="false")
+            return result, policy.primary
+
+        primary = asyncio.create_task(self._attempt(call_type, policy.primary, fn))
+        tasks = {primary: policy.primary}
+        try:
+            done, _ = await asyncio.wait(
+                tasks, timeout=self.hedge_delay(call_type, policy.primary)
+            )
+            # The hedge also stands in for a primary that failed early.
+            if not done or primary.exception() is not None:
+                logger.debug(f"Hedging LLM call: call={call_type}, route={policy.hedge}")
+                tasks[asyncio.create_task(self._attempt(call_type, policy.hedge, fn))] = policy.hedge
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        route = tasks[task]
+                        hedged = "true" if len(tasks) > 1 else "false"
+                        route_wins.inc(call=call_type, route=route, hedged=hedged)
+                        return task.result(), route
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    task.exception()
+                task.cancel()
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a
+    call is in flight wait for it and share its result or exception. If
+    the caller that started the call is cancelled, a waiting caller makes
+    the call again.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def get(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._calls.get(key)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while key in self._calls:
+            call = self._calls[key]
+            try:
+                # Shield so that a cancelled waiter doesn't cancel the shared call.
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                # Only pass on our own cancellation. If it was the caller
+                # that started the call that got cancelled, make the call
+                # again instead.
+                if not call.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else awaits it.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,83 @@
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+from pocketpal.audio import VOICES
+from pocketpal.metrics import registry
+
+# Pre-generated stories kept ready per language and category, so starting
+# one of them is instant. Off by default, since every replica fills its
+# pool on startup: with 1, that's a story with STARTER_POOL_DEPTH levels of
+# choices for each of the languages and categories.
+STARTER_POOL_SIZE = int(os.getenv("STARTER_POOL_SIZE", 0))
+# Levels of branches below the initial one generated before a story is
+# pooled, so the first choices are ready too.
+STARTER_POOL_DEPTH = int(os.getenv("STARTER_POOL_DEPTH", 2))
+STARTER_REFILL_INTERVAL = int(os.getenv("STARTER_REFILL_INTERVAL", 60))
+# Comma separated subset of the languages with a voice, e.g. "en,es".
+STARTER_LANGUAGES = [
+    language
+    for language in os.getenv("STARTER_LANGUAGES", ",".join(VOICES)).split(",")
+    if language in VOICES
+]
+
+STARTER_PREMISES: Dict[str, List[str]] = {
+    "adventure": [
+        "A map falls out of an old library book, marked with a place that isn't on any other map.",
+        "You are the newest crew member on a ship sailing past the edge of the known sea.",
+        "A storm strands your train in a mountain village that seems to have been expecting you.",
+    ],
+    "mystery": [
+        "Every clock in town stopped at the same minute last night, except the one in your room.",
+        "A letter arrives addressed to you, postmarked fifty years ago.",
+        "The lighthouse keeper has vanished, but the light still turns on every night.",
+    ],
+    "fantasy": [
+        "A dragon egg hatches in your kitchen, and the baby dragon only speaks in riddles.",
+        "You find a door in the forest that opens onto a different season every time.",
+        "The village witch asks you to deliver a package, and warns you never to open it.",
+    ],
+    "space": [
+        "Your small research station picks up a signal that repeats your own name.",
+        "You wake up from cryosleep years too early, and the ship is very quiet.",
+        "A friendly robot lands in your garden, looking for the way home.",
+    ],
+    "bedtime": [
+        "A sleepy bear can't find the cave where it's supposed to spend the winter.",
+        "The moon has lost its glow, and only you know where it might have gone.",
+        "Your teddy bear invites you to a picnic on the roof, at midnight.",
+    ],
+}
+
+STARTER_CATEGORIES = list(STARTER_PREMISES)
+
+starter_requests = registry.counter(
+    "pocketpal_starter_requests_total",
+    "Starter stories requested, by whether the pool had one ready.",
+    ("outcome",),
+)
+
+
+def random_premise(category: str) -> str:
+    return random.choice(STARTER_PREMISES[category])
+
+
+def missing_starters(counts: Dict[Tuple[str, str], int]) -> List[Tuple[str, str]]:
+    """
+    One (language, category) per story the pool is short of, spread across
+    languages and categories so that the emptiest ones fill up first.
+    """
+    missing = []
+    for level in range(STARTER_POOL_SIZE):
+        for language in STARTER_LANGUAGES:
+            for category in STARTER_CATEGORIES:
+                if counts.get((language, category), 0) <= level:
+                    missing.append((language, category))
+    return missing
+
+
+def pick_category(category: Optional[str]) -> str:
+    """The requested category if it exists, otherwise a random one."""
+    if category in STARTER_PREMISES:
+        return category
+    return random.choice(STARTER_CATEGORIES)
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import mmap
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Union
+from urllib.parse import quote
+
+from pocketpal.audio import AudioService, audio_service, get_full_url
+from pocketpal.cache import LRUCache
+from pocketpal.metrics import span
+
+# "gcs", "local", or "fake" for local storage with the latency and
+# failures of FAKE_STORAGE_LATENCY and FAKE_STORAGE_FAILURE_RATE.
+AUDIO_STORAGE = os.getenv("AUDIO_STORAGE", "gcs")
+AUDIO_STORAGE_DIR = os.getenv("AUDIO_STORAGE_DIR", "data/audio")
+# Where clients download local blobs from, e.g. a CDN in front of the app.
+AUDIO_LOCAL_URL = os.getenv("AUDIO_LOCAL_URL", "/audio")
+# Local blobs kept memory-mapped for serving.
+AUDIO_MMAP_FILES = int(os.getenv("AUDIO_MMAP_FILES", 256))
+SEND_CHUNK_SIZE = 64 * 1024
+
+BlobData = Union[bytes, AsyncIterator[bytes]]
+
+
+class GCSStorage:
+    """Blobs in the Cloud Storage bucket, served publicly by Google."""
+
+    def __init__(self, service: AudioService):
+        self.service = service
+
+    async def exists(self, blob_name: str) -> bool:
+        return await self.service.blob_exists(blob_name)
+
+    async def size(self, blob_name: str) -> Optional[int]:
+        return await self.service.blob_size(blob_name)
+
+    def read(self, blob_name: str) -> AsyncIterator[bytes]:
+        return self.service.download_audio(blob_name)
+
+    async def put(self, blob_name: str, data: BlobData, content_type: str = "audio/mpeg"):
+        await self.service.upload_audio(data, blob_name, content_type)
+
+    def url(self, blob_name: str) -> str:
+        return get_full_url(blob_name)
+
+
+@dataclass
+class MappedBlob:
+    """A memory-mapped local blob, shared by every response that sends it."""
+
+    data: Union[mmap.mmap, bytes]
+    size: int
+    etag: str
+
+    async def chunks(self, start: int, stop: int) -> AsyncIterator[memoryview]:
+        """The bytes from start to stop, sent straight from the page cache."""
+        view = memoryview(self.data)
+        for offset in range(start, stop, SEND_CHUNK_SIZE):
+            yield view[offset : min(offset + SEND_CHUNK_SIZE, stop)]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # Still being sent. It's unmapped once the last chunk is
+                # released instead.
+                pass
+
+
+class LocalStorage:
+    """Blobs in a local directory, served by the app under /audio/."""
+
+    def __init__(
+        self,
+        root: str,
+        base_url: str = AUDIO_LOCAL_URL,
+        mmap_files: int = AUDIO_MMAP_FILES,
+    ):
+        self.root = root
+        self.base_url = base_url
+        # Blob names are content addressed, so a mapped blob never goes stale.
+        self.mapped = LRUCache(mmap_files, on_evict=MappedBlob.close)
+
+    def path(self, blob_name: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, blob_name))
+        if not path.startswith(os.path.realpath(self.root) + os.sep):
+            raise ValueError(f"Invalid blob name: {blob_name}")
+        return path
+
+    async def exists(self, blob_name: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.path(blob_name))
+
+    async def size(self, blob_name: str) -> Optional[int]:
+        try:
+            return (await self.open(blob_name)).size
+        except FileNotFoundError:
+            return None
+
+    async def read(self, blob_name: str) -> AsyncIterator[bytes]:
+        blob = await self.open(blob_name)
+        async for chunk in blob.chunks(0, blob.size):
+            yield chunk
+
+    async def put(self, blob_name: str, data: BlobData, content_type: str = "audio/mpeg"):
+        # Served with the content type of the blob name's extension.
+        with span("upload", "local"):
+            if not isinstance(data, bytes):
+                data = b"".join([chunk async for chunk in data])
+            await asyncio.to_thread(self._write, self.path(blob_name), data)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial blobs.
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+    def url(self, blob_name: str) -> str:
+        return f"{self.base_url}/{quote(blob_name)}"
+
+    async def open(self, blob_name: str) -> MappedBlob:
+        """Map a blob for serving. Raises FileNotFoundError if it's missing."""
+        blob = self.mapped.get(blob_name)
+        if blob is None:
+            blob = await asyncio.to_thread(self._map, blob_name)
+            self.mapped.set(blob_name, blob)
+        return blob
+
+    def _map(self, blob_name: str) -> MappedBlob:
+        with open(self.path(blob_name), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # Empty files can't be mapped. The mapping outlives the file handle.
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        etag = hashlib.sha1(blob_name.encode(), usedforsecurity=False).hexdigest()
+        return MappedBlob(data, size, etag[:16])
+
+
+def make_storage():
+    if AUDIO_STORAGE == "local":
+        return LocalStorage(AUDIO_STORAGE_DIR)
+    if AUDIO_STORAGE == "fake":
+        from pocketpal.fakes import FakeRemoteStorage, Faults
+
+        return FakeRemoteStorage(
+            LocalStorage(AUDIO_STORAGE_DIR), Faults.from_env("FAKE_STORAGE")
+        )
+    return GCSStorage(audio_service)
+
+
+storage = make_storage()
@@ -7,10 +7,23 @@ CREATE TABLE
         status TEXT NOT NULL,
         sentiment TEXT NOT NULL,
         audio_url TEXT,
+        -- Blob names of extra renditions of the audio by variant name.
+        audio_variants JSONB NOT NULL DEFAULT '{}',
         paragraph TEXT,
         positive_branch_id TEXT,
         negative_branch_id TEXT,
         final_branch BOOLEAN NOT NULL DEFAULT false,
+        -- Position in the story, the initial branch has depth 1.
+        depth INTEGER NOT NULL DEFAULT 1,
+        -- All paragraphs from the initial branch up to and including this one.
+        story_prefix TEXT,
+        story_length INTEGER,
+        -- Rolling summary of the first summary_depth paragraphs of the story,
+        -- used in place of them when prompting for the next paragraph.
+        story_summary TEXT,
+        summary_depth INTEGER NOT NULL DEFAULT 0,
+        -- When the status last changed, to find generation that got stuck.
+        status_updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
         PRIMARY KEY (branch_id),
         CHECK (
             sentiment = ANY (ARRAY['initial_branch', 'positive', 'negative'])
@@ -38,6 +51,7 @@ CREATE TABLE
         description TEXT NOT NULL,
         initial_prompt TEXT NOT NULL,
         lang TEXT NOT NULL DEFAULT 'en',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
         PRIMARY KEY (story_id),
         CONSTRAINT fk_stories_initial_branch FOREIGN KEY (initial_branch_id) REFERENCES branches (branch_id) ON DELETE SET NULL DEFERRABLE INITIALLY DEFERRED
     );
@@ -52,7 +66,49 @@ ADD CONSTRAINT fk_branches_negative_branch FOREIGN KEY (negative_branch_id) REFE
 -- Create indexes for 'stories' table
 CREATE INDEX idx_stories_initial_branch_id ON stories (initial_branch_id);
 
+CREATE INDEX idx_stories_created_at ON stories (created_at);
+
 -- Create indexes for 'branches' table
 CREATE INDEX idx_branches_previous_branch_id ON branches (previous_branch_id);
 
-CREATE INDEX idx_branches_story_id ON branches (story_id);
\ No newline at end of file
+CREATE UNIQUE INDEX idx_branches_previous_branch_sentiment ON branches (previous_branch_id, sentiment);
+
+CREATE INDEX idx_branches_story_id ON branches (story_id);
+
+CREATE INDEX idx_branches_generating ON branches (status_updated_at)
+WHERE status IN ('generating-text', 'generating-audio');
+
+-- Create the 'generation_jobs' table
+CREATE TABLE
+    generation_jobs (
+        branch_id TEXT NOT NULL,
+        story_id TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        depth INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (branch_id),
+        CONSTRAINT fk_generation_jobs_branch FOREIGN KEY (branch_id) REFERENCES branches (branch_id) ON DELETE CASCADE,
+        CHECK (
+            status = ANY (ARRAY['queued', 'running', 'done', 'failed'])
+        )
+    );
+
+CREATE INDEX idx_generation_jobs_status ON generation_jobs (status);
+
+-- Create the 'starter_stories' table, pre-generated stories waiting to be
+-- handed out by language and premise category
+CREATE TABLE
+    starter_stories (
+        story_id TEXT NOT NULL,
+        lang TEXT NOT NULL,
+        category TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (story_id),
+        CONSTRAINT fk_starter_stories_story FOREIGN KEY (story_id) REFERENCES stories (story_id) ON DELETE CASCADE
+    );
+
+CREATE INDEX idx_starter_stories_pool ON starter_stories (lang, category, created_at);
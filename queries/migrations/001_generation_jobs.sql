@@ -0,0 +1,20 @@
+-- Persistent queue for background branch generation.
+CREATE TABLE
+    IF NOT EXISTS generation_jobs (
+        branch_id TEXT NOT NULL,
+        story_id TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        depth INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (branch_id),
+        CONSTRAINT fk_generation_jobs_branch FOREIGN KEY (branch_id) REFERENCES branches (branch_id) ON DELETE CASCADE,
+        CHECK (
+            status = ANY (ARRAY['queued', 'running', 'done', 'failed'])
+        )
+    );
+
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status);
@@ -0,0 +1,40 @@
+-- Materialize each branch's position and full story text so that building
+-- the LLM context no longer walks every ancestor.
+ALTER TABLE branches
+ADD COLUMN IF NOT EXISTS depth INTEGER NOT NULL DEFAULT 1,
+ADD COLUMN IF NOT EXISTS story_prefix TEXT,
+ADD COLUMN IF NOT EXISTS story_length INTEGER;
+
+-- Backfill existing rows by walking each story tree from its root.
+WITH RECURSIVE
+    tree AS (
+        SELECT
+            branch_id,
+            1 AS depth,
+            paragraph AS story_prefix
+        FROM
+            branches
+        WHERE
+            previous_branch_id IS NULL
+        UNION ALL
+        SELECT
+            b.branch_id,
+            t.depth + 1,
+            CASE
+                WHEN b.paragraph IS NULL THEN NULL
+                WHEN t.story_prefix IS NULL THEN b.paragraph
+                ELSE t.story_prefix || E'\n\n' || b.paragraph
+            END
+        FROM
+            branches b
+            JOIN tree t ON b.previous_branch_id = t.branch_id
+    )
+UPDATE branches b
+SET
+    depth = tree.depth,
+    story_prefix = tree.story_prefix,
+    story_length = length(tree.story_prefix)
+FROM
+    tree
+WHERE
+    b.branch_id = tree.branch_id;
@@ -0,0 +1,24 @@
+-- A branch can only have one child per sentiment. Concurrent requests used
+-- to be able to insert duplicates, so first drop every duplicate that its
+-- parent doesn't point to (keeping the lowest id if it points to none).
+DELETE FROM branches b USING branches p
+WHERE
+    b.previous_branch_id = p.branch_id
+    AND b.sentiment IN ('positive', 'negative')
+    AND b.branch_id <> COALESCE(
+        CASE b.sentiment
+            WHEN 'positive' THEN p.positive_branch_id
+            ELSE p.negative_branch_id
+        END,
+        (
+            SELECT
+                min(d.branch_id)
+            FROM
+                branches d
+            WHERE
+                d.previous_branch_id = b.previous_branch_id
+                AND d.sentiment = b.sentiment
+        )
+    );
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_branches_previous_branch_sentiment ON branches (previous_branch_id, sentiment);
@@ -0,0 +1,6 @@
+-- Keep a rolling summary per branch so prompts only carry the most recent
+-- paragraphs verbatim. Existing branches start without one and descendants
+-- create it once their story outgrows the context budget.
+ALTER TABLE branches
+ADD COLUMN IF NOT EXISTS story_summary TEXT,
+ADD COLUMN IF NOT EXISTS summary_depth INTEGER NOT NULL DEFAULT 0;
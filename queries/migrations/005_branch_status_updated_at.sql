@@ -0,0 +1,7 @@
+-- Track when each branch last changed status, so branches left in
+-- generating-text or generating-audio by a crashed worker can be swept.
+ALTER TABLE branches
+ADD COLUMN IF NOT EXISTS status_updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS idx_branches_generating ON branches (status_updated_at)
+WHERE status IN ('generating-text', 'generating-audio');
@@ -0,0 +1,18 @@
+-- Pre-generated stories waiting to be handed out, by language and premise
+-- category. A story leaves the pool when it's handed out.
+ALTER TABLE stories
+ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS idx_stories_created_at ON stories (created_at);
+
+CREATE TABLE IF NOT EXISTS
+    starter_stories (
+        story_id TEXT NOT NULL,
+        lang TEXT NOT NULL,
+        category TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (story_id),
+        CONSTRAINT fk_starter_stories_story FOREIGN KEY (story_id) REFERENCES stories (story_id) ON DELETE CASCADE
+    );
+
+CREATE INDEX IF NOT EXISTS idx_starter_stories_pool ON starter_stories (lang, category, created_at);
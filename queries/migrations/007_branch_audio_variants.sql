@@ -0,0 +1,4 @@
+-- Blob names of extra renditions of each branch's audio, e.g. Opus for
+-- clients on slow links, by variant name. audio_url stays the main one.
+ALTER TABLE branches
+ADD COLUMN IF NOT EXISTS audio_variants JSONB NOT NULL DEFAULT '{}';
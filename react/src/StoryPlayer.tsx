@@ -10,7 +10,7 @@ import {
 } from "@radix-ui/react-icons"
 import { Button, Flex, Heading, IconButton, Text } from "@radix-ui/themes"
 import { useEffect, useReducer, useRef, useState } from "react"
-import { getBranch, type Branch, type Story } from "./api"
+import { getBranch, watchBranch, type Branch, type Story } from "./api"
 import toneSrc from "./audio/tone.mp3"
 
 interface StoryProps {
@@ -32,6 +32,7 @@ type State = {
 type Action =
     | { type: "SET_INITIAL_BRANCH"; branch: Branch }
     | { type: "SET_UPCOMING_BRANCH"; fromBranchId: string; branch: Branch }
+    | { type: "BRANCH_UPDATED"; branch: Branch }
     | { type: "TRANSITION_TO_NEXT_BRANCH"; fromBranchId: string }
     | { type: "SET_SENTIMENT"; sentiment: "positive" | "negative" | null }
     | { type: "GO_BACK" }
@@ -56,6 +57,12 @@ function reducer(state: State, action: Action): State {
                 return state
             }
             return { ...state, upcomingBranch: action.branch }
+        case "BRANCH_UPDATED":
+            return {
+                ...state,
+                currentBranch: state.currentBranch?.id === action.branch.id ? action.branch : state.currentBranch,
+                upcomingBranch: state.upcomingBranch?.id === action.branch.id ? action.branch : state.upcomingBranch,
+            }
         case "SET_SENTIMENT": {
             const newState: State = { ...state, sentiment: action.sentiment }
             if (!newState.hasAudioEnded) {
@@ -164,12 +171,28 @@ export default function StoryPlayer({ story, autoplay = false, autoContinue = tr
         fetchInitialBranch()
     }, [story.id, story.initial_branch_id])
 
+    // Branches arrive as soon as their text is written, so follow the ones
+    // still waiting for audio until it's ready.
+    const currentStoryId = state.currentBranch?.story_id
+    const currentBranchId = state.currentBranch?.id
+    const isCurrentBranchDone = state.currentBranch?.status === "done"
+    useEffect(() => {
+        if (!currentStoryId || !currentBranchId || isCurrentBranchDone) return
+        return watchBranch(currentStoryId, currentBranchId, branch => dispatch({ type: "BRANCH_UPDATED", branch }))
+    }, [currentStoryId, currentBranchId, isCurrentBranchDone])
+
     useEffect(() => {
         if (!state.currentBranch) return
         const audio = audioRef.current
         if (!audio) return
 
-        if (state.currentBranch.audio_url && state.currentBranch.audio_url !== audio.src) {
+        if (!state.currentBranch.audio_url) {
+            // Don't replay the previous branch while this one's audio is synthesized.
+            audio.pause()
+            audio.removeAttribute("src")
+            return
+        }
+        if (state.currentBranch.audio_url !== audio.src) {
             audio.src = state.currentBranch.audio_url
             audio.load()
         }
@@ -346,6 +369,7 @@ export default function StoryPlayer({ story, autoplay = false, autoContinue = tr
                 </Heading>
                 <Text>{story.description}</Text>
             </Flex>
+            {state.currentBranch?.paragraph && <Text size="4">{state.currentBranch.paragraph}</Text>}
             <Flex direction={{ initial: "column", sm: "row" }} gap="4">
                 {state.currentBranch?.final_branch ? (
                     <Button
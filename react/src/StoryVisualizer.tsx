@@ -1,7 +1,7 @@
 import { Flex } from "@radix-ui/themes"
 import * as d3 from "d3"
 import { useCallback, useEffect, useRef, useState } from "react"
-import { getBranch, type Story } from "./api"
+import { getTree, type Story } from "./api"
 
 interface Node extends d3.SimulationNodeDatum {
     id: string
@@ -19,12 +19,6 @@ interface StoryVisualizerProps {
     story: Story
 }
 
-type QueueItem = {
-    branchId: string
-    parentId: string | null
-    sentiment: "positive" | "negative" | "initial"
-}
-
 function StoryVisualizer({ story }: StoryVisualizerProps) {
     const svgRef = useRef<SVGSVGElement>(null)
     const audioRef = useRef<HTMLAudioElement>(null)
@@ -41,46 +35,27 @@ function StoryVisualizer({ story }: StoryVisualizerProps) {
     useEffect(() => {
         const fetchBranches = async () => {
             setIsLoading(true)
-            const queue: QueueItem[] = [{ branchId: story.initial_branch_id, parentId: null, sentiment: "initial" }]
-
-            while (queue.length > 0) {
-                const item = queue.shift()
-                if (!item) break
-                const { branchId, parentId, sentiment } = item
-                const branch = await getBranch(story.id, branchId)
-
-                const newNode: Node = { id: branch.id, audioURL: branch.audio_url, sentiment }
-                const newNodes: Node[] = [newNode]
+            try {
+                const tree = await getTree(story.id)
+                const newNodes: Node[] = tree.branches.map(branch => ({
+                    id: branch.id,
+                    audioURL: branch.audio_url,
+                    sentiment: branch.sentiment === "initial_branch" ? "initial" : branch.sentiment,
+                }))
                 const newLinks: Link[] = []
-
-                if (parentId && sentiment !== "initial") {
-                    const newLink: Link = {
-                        source: parentId,
-                        target: branch.id,
-                        sentiment: sentiment,
+                for (const branch of tree.branches) {
+                    if (branch.previous_branch_id && branch.sentiment !== "initial_branch") {
+                        newLinks.push({
+                            source: branch.previous_branch_id,
+                            target: branch.id,
+                            sentiment: branch.sentiment,
+                        })
                     }
-                    newLinks.push(newLink)
                 }
-
-                if (branch.positive_branch_id) {
-                    queue.push({
-                        branchId: branch.positive_branch_id,
-                        parentId: branch.id,
-                        sentiment: "positive",
-                    })
-                }
-                if (branch.negative_branch_id) {
-                    queue.push({
-                        branchId: branch.negative_branch_id,
-                        parentId: branch.id,
-                        sentiment: "negative",
-                    })
-                }
-
                 updateGraph(newNodes, newLinks)
+            } finally {
+                setIsLoading(false)
             }
-
-            setIsLoading(false)
         }
 
         fetchBranches()
@@ -16,14 +16,41 @@ export interface Branch {
     status: "new" | "generating-text" | "text-only" | "generating-audio" | "done" | "failed"
     sentiment: "initial_branch" | "positive" | "negative"
     audio_url: string | null
+    // Extra renditions of the audio by name, e.g. "opus".
+    audio_variants: Record<string, string>
     paragraph: string | null
     positive_branch_id: string
     negative_branch_id: string
     final_branch: boolean
 }
 
+export interface TreeBranch {
+    id: string
+    previous_branch_id: string | null
+    status: Branch["status"]
+    sentiment: Branch["sentiment"]
+    audio_url: string | null
+    positive_branch_id: string | null
+    negative_branch_id: string | null
+    final_branch: boolean
+    depth: number
+}
+
+export interface Tree {
+    story_id: string
+    root: string
+    branches: TreeBranch[]
+}
+
 const pendingBranchRequests: Record<string, Promise<Branch>> = {}
 
+// Branches are generated in the background, so poll until they have text.
+const BRANCH_POLL_INITIAL_DELAY_MS = 500
+const BRANCH_POLL_MAX_DELAY_MS = 3000
+const BRANCH_POLL_MAX_ATTEMPTS = 120
+// Lets the server hold each poll open until the branch has been generated.
+const BRANCH_POLL_WAIT_SECONDS = 20
+
 async function api<T>(endpoint: string, options: RequestInit = {}): Promise<T> {
     try {
         const url = `${API_BASE_URL}${endpoint}`
@@ -51,14 +78,44 @@ export async function createStory(initialPrompt: string): Promise<{ story: Story
     })
 }
 
+// Hands out a pre-generated story, so playback can start right away.
+export async function createStarterStory(
+    lang: string,
+    category?: string,
+): Promise<{ story: Story; initial_branch: Branch }> {
+    return api("/stories/starter", {
+        method: "POST",
+        body: JSON.stringify({ lang, category }),
+    })
+}
+
 export async function getStory(storyId: string): Promise<Story> {
     return api(`/stories/${storyId}/`)
 }
 
+// Fetches a whole subtree without triggering any generation.
+export async function getTree(storyId: string, root?: string, depth?: number): Promise<Tree> {
+    const params = new URLSearchParams()
+    if (root) params.set("root", root)
+    if (depth !== undefined) params.set("depth", String(depth))
+    const query = params.toString()
+    return api(`/stories/${storyId}/tree${query ? `?${query}` : ""}`)
+}
+
+// The audio of a branch and all of its ancestors, for playing a whole path
+// without gaps. The audiobook is a single file, the playlist is HLS.
+export function pathPlaylistUrl(storyId: string, branchId: string): string {
+    return `${API_BASE_URL}/stories/${storyId}/branches/${branchId}/playlist.m3u8`
+}
+
+export function pathAudiobookUrl(storyId: string, branchId: string): string {
+    return `${API_BASE_URL}/stories/${storyId}/branches/${branchId}/audiobook`
+}
+
 export async function getBranch(storyId: string, branchId: string): Promise<Branch> {
     const key = `${storyId}:${branchId}`
     if (!pendingBranchRequests[key]) {
-        pendingBranchRequests[key] = api(`/stories/${storyId}/branches/${branchId}/`)
+        pendingBranchRequests[key] = pollBranch(storyId, branchId)
         pendingBranchRequests[key].finally(() => {
             delete pendingBranchRequests[key]
         })
@@ -66,6 +123,28 @@ export async function getBranch(storyId: string, branchId: string): Promise<Bran
     return pendingBranchRequests[key]
 }
 
+// The paragraph can be shown as soon as it has been written, while its audio
+// is still being synthesized. Follow watchBranch for the audio.
+function hasBranchText(branch: Branch): boolean {
+    if (!["text-only", "generating-audio", "done"].includes(branch.status)) return false
+    return branch.final_branch || Boolean(branch.positive_branch_id && branch.negative_branch_id)
+}
+
+async function pollBranch(storyId: string, branchId: string): Promise<Branch> {
+    let delay = BRANCH_POLL_INITIAL_DELAY_MS
+    for (let attempt = 0; attempt < BRANCH_POLL_MAX_ATTEMPTS; attempt++) {
+        const branch = await api<Branch>(
+            `/stories/${storyId}/branches/${branchId}/?wait=${BRANCH_POLL_WAIT_SECONDS}`,
+        )
+        if (hasBranchText(branch)) {
+            return branch
+        }
+        await new Promise(resolve => setTimeout(resolve, delay))
+        delay = Math.min(delay * 1.5, BRANCH_POLL_MAX_DELAY_MS)
+    }
+    throw new Error(`Branch ${branchId} was not generated in time`)
+}
+
 export async function generateBranch(
     storyId: string,
     branchId: string,
@@ -83,3 +162,45 @@ export async function generateBranch(
     }
     return pendingBranchRequests[key]
 }
+
+// Calls onBranch every time the branch changes status, from "text-only" when
+// the paragraph can be shown to "done" once the audio is ready. Returns a
+// function that closes the stream.
+export function watchBranch(storyId: string, branchId: string, onBranch: (branch: Branch) => void): () => void {
+    const source = new EventSource(`${API_BASE_URL}/stories/${storyId}/branches/${branchId}/events`)
+    source.addEventListener("branch", event => {
+        const branch: Branch = JSON.parse(event.data)
+        onBranch(branch)
+        if (branch.status === "done" || branch.status === "failed") source.close()
+    })
+    return () => source.close()
+}
+
+export interface BranchStreamHandlers {
+    onToken?: (text: string) => void
+    onAudio?: (chunk: Uint8Array) => void
+    onBranch?: (branch: Branch) => void
+    onError?: (message: string) => void
+}
+
+// Streams a branch as it is generated. Returns a function that closes the stream.
+export function streamBranch(storyId: string, branchId: string, handlers: BranchStreamHandlers): () => void {
+    const source = new EventSource(`${API_BASE_URL}/stories/${storyId}/branches/${branchId}/stream`)
+    source.addEventListener("token", event => {
+        handlers.onToken?.(JSON.parse(event.data).text)
+    })
+    source.addEventListener("audio", event => {
+        const data = atob(JSON.parse(event.data).data)
+        handlers.onAudio?.(Uint8Array.from(data, c => c.charCodeAt(0)))
+    })
+    source.addEventListener("branch", event => {
+        handlers.onBranch?.(JSON.parse(event.data))
+        source.close()
+    })
+    source.addEventListener("error", event => {
+        const message = event instanceof MessageEvent ? JSON.parse(event.data).message : "Stream closed"
+        handlers.onError?.(message)
+        source.close()
+    })
+    return () => source.close()
+}
@@ -0,0 +1,48 @@
+import asyncio
+
+from pocketpal.cache import LRUCache, MemoryStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    evicted = []
+    cache = LRUCache(2, on_evict=evicted.append)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert evicted == [2]
+    assert "b" not in cache
+    assert cache.get("a") == 1
+
+
+def test_expired_entries_are_evicted():
+    clock = Clock()
+    evicted = []
+    cache = LRUCache(2, ttl=10, clock=clock, on_evict=evicted.append)
+    cache.set("a", 1)
+    clock.now = 10
+    assert cache.get("a") is None
+    assert evicted == [1]
+
+
+def test_memory_store_values_expire():
+    async def main():
+        clock = Clock()
+        store = MemoryStore(clock)
+        await store.set("short", "value", ttl=10)
+        await store.set("long", "value")
+        clock.now = 10
+        assert await store.get("short") is None
+        assert await store.get("long") == "value"
+        await store.delete("long")
+        assert await store.get("long") is None
+
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from pocketpal.gateway import (
+    CircuitBreaker,
+    CircuitOpenError,
+    Gateway,
+    PrioritySemaphore,
+)
+from pocketpal.jobs import PRIORITY_SPECULATIVE, PRIORITY_USER
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def fail():
+    raise RuntimeError("provider down")
+
+
+def open_gateway(clock):
+    gateway = Gateway("test", retries=0, failure_threshold=1, reset_seconds=10)
+    gateway.breakers["key"] = CircuitBreaker(1, 10, clock)
+    return gateway
+
+
+def test_cancelled_trial_call_lets_the_next_call_try():
+    async def main():
+        clock = Clock()
+        gateway = open_gateway(clock)
+        with pytest.raises(RuntimeError):
+            await gateway.call(fail, key="key")
+        with pytest.raises(CircuitOpenError):
+            await gateway.call(fail, key="key")
+
+        clock.now = 10
+        trial = asyncio.create_task(gateway.call(lambda: asyncio.sleep(60), key="key"))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        assert await gateway.call(lambda: asyncio.sleep(0, "ok"), key="key") == "ok"
+        assert not gateway.breakers["key"].is_open
+
+    asyncio.run(main())
+
+
+def test_trial_cancelled_while_waiting_for_a_slot_lets_the_next_call_try():
+    async def main():
+        clock = Clock()
+        gateway = open_gateway(clock)
+        gateway.semaphore = PrioritySemaphore(1)
+        with pytest.raises(RuntimeError):
+            await gateway.call(fail, key="key")
+
+        # Another key holds the only slot, so the trial waits for it.
+        release = asyncio.Event()
+        busy = asyncio.create_task(gateway.call(release.wait, key="other"))
+        await asyncio.sleep(0)
+        clock.now = 10
+        trial = asyncio.create_task(gateway.call(lambda: asyncio.sleep(0), key="key"))
+        await asyncio.sleep(0)
+        assert gateway.breakers["key"].trial
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        release.set()
+        await busy
+        assert await gateway.call(lambda: asyncio.sleep(0, "ok"), key="key") == "ok"
+
+    asyncio.run(main())
+
+
+def test_cancelled_trial_stream_lets_the_next_call_try():
+    async def main():
+        clock = Clock()
+        gateway = open_gateway(clock)
+        with pytest.raises(RuntimeError):
+            await gateway.call(fail, key="key")
+
+        async def slow_stream():
+            await asyncio.sleep(60)
+            yield "never"
+
+        async def consume():
+            async for _ in gateway.stream(slow_stream, key="key"):
+                pass
+
+        clock.now = 10
+        trial = asyncio.create_task(consume())
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        assert await gateway.call(lambda: asyncio.sleep(0, "ok"), key="key") == "ok"
+
+    asyncio.run(main())
+
+
+def test_half_open_breaker_allows_a_single_trial():
+    clock = Clock()
+    breaker = CircuitBreaker(2, 10, clock)
+    breaker.record(False)
+    breaker.check()
+    breaker.record(False)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    clock.now = 10
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record(True)
+    breaker.check()
+    assert not breaker.is_open
+
+
+def test_reserved_slots_are_kept_for_user_calls():
+    async def main():
+        semaphore = PrioritySemaphore(2, reserved=1)
+        await semaphore.acquire(PRIORITY_SPECULATIVE)
+        speculative = asyncio.create_task(semaphore.acquire(PRIORITY_SPECULATIVE))
+        await asyncio.sleep(0)
+        assert not speculative.done()
+
+        await asyncio.wait_for(semaphore.acquire(PRIORITY_USER), 1)
+        semaphore.release()
+        semaphore.release()
+        await asyncio.wait_for(speculative, 1)
+
+    asyncio.run(main())
+
+
+def test_user_calls_are_woken_first():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        order = []
+
+        async def acquire(priority):
+            await semaphore.acquire(priority)
+            order.append(priority)
+            semaphore.release()
+
+        waiters = [
+            asyncio.create_task(acquire(PRIORITY_SPECULATIVE)),
+            asyncio.create_task(acquire(PRIORITY_USER)),
+        ]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*waiters)
+        assert order == [PRIORITY_USER, PRIORITY_SPECULATIVE]
+
+    asyncio.run(main())
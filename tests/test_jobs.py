@@ -0,0 +1,85 @@
+import asyncio
+
+from pocketpal import jobs
+from pocketpal.jobs import GenerationQueue, MemoryJobStore, PRIORITY_USER
+
+
+def test_user_jobs_run_before_speculative_ones():
+    async def main():
+        ran = []
+
+        async def handler(job):
+            ran.append(job.branch_id)
+
+        queue = GenerationQueue(handler, MemoryJobStore(), workers=1)
+        await queue.enqueue("story", "speculative")
+        await queue.enqueue("story", "user", PRIORITY_USER)
+        await queue.start()
+        assert await queue.wait("speculative", 1)
+        await queue.stop()
+        assert ran == ["user", "speculative"]
+
+    asyncio.run(main())
+
+
+def test_worker_survives_a_job_cancelled_from_elsewhere():
+    async def main():
+        ran = []
+
+        async def handler(job):
+            ran.append(job.branch_id)
+            if job.branch_id == "first":
+                other = asyncio.create_task(asyncio.sleep(60))
+                other.cancel()
+                await other
+
+        store = MemoryJobStore()
+        queue = GenerationQueue(handler, store, workers=1)
+        await queue.start()
+        await queue.enqueue("story", "first")
+        await queue.enqueue("story", "second")
+        assert await queue.wait("second", 1)
+        await queue.stop()
+        assert ran == ["first", "second"]
+        assert store.jobs["first"].status == "failed"
+        assert store.jobs["second"].status == "done"
+
+    asyncio.run(main())
+
+
+def test_stopped_jobs_stay_queued():
+    async def main():
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        store = MemoryJobStore()
+        queue = GenerationQueue(handler, store, workers=1)
+        await queue.start()
+        await queue.enqueue("story", "branch")
+        await started.wait()
+        await queue.stop(timeout=0.01)
+        assert store.jobs["branch"].status == "queued"
+
+    asyncio.run(main())
+
+
+def test_finished_jobs_are_pruned_after_their_retention(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETENTION_SECONDS", 0)
+
+    async def main():
+        async def handler(job):
+            pass
+
+        store = MemoryJobStore()
+        queue = GenerationQueue(handler, store, workers=1)
+        await queue.start()
+        await queue.enqueue("story", "branch")
+        assert await queue.wait("branch", 1)
+        await asyncio.sleep(0)
+        await queue.stop()
+        assert "branch" not in store.jobs
+
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from pocketpal.singleflight import SingleFlight
+
+
+def test_waiters_share_the_result():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", fn) for _ in range(3)))
+        assert results == ["result"] * 3
+        assert len(calls) == 1
+        assert "key" not in flight
+
+    asyncio.run(main())
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return object()
+
+        async def caller(delay):
+            # Callers keep arriving while the call is in flight.
+            await asyncio.sleep(delay)
+            return await flight.do("key", fn)
+
+        callers = [asyncio.create_task(caller(i % 5 * 0.001)) for i in range(100)]
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*callers)
+        assert calls == 1
+        assert all(result is results[0] for result in results)
+        assert "key" not in flight
+
+    asyncio.run(main())
+
+
+def test_concurrent_callers_of_different_keys_each_make_the_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fn(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        results = await asyncio.gather(
+            *(flight.do(i % 3, lambda i=i: fn(i % 3)) for i in range(30))
+        )
+        assert sorted(calls) == [0, 1, 2]
+        assert results == [i % 3 for i in range(30)]
+
+    asyncio.run(main())
+
+
+def test_waiters_share_the_exception():
+    async def main():
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("failed")
+
+        results = await asyncio.gather(
+            *(flight.do("key", fn) for _ in range(2)), return_exceptions=True
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(main())
+
+
+def test_cancelled_owner_hands_the_call_to_a_waiter():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        owner = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        assert await waiter == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_call_running():
+    async def main():
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        owner = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert await owner == "result"
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from pocketpal.storage import LocalStorage  # noqa: E402
+
+
+def test_blob_chunks_are_views_of_the_mapping(tmp_path):
+    async def main():
+        storage = LocalStorage(str(tmp_path))
+        await storage.put("blob.mp3", b"x" * 100_000)
+        blob = await storage.open("blob.mp3")
+        chunks = [chunk async for chunk in blob.chunks(10, 90_000)]
+        assert all(isinstance(chunk, memoryview) for chunk in chunks)
+        assert b"".join(chunks) == b"x" * 89_990
+
+    asyncio.run(main())
+
+
+def test_evicted_blobs_are_unmapped(tmp_path):
+    async def main():
+        storage = LocalStorage(str(tmp_path), mmap_files=1)
+        await storage.put("first.mp3", b"first")
+        await storage.put("second.mp3", b"second")
+        first = await storage.open("first.mp3")
+        await storage.open("second.mp3")
+        assert first.data.closed
+
+    asyncio.run(main())
+
+
+def test_blobs_being_sent_stay_mapped_when_evicted(tmp_path):
+    async def main():
+        storage = LocalStorage(str(tmp_path), mmap_files=1)
+        await storage.put("first.mp3", b"first")
+        await storage.put("second.mp3", b"second")
+        first = await storage.open("first.mp3")
+        chunks = first.chunks(0, first.size)
+        chunk = await chunks.__anext__()
+        await storage.open("second.mp3")
+        assert not first.data.closed
+        assert bytes(chunk) == b"first"
+
+    asyncio.run(main())
@@ -0,0 +1,18 @@
+import time
+
+from pocketpal.utils import new_id
+
+
+def test_new_ids_sort_by_creation_time():
+    ids = []
+    for _ in range(3):
+        ids.append(new_id())
+        time.sleep(0.002)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_new_ids_start_with_the_prefix():
+    branch_id = new_id("ab")
+    assert branch_id.startswith("ab")
+    assert len(branch_id) == 18